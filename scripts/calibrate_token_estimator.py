@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Token Estimator Calibration Script
+
+Fit the tiktoken-backed token estimator families (cl100k, o200k) against the
+real tokenizers on the course material, and print the measured coefficients
+and maximum relative error for TOKEN_ESTIMATOR_FAMILIES in utils/llm_helpers.py.
+"""
+
+from pathlib import Path
+import json
+import sys
+import argparse
+from typing import List
+
+# Allow running from anywhere without installing the project
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# One representative model per family
+FAMILY_MODELS = {"cl100k": "gpt-4", "o200k": "gpt-4o"}
+
+
+def collect_samples(root: Path, max_samples: int = 2000) -> List[str]:
+    """Collect paragraphs from Markdown files and notebook cells under root."""
+    samples = []
+
+    for path in sorted(root.rglob("*.md")) + sorted(root.rglob("*.ipynb")):
+        if any(part.startswith(".") for part in path.parts):
+            continue
+        try:
+            if path.suffix == ".ipynb":
+                with open(path, "r", encoding="utf-8") as f:
+                    cells = json.load(f).get("cells", [])
+                texts = ["".join(cell.get("source", [])) for cell in cells]
+            else:
+                texts = path.read_text(encoding="utf-8").split("\n\n")
+        except (OSError, ValueError):
+            continue
+
+        samples.extend(text for text in texts if text.strip())
+
+    # Spread the sample over the whole corpus
+    step = max(1, len(samples) // max_samples)
+    return samples[::step][:max_samples]
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(
+        description="Calibrate the token estimator against tiktoken"
+    )
+    parser.add_argument(
+        "--dir", type=str, default=".", help="Directory with sample text"
+    )
+    parser.add_argument(
+        "--families",
+        type=str,
+        nargs="+",
+        default=list(FAMILY_MODELS),
+        choices=list(FAMILY_MODELS),
+        help="Tokenizer families to calibrate",
+    )
+    parser.add_argument(
+        "--max-samples", type=int, default=2000, help="Maximum sample texts"
+    )
+
+    args = parser.parse_args()
+
+    from utils.llm_helpers import calibrate_token_estimator
+
+    samples = collect_samples(Path(args.dir), args.max_samples)
+    if not samples:
+        print(f"✗ No sample text found under {args.dir}")
+        sys.exit(1)
+
+    print(f"Calibrating on {len(samples)} samples\n")
+
+    for family in args.families:
+        try:
+            fit = calibrate_token_estimator(samples, FAMILY_MODELS[family])
+        except Exception as e:
+            print(f"✗ {family}: {str(e)}")
+            sys.exit(1)
+
+        print(
+            f"✓ {family}: coefficients={fit['coefficients']}, "
+            f"max relative error={fit['max_error']:.1%}"
+        )
+        print(
+            f'    "{family}": {{"coefficients": {fit["coefficients"]}, '
+            f'"error": {fit["max_error"]}, "measured": True, ...}}'
+        )
+
+
+if __name__ == "__main__":
+    main()
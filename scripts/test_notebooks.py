@@ -8,18 +8,40 @@ Automatically test that all Jupyter notebooks execute without errors.
 import nbformat
 from nbconvert.preprocessors import ExecutePreprocessor
 from pathlib import Path
+import json
+import os
 import sys
 import argparse
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
-def test_notebook(notebook_path: Path, timeout: int = 600) -> Dict:
+def read_cassette_misses(cassette: Path) -> List[Dict]:
+    """Read the provider calls a notebook kernel could not find in its cassette."""
+    misses_path = Path(f"{cassette}.misses.jsonl")
+    if not misses_path.exists():
+        return []
+
+    with open(misses_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_notebook(
+    notebook_path: Path,
+    timeout: int = 600,
+    cassette_dir: Optional[Path] = None,
+    cassette_mode: str = "replay",
+) -> Dict:
     """
     Test a single notebook by executing all cells.
 
+    With ``cassette_dir`` set, LLM provider calls made by the notebook are
+    recorded to / replayed from ``<cassette_dir>/<notebook>.jsonl.gz``.
+
     Args:
         notebook_path: Path to the notebook
         timeout: Execution timeout in seconds
+        cassette_dir: Directory holding per-notebook cassettes
+        cassette_mode: "replay", "auto" or "record"
 
     Returns:
         Dict with test results
@@ -30,8 +52,18 @@ def test_notebook(notebook_path: Path, timeout: int = 600) -> Dict:
         "success": False,
         "error": None,
         "cells_executed": 0,
+        "cassette_misses": [],
     }
 
+    cassette = None
+    previous_env = {k: os.environ.get(k) for k in ("LLM_CASSETTE", "LLM_CASSETTE_MODE")}
+    if cassette_dir is not None:
+        cassette = cassette_dir / f"{notebook_path.stem}.jsonl.gz"
+        Path(f"{cassette}.misses.jsonl").unlink(missing_ok=True)
+        # The kernel inherits these and records/replays every provider call
+        os.environ["LLM_CASSETTE"] = str(cassette.resolve())
+        os.environ["LLM_CASSETTE_MODE"] = cassette_mode
+
     try:
         with open(notebook_path, "r", encoding="utf-8") as f:
             nb = nbformat.read(f, as_version=4)
@@ -47,11 +79,30 @@ def test_notebook(notebook_path: Path, timeout: int = 600) -> Dict:
     except Exception as e:
         result["error"] = str(e)
 
+    finally:
+        for key, value in previous_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    if cassette is not None:
+        result["cassette_misses"] = read_cassette_misses(cassette)
+        if result["cassette_misses"] and result["success"]:
+            result["success"] = False
+            result[
+                "error"
+            ] = f"{len(result['cassette_misses'])} LLM call(s) missing from {cassette}"
+
     return result
 
 
 def test_all_notebooks(
-    notebooks_dir: Path, pattern: str = "*.ipynb", exclude: List[str] = None
+    notebooks_dir: Path,
+    pattern: str = "*.ipynb",
+    exclude: List[str] = None,
+    cassette_dir: Optional[Path] = None,
+    cassette_mode: str = "replay",
 ) -> List[Dict]:
     """
     Test all notebooks in a directory.
@@ -60,6 +111,8 @@ def test_all_notebooks(
         notebooks_dir: Directory containing notebooks
         pattern: Glob pattern for notebook files
         exclude: List of notebook names to exclude
+        cassette_dir: Directory holding per-notebook cassettes (None = live calls)
+        cassette_mode: "replay", "auto" or "record"
 
     Returns:
         List of test results
@@ -78,7 +131,9 @@ def test_all_notebooks(
     for i, notebook_path in enumerate(notebooks, 1):
         print(f"[{i}/{total}] Testing {notebook_path.name}...", end=" ")
 
-        result = test_notebook(notebook_path)
+        result = test_notebook(
+            notebook_path, cassette_dir=cassette_dir, cassette_mode=cassette_mode
+        )
 
         if result["success"]:
             print("✓ PASSED")
@@ -111,6 +166,8 @@ def print_summary(results: List[Dict]):
             if not r["success"]:
                 print(f"  - {r['notebook']}")
                 print(f"    Error: {r['error'][:100]}...")
+                for miss in r.get("cassette_misses", [])[:5]:
+                    print(f"    Cassette miss: {miss['op']} {miss['arguments']}")
 
     print("=" * 60)
 
@@ -129,6 +186,20 @@ def main():
     parser.add_argument(
         "--exclude", type=str, nargs="+", help="Notebook names to exclude"
     )
+    parser.add_argument(
+        "--cassette-dir",
+        type=str,
+        default=None,
+        help="Replay LLM calls from per-notebook cassettes in this directory",
+    )
+    parser.add_argument(
+        "--cassette-mode",
+        type=str,
+        default="replay",
+        choices=["replay", "auto", "record"],
+        help="replay: fail on unrecorded calls; auto: record missing calls; "
+        "record: re-record everything",
+    )
 
     args = parser.parse_args()
 
@@ -142,8 +213,14 @@ def main():
         sys.exit(1)
 
     # Run tests
+    cassette_dir = repo_root / args.cassette_dir if args.cassette_dir else None
+
     results = test_all_notebooks(
-        notebooks_dir, pattern=args.pattern, exclude=args.exclude or []
+        notebooks_dir,
+        pattern=args.pattern,
+        exclude=args.exclude or [],
+        cassette_dir=cassette_dir,
+        cassette_mode=args.cassette_mode,
     )
 
     # Print summary
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+tiktoken Cache Warm-up Script
+
+Pre-seed the tiktoken encoding cache so token counting works offline, e.g.
+in the Docker image or an air-gapped classroom environment.
+"""
+
+from pathlib import Path
+import os
+import sys
+import argparse
+
+# Allow running from anywhere without installing the project
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(description="Warm the tiktoken encoding cache")
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Cache directory (default: TIKTOKEN_CACHE_DIR or data/tiktoken_cache)",
+    )
+    parser.add_argument(
+        "--encodings",
+        type=str,
+        nargs="+",
+        default=["cl100k_base", "o200k_base"],
+        help="Encodings to cache",
+    )
+    parser.add_argument(
+        "--source-dir",
+        type=str,
+        help="Directory with pre-downloaded <encoding>.tiktoken files to seed from",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only verify the encodings load from the cache (no downloads)",
+    )
+
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        os.environ["TIKTOKEN_CACHE_DIR"] = os.path.abspath(args.cache_dir)
+    if args.check:
+        os.environ["TIKTOKEN_OFFLINE"] = "1"
+
+    from utils.llm_helpers import warm_tiktoken_cache
+
+    try:
+        cached = warm_tiktoken_cache(args.encodings, source_dir=args.source_dir)
+    except Exception as e:
+        print(f"✗ Error warming tiktoken cache: {str(e)}")
+        sys.exit(1)
+
+    for name, path in cached.items():
+        print(f"✓ {name}: {path}")
+
+
+if __name__ == "__main__":
+    main()
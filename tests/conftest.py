@@ -0,0 +1,30 @@
+"""Shared pytest setup."""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+# data_helpers annotates with pd.io.formats.style.Styler, which pandas only
+# exposes once the module has been imported
+import pandas.io.formats.style  # noqa: F401
+
+# Allow `import utils` without installing the project
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    """Count one token per UTF-8 byte, so tokenizer tests need no BPE download."""
+    import tiktoken
+
+    from utils import llm_helpers
+
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(llm_helpers, "_get_encoding", lambda name: encoding)
+    return encoding
@@ -0,0 +1,59 @@
+"""Tests for the local batch executor."""
+
+from utils.batch_helpers import LocalBatchExecutor, run_batch_job, write_batch_file
+from utils.llm_helpers import LLM_PROVIDERS, register_llm_provider
+
+
+def _run(tmp_path, prompts, executor):
+    return run_batch_job(
+        prompts, model="gpt-4", executor=executor, work_dir=tmp_path, poll_interval=0
+    )
+
+
+def test_mock_provider_completes_every_request(tmp_path, byte_encoding):
+    executor = LocalBatchExecutor(work_dir=tmp_path / "batches", provider="mock")
+    results = _run(tmp_path, {"q1": "Explain AI", "q2": "Explain ML"}, executor)
+
+    assert set(results) == {"q1", "q2"}
+    assert all(text and not text.startswith("Error") for text in results.values())
+
+
+def test_failing_responder_counts_as_failed(tmp_path):
+    def respond(body):
+        prompt = body["messages"][-1]["content"]
+        if prompt == "bad":
+            raise ValueError("boom")
+        return prompt.upper()
+
+    executor = LocalBatchExecutor(work_dir=tmp_path / "batches", respond=respond)
+    batch_id = executor.submit(
+        _input_file(tmp_path, executor, {"ok": "fine", "ko": "bad"})
+    )
+    info = executor.status(batch_id)
+
+    assert info["request_counts"] == {"total": 2, "completed": 1, "failed": 1}
+
+    results = _run(tmp_path, {"ok": "fine", "ko": "bad"}, executor)
+    assert results == {"ok": "FINE", "ko": "Error: boom"}
+
+
+def test_call_llm_error_strings_count_as_failed(tmp_path):
+    register_llm_provider(
+        "down", lambda prompt, model=None, **kwargs: "Error calling down: refused"
+    )
+    try:
+        executor = LocalBatchExecutor(work_dir=tmp_path / "batches", provider="down")
+        batch_id = executor.submit(
+            _input_file(tmp_path, executor, {"q1": "Explain AI"})
+        )
+        info = executor.status(batch_id)
+    finally:
+        LLM_PROVIDERS.pop("down")
+
+    assert info["request_counts"] == {"total": 1, "completed": 0, "failed": 1}
+
+
+def _input_file(tmp_path, executor, prompts):
+    return write_batch_file(
+        prompts, tmp_path / "input.jsonl", "gpt-4", executor.endpoint
+    )
@@ -0,0 +1,69 @@
+"""Tests for corpus-level BLEU and its smoothing methods."""
+
+import math
+
+import pytest
+
+from utils.evaluation_helpers import calculate_bleu, corpus_bleu
+
+REFERENCE = "the cat sat on the mat"
+CANDIDATE = "the cat sat on a mat"
+
+
+def test_sentence_bleu_matches_the_formula():
+    # Precisions 5/6, 3/5, 2/4, 1/3 and no brevity penalty
+    expected = (5 / 6 * 3 / 5 * 2 / 4 * 1 / 3) ** 0.25
+
+    assert calculate_bleu(REFERENCE, CANDIDATE) == pytest.approx(expected)
+    assert corpus_bleu([REFERENCE], [REFERENCE])["bleu"] == pytest.approx(1.0)
+
+
+def test_corpus_bleu_pools_statistics_instead_of_averaging():
+    references = [REFERENCE, "a b c d e f"]
+    candidates = [CANDIDATE, "a b c d e f"]
+
+    result = corpus_bleu(references, candidates)
+
+    assert result["precisions"] == pytest.approx([11 / 12, 8 / 10, 6 / 8, 4 / 6])
+    mean_sentence = (calculate_bleu(references[0], candidates[0]) + 1.0) / 2
+    assert result["bleu"] != pytest.approx(mean_sentence)
+
+
+def test_multiple_references_clip_to_the_best_single_reference():
+    result = corpus_bleu([["the cat", "the the mat"]], ["the the the"], n=1)
+
+    assert result["precisions"] == [2 / 3]
+
+
+def test_brevity_penalty_uses_the_closest_reference_length():
+    result = corpus_bleu([["a b c d e f g h", "a b c d"]], ["a b c"], n=1)
+
+    assert result["reference_length"] == 4
+    assert result["brevity_penalty"] == pytest.approx(math.exp(1 - 4 / 3))
+
+
+def test_smoothing_rescues_missing_higher_order_matches():
+    # Three-word candidate: no 4-grams at all, and no matching trigram
+    reference, candidate = "the cat sat down", "the cat ran"
+
+    assert corpus_bleu([reference], [candidate])["bleu"] == 0.0
+
+    floor = corpus_bleu([reference], [candidate], smoothing="floor")
+    # Effective order: 2/3, 1/2 and the 0.1 floor over one trigram
+    assert floor["bleu"] == pytest.approx(
+        math.exp(1 - 4 / 3) * (2 / 3 * 1 / 2 * 0.1) ** (1 / 3)
+    )
+
+    add_k = corpus_bleu([reference], [candidate], smoothing="add-k")
+    assert add_k["precisions"][1:3] == pytest.approx([2 / 3, 1 / 2])
+
+    exp = corpus_bleu([reference], [candidate], smoothing="exp")
+    assert exp["precisions"][2] == pytest.approx(0.5)
+    assert 0 < exp["bleu"] < 1
+
+
+def test_bad_arguments_raise():
+    with pytest.raises(ValueError):
+        corpus_bleu([REFERENCE], [CANDIDATE], smoothing="magic")
+    with pytest.raises(ValueError):
+        corpus_bleu([REFERENCE], [CANDIDATE, CANDIDATE])
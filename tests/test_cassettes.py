@@ -0,0 +1,118 @@
+"""Tests for cassette record/replay of streamed provider calls."""
+
+import json
+
+import pytest
+
+import requests
+from utils.cassette_helpers import recordable, use_cassette
+from utils.llm_helpers import stop_on_sections, stream_local_llm
+
+CHUNKS = ["## A\n", "x\n", "## B\n", "y\n", "## C\n", "z\n"]
+
+
+class FakeStreamResponse:
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for chunk in CHUNKS:
+            yield json.dumps({"response": chunk}).encode("utf-8")
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def live_calls(monkeypatch):
+    calls = []
+
+    def fake_post(url, **kwargs):
+        calls.append(kwargs["json"]["prompt"])
+        return FakeStreamResponse()
+
+    monkeypatch.setattr(requests, "post", fake_post)
+    return calls
+
+
+def stream(prompt, stop_when=None):
+    stats = {}
+    text = "".join(stream_local_llm(prompt, stop_when=stop_when, stats=stats))
+    return text, stats
+
+
+def test_replay_reapplies_the_callers_predicate(tmp_path, live_calls):
+    path = str(tmp_path / "cassette.jsonl")
+
+    with use_cassette(path, mode="auto"):
+        recorded, _ = stream("Outline", stop_on_sections(1))
+    assert recorded == "## A\nx\n## B\n"
+    assert len(live_calls) == 1
+
+    with use_cassette(path, mode="replay") as cassette:
+        text, stats = stream("Outline", stop_on_sections(1))
+    assert text == recorded
+    assert stats == {"output_tokens": 3, "stopped_early": True, "tokens_saved": 0}
+    assert cassette.misses == []
+    assert len(live_calls) == 1
+
+
+def test_reading_past_a_partial_recording_is_a_miss(tmp_path, live_calls):
+    path = str(tmp_path / "cassette.jsonl")
+
+    with use_cassette(path, mode="auto"):
+        stream("Outline", stop_on_sections(1))
+
+    with use_cassette(path, mode="replay") as cassette:
+        text, _ = stream("Outline", stop_on_sections(3))
+    assert "Error" in text
+    assert len(cassette.misses) == 1
+    assert "ends after 3 chunks" in cassette.misses[0]["reason"]
+    assert len(live_calls) == 1
+
+
+def test_auto_mode_completes_a_partial_recording(tmp_path, live_calls):
+    path = str(tmp_path / "cassette.jsonl")
+
+    with use_cassette(path, mode="auto"):
+        stream("Outline", stop_on_sections(1))
+        text, stats = stream("Outline")
+    assert text == "".join(CHUNKS)
+    assert stats["output_tokens"] == len(CHUNKS)
+    assert len(live_calls) == 2
+
+    # The complete recording now serves any predicate, including none
+    with use_cassette(path, mode="replay") as cassette:
+        full, _ = stream("Outline")
+        cut, stats = stream("Outline", stop_on_sections(2))
+    assert full == "".join(CHUNKS)
+    assert cut == "## A\nx\n## B\ny\n## C\n"
+    assert stats["stopped_early"] is True
+    assert cassette.misses == []
+    assert len(live_calls) == 2
+
+
+def test_completions_that_start_with_error_are_recorded(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    calls = []
+
+    @recordable("explain")
+    def explain(topic):
+        calls.append(topic)
+        if topic == "down":
+            return "Error calling OpenAI: connection refused"
+        return f"Error handling in {topic} uses try/except blocks."
+
+    with use_cassette(path, mode="auto"):
+        explain("Python")
+        explain("down")
+
+    with use_cassette(path, mode="replay") as cassette:
+        text = explain("Python")
+    assert text == "Error handling in Python uses try/except blocks."
+    assert cassette.misses == []
+    assert calls == ["Python", "down"]
+
+    with use_cassette(path, mode="auto"):
+        explain("down")
+    assert calls == ["Python", "down", "down"]
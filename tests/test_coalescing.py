@@ -0,0 +1,64 @@
+"""Tests for single-flight coalescing of identical call_llm requests."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.llm_helpers import (
+    LLM_PROVIDERS,
+    call_llm,
+    get_coalescing_stats,
+    register_llm_provider,
+    reset_coalescing_stats,
+)
+
+
+def test_identical_concurrent_requests_share_one_upstream_call():
+    calls = []
+    lock = threading.Lock()
+
+    def provider(prompt, model=None, **kwargs):
+        with lock:
+            calls.append(prompt)
+        # Keep the first request in flight while the others arrive
+        time.sleep(0.2)
+        return f"answer to {prompt}"
+
+    register_llm_provider("slow", provider)
+    reset_coalescing_stats()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(
+                pool.map(
+                    lambda _: call_llm("Q?", provider="slow", temperature=0), range(8)
+                )
+            )
+        # A different request is not merged with the others
+        other = call_llm("Other?", provider="slow", temperature=0)
+    finally:
+        LLM_PROVIDERS.pop("slow")
+
+    assert results == ["answer to Q?"] * 8
+    assert other == "answer to Other?"
+    assert calls == ["Q?", "Other?"]
+    assert get_coalescing_stats() == {"upstream_calls": 2, "coalesced_calls": 7}
+
+
+def test_sampling_temperatures_are_not_coalesced_by_default():
+    calls = []
+
+    register_llm_provider(
+        "plain", lambda prompt, model=None, **kwargs: calls.append(1) or "x"
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(
+                pool.map(
+                    lambda _: call_llm("Q?", provider="plain", temperature=0.7),
+                    range(4),
+                )
+            )
+    finally:
+        LLM_PROVIDERS.pop("plain")
+
+    assert len(calls) == 4
@@ -0,0 +1,36 @@
+"""Tests for parallel corpus token counting."""
+
+from utils import llm_helpers
+from utils.llm_helpers import count_tokens_corpus
+
+
+def test_counts_follow_input_order_and_skip_missing(byte_encoding):
+    result = count_tokens_corpus(["abc", None, "héllo", float("nan")], max_workers=1)
+
+    assert result["counts"] == [3, 0, 6, 0]
+    assert result["total"] == 9
+    assert result["max_tokens"] == 6
+    assert result["estimated"] is False
+
+
+def test_files_are_counted_block_by_block(tmp_path, byte_encoding, monkeypatch):
+    monkeypatch.setattr(llm_helpers, "_CORPUS_BLOCK_CHARS", 16)
+    text = "".join(f"line {i}: some words\n  indented\n" for i in range(50))
+    path = tmp_path / "doc.txt"
+    path.write_text(text, encoding="utf-8")
+
+    result = count_tokens_corpus([path], files=True, max_workers=1)
+
+    assert result["counts"] == [len(text.encode("utf-8"))]
+
+
+def test_parallel_counts_match_in_process_counts(monkeypatch):
+    # Never wait on a tokenizer download; both paths then count the same way
+    monkeypatch.setenv("TIKTOKEN_OFFLINE", "1")
+    documents = [("word " * n).strip() for n in range(60)]
+
+    serial = count_tokens_corpus(documents, max_workers=1, batch_size=4)
+    parallel = count_tokens_corpus(documents, max_workers=2, batch_size=4)
+
+    assert parallel["counts"] == serial["counts"]
+    assert parallel["documents"] == 60
@@ -0,0 +1,44 @@
+"""Tests for the local embedding backends."""
+
+import datetime
+
+import numpy as np
+
+import requests
+from utils.llm_helpers import get_local_embeddings
+
+
+class FakeResponse:
+    status_code = 200
+    elapsed = datetime.timedelta(milliseconds=5)
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+def test_local_embeddings_are_batched_in_order(monkeypatch):
+    batches = []
+
+    def fake_post(url, json=None, **kwargs):
+        assert url.endswith("/api/embed")
+        batches.append(json["input"])
+        return FakeResponse(
+            {"embeddings": [[float(len(t)), 1.0] for t in json["input"]]}
+        )
+
+    monkeypatch.setattr(requests, "post", fake_post)
+    texts = ["a" * n for n in range(1, 8)]
+
+    vectors = get_local_embeddings(texts, model="nomic-embed-text", batch_size=3)
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [v[0] for v in vectors] == [float(n) for n in range(1, 8)]
+
+    array = get_local_embeddings(texts, batch_size=3, as_array=True)
+    assert array.dtype == np.float32 and array.shape == (7, 2)
@@ -0,0 +1,70 @@
+"""Tests for evaluation report aggregation."""
+
+import json
+import math
+
+import pytest
+
+from utils.evaluation_helpers import (
+    create_evaluation_report,
+    create_streaming_evaluation_report,
+)
+from utils.judge_helpers import Rubric, judge_outputs
+
+
+def test_report_skips_nan_when_picking_best_and_worst():
+    results = [{"bleu": 1.0}, {"bleu": float("nan")}, {"bleu": 2.0}, {"rouge-l": 1.0}]
+
+    report = create_evaluation_report(results, metrics=["bleu"])
+
+    assert report["metrics"]["bleu"]["mean"] == 1.5
+    assert report["best_sample"] == {"bleu": 2.0}
+    assert report["worst_sample"] == {"bleu": 1.0}
+
+
+def test_report_over_judge_scores_with_failed_rows():
+    def judge(prompt):
+        if "unparseable" in prompt:
+            return "I refuse to score this."
+        score = 2 if "weak" in prompt else 5
+        return json.dumps({"relevance": score, "accuracy": score, "rationale": "ok"})
+
+    rubric = Rubric("test", {"relevance": "On task?", "accuracy": "Correct?"})
+    df = judge_outputs(
+        ["weak answer", "unparseable answer", "strong answer"],
+        rubric,
+        judge_fn=judge,
+        cache=False,
+        max_workers=1,
+    )
+    assert math.isnan(df.loc[1, "judge_score"])
+
+    report = create_evaluation_report(df.to_dict("records"), metrics=rubric.metrics)
+
+    assert report["metrics"]["judge_score"]["mean"] == 3.5
+    assert report["best_sample"]["output"] == "strong answer"
+    assert report["worst_sample"]["output"] == "weak answer"
+
+
+def test_streaming_report_matches_batch_report_with_nan_rows():
+    results = [
+        {"bleu": 0.2, "id": 0},
+        {"bleu": float("nan"), "id": 1},
+        {"bleu": 0.9, "id": 2},
+        {"bleu": None, "id": 3},
+        {"id": 4},
+        {"bleu": 0.5, "id": 5},
+    ]
+
+    batch = create_evaluation_report(results, metrics=["bleu"])
+    streaming = create_streaming_evaluation_report(results, metrics=["bleu"])
+
+    assert streaming["num_samples"] == batch["num_samples"]
+    assert streaming["metrics"]["bleu"]["mean"] == pytest.approx(
+        batch["metrics"]["bleu"]["mean"]
+    )
+    assert streaming["metrics"]["bleu"]["std"] == pytest.approx(
+        batch["metrics"]["bleu"]["std"]
+    )
+    assert streaming["best_sample"]["id"] == batch["best_sample"]["id"] == 2
+    assert streaming["worst_sample"]["id"] == batch["worst_sample"]["id"] == 0
@@ -0,0 +1,96 @@
+"""Tests for LLM-as-judge scoring, caching and pairwise comparison."""
+
+import json
+
+from utils.judge_helpers import JudgmentCache, Rubric, judge_outputs, judge_pairwise
+
+RUBRIC = Rubric("test", {"relevance": "On task?", "accuracy": "Correct?"})
+
+
+class CountingJudge:
+    """Scores by output length and counts how often it is asked."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        score = 5 if "long answer" in prompt else 2
+        return json.dumps({"relevance": score, "accuracy": score, "rationale": "ok"})
+
+
+def test_judgments_are_cached_and_deduplicated(tmp_path):
+    cache = JudgmentCache(str(tmp_path / "judgments.sqlite"))
+    judge = CountingJudge()
+    outputs = ["short", "a long answer", "short"]
+
+    first = judge_outputs(outputs, RUBRIC, judge_fn=judge, cache=cache, max_workers=2)
+    assert len(judge.prompts) == 2
+    assert list(first["judge_score"]) == [2.0, 5.0, 2.0]
+    assert not first["cached"].any()
+
+    second = judge_outputs(outputs, RUBRIC, judge_fn=judge, cache=cache, max_workers=2)
+    assert len(judge.prompts) == 2
+    assert second["cached"].all()
+    assert list(second["judge_score"]) == list(first["judge_score"])
+
+    # A changed rubric never reuses stale scores
+    other = Rubric("test", {"relevance": "On topic?", "accuracy": "Correct?"})
+    judge_outputs(outputs, other, judge_fn=judge, cache=cache)
+    assert len(judge.prompts) == 4
+
+
+def test_malformed_and_failed_replies_are_retried():
+    replies = iter(
+        [
+            "Error calling OpenAI: rate limited",
+            "Scores: great",
+            "Error analysis: " + json.dumps({"relevance": 4, "accuracy": 3}),
+        ]
+    )
+
+    df = judge_outputs(
+        ["x"], RUBRIC, judge_fn=lambda prompt: next(replies), cache=False
+    )
+
+    assert df.loc[0, "attempts"] == 3
+    assert df.loc[0, "judge_score"] == 3.5
+    assert df.loc[0, "error"] is None
+
+
+def pairwise_judge(prefer):
+    def judge(prompt):
+        first = prompt.split("Response A:\n")[1].split("\n")[0]
+        second = prompt.split("Response B:\n")[1].split("\n")[0]
+        return json.dumps({"winner": prefer(first, second)})
+
+    return judge
+
+
+def test_position_swap_cancels_position_bias():
+    always_first = pairwise_judge(lambda first, second: "A")
+
+    df = judge_pairwise(
+        ["one", "two"], ["uno", "dos"], judge_fn=always_first, cache=False
+    )
+
+    assert list(df["winner"]) == ["tie", "tie"]
+    assert list(df["score_a"]) == [0.5, 0.5]
+    assert not df["consistent"].any()
+
+
+def test_consistent_verdicts_survive_the_swap():
+    prefers_longer = pairwise_judge(
+        lambda first, second: "A" if len(first) > len(second) else "B"
+    )
+
+    df = judge_pairwise(
+        ["a detailed answer", "no"],
+        ["brief", "a much longer answer"],
+        judge_fn=prefers_longer,
+        cache=False,
+    )
+
+    assert list(df["winner"]) == ["A", "B"]
+    assert list(df["score_a"]) == [1.0, 0.0]
+    assert df["consistent"].all()
@@ -0,0 +1,68 @@
+"""Tests for Ollama context sizing and session context reuse."""
+
+import datetime
+import logging
+
+import pytest
+
+import requests
+from utils.llm_helpers import OLLAMA_NUM_CTX_BUCKETS, LocalLLMSession, size_num_ctx
+
+
+def test_num_ctx_rounds_the_padded_request_up_to_a_bucket():
+    # llama estimates carry a 20% error bound, plus 2 tokens of slack
+    assert size_num_ctx(1700, model="llama2:7b") == 2048
+    assert size_num_ctx(1710, model="llama2:7b") == 4096
+    assert size_num_ctx(1300, 600, model="llama2:7b") == 4096
+    assert set(size_num_ctx(n * 997) for n in range(1, 30)) <= set(
+        OLLAMA_NUM_CTX_BUCKETS
+    )
+
+
+def test_num_ctx_is_capped_with_a_warning(caplog):
+    with caplog.at_level(logging.WARNING):
+        assert size_num_ctx(50000, 500, cap=8192) == 8192
+    assert "8192" in caplog.text
+
+
+class FakeResponse:
+    status_code = 200
+    elapsed = datetime.timedelta(milliseconds=5)
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    payloads = []
+
+    def fake_post(url, json=None, **kwargs):
+        payloads.append(json)
+        turn = len(payloads)
+        return FakeResponse(
+            {"response": f"reply {turn}", "context": list(range(turn * 10))}
+        )
+
+    monkeypatch.setattr(requests, "post", fake_post)
+    return payloads
+
+
+def test_session_reuses_the_generate_context(ollama):
+    session = LocalLLMSession(system="Be brief")
+
+    assert session.send("First") == "reply 1"
+    assert session.send("Second") == "reply 2"
+
+    first, second = ollama
+    assert first["system"] == "Be brief" and "context" not in first
+    assert second["context"] == list(range(10)) and "system" not in second
+    assert second["prompt"] == "Second"
+    assert session.turns[-1]["prefill_tokens_saved"] == 10
+    assert session.prefill_tokens_saved == 10
@@ -0,0 +1,46 @@
+"""Tests for in-process Prometheus metrics."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics_helpers import Counter, Histogram
+
+
+def test_shards_of_exited_threads_are_retired():
+    requests = Counter("test_requests_total", "Requests", ("route",))
+    latency = Histogram("test_latency_seconds", "Latency")
+
+    def work(_):
+        requests.inc(route="/chat")
+        latency.observe(0.3)
+
+    # A fresh pool per call, as sample_llm and judge_outputs do
+    for _ in range(50):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(work, range(8)))
+
+    assert len(requests._shards) <= 1
+    assert len(latency._shards) <= 1
+    assert requests.values() == {("/chat",): 400}
+    assert sum(latency.values()[()][:-1]) == 400
+
+
+def test_histogram_snapshots_are_consistent_during_writes():
+    latency = Histogram("test_consistent_seconds", "Latency", buckets=(1,))
+    done = threading.Event()
+
+    def writer():
+        while not done.is_set():
+            latency.observe(1.0)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(2000):
+            state = latency.values().get(())
+            if state:
+                # Every observation is 1.0, so the sum must equal the count
+                assert state[-1] == sum(state[:-1])
+    finally:
+        done.set()
+        thread.join()
@@ -0,0 +1,61 @@
+"""Tests for MinHash/LSH near-duplicate detection."""
+
+import random
+
+import pytest
+
+from utils.evaluation_helpers import (
+    MinHashLSH,
+    calculate_similarity,
+    find_near_duplicates,
+)
+
+
+def make_corpus(n_pairs=40, words=20, seed=0):
+    """Texts of distinct words, each followed by a copy with one word replaced."""
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    texts = []
+    for _ in range(n_pairs):
+        original = rng.sample(vocabulary, words)
+        duplicate = list(original)
+        duplicate[rng.randrange(words)] = rng.choice(vocabulary)
+        texts.extend([" ".join(original), " ".join(duplicate)])
+    return texts
+
+
+def test_lsh_recalls_near_duplicate_pairs():
+    texts = make_corpus()
+    true_pairs = {
+        (i, j)
+        for i in range(len(texts))
+        for j in range(i + 1, len(texts))
+        if calculate_similarity(texts[i], texts[j]) >= 0.85
+    }
+    assert len(true_pairs) == 40
+
+    found = find_near_duplicates(texts, threshold=0.8)
+    found_pairs = {(i, j) for i, j, _ in found}
+
+    assert len(true_pairs & found_pairs) / len(true_pairs) >= 0.95
+    # Unrelated texts share almost no words and are never reported
+    for i, j in found_pairs:
+        assert calculate_similarity(texts[i], texts[j]) >= 0.5
+
+
+def test_signature_estimates_jaccard():
+    index = MinHashLSH(num_perm=256)
+    a = " ".join(f"w{i}" for i in range(40))
+    b = " ".join(f"w{i}" for i in range(20, 60))
+
+    estimate = index.estimate_jaccard(index.signature(a), index.signature(b))
+
+    assert estimate == pytest.approx(calculate_similarity(a, b), abs=0.1)
+
+
+def test_duplicate_keys_are_rejected():
+    index = MinHashLSH()
+    index.insert("a", "some text")
+    assert "a" in index and len(index) == 1
+    with pytest.raises(ValueError):
+        index.insert("a", "other text")
@@ -0,0 +1,48 @@
+"""Tests for max_tokens sizing from output length profiles."""
+
+from utils import llm_helpers
+from utils.llm_helpers import (
+    LLM_PROVIDERS,
+    TASK_MAX_TOKENS,
+    OutputLengthProfiles,
+    call_llm,
+    register_llm_provider,
+)
+
+
+def test_suggestion_follows_the_recorded_percentile():
+    profiles = OutputLengthProfiles(percentile=90, headroom=1.5, min_samples=5)
+    for length in (100, 110, 120, 130):
+        profiles.record("summary", length)
+
+    # Too little history: fall back to the task profile
+    assert (
+        profiles.suggest("summary", task="classification")
+        == TASK_MAX_TOKENS["classification"]
+    )
+
+    for length in range(140, 240, 10):
+        profiles.record("summary", length)
+    # 14 lengths: the 90th percentile is the 13th smallest, 220
+    assert profiles.suggest("summary") == int(220 * 1.5)
+
+
+def test_call_llm_sizes_and_records_template_outputs(monkeypatch, byte_encoding):
+    profiles = OutputLengthProfiles(min_samples=3, headroom=1.0)
+    monkeypatch.setattr(llm_helpers, "output_profiles", profiles)
+    requested = []
+
+    def provider(prompt, model=None, max_tokens=None, **kwargs):
+        requested.append(max_tokens)
+        return "x" * 40
+
+    register_llm_provider("sized", provider)
+    try:
+        for _ in range(4):
+            call_llm("Summarize", provider="sized", template="summary", task="analysis")
+    finally:
+        LLM_PROVIDERS.pop("sized")
+
+    # Byte-level tokens: each 40-character completion is 40 tokens
+    assert requested == [TASK_MAX_TOKENS["analysis"]] * 3 + [40]
+    assert list(profiles.lengths["summary"]) == [40] * 4
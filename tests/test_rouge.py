@@ -0,0 +1,47 @@
+"""Tests for the bit-parallel LCS behind ROUGE-L."""
+
+import random
+
+import numpy as np
+
+from utils.evaluation_helpers import calculate_rouge, calculate_rouge_batch, lcs_length
+
+
+def dp_lcs_length(seq1, seq2):
+    """Reference O(n * m) dynamic programme."""
+    previous = [0] * (len(seq2) + 1)
+    for a in seq1:
+        current = [0]
+        for j, b in enumerate(seq2):
+            current.append(
+                previous[j] + 1 if a == b else max(previous[j + 1], current[j])
+            )
+        previous = current
+    return previous[-1]
+
+
+def test_lcs_matches_the_dynamic_programme_on_random_strings():
+    rng = random.Random(0)
+    for _ in range(500):
+        alphabet = "abcd"[: rng.randint(1, 4)]
+        seq1 = [rng.choice(alphabet) for _ in range(rng.randint(0, 80))]
+        seq2 = [rng.choice(alphabet) for _ in range(rng.randint(0, 80))]
+        assert lcs_length(seq1, seq2) == dp_lcs_length(seq1, seq2)
+
+
+def test_lcs_handles_sequences_longer_than_a_machine_word():
+    rng = random.Random(1)
+    seq1 = [rng.randrange(20) for _ in range(300)]
+    seq2 = [rng.randrange(20) for _ in range(250)]
+    assert lcs_length(seq1, seq2) == dp_lcs_length(seq1, seq2)
+
+
+def test_rouge_l_batch_matches_pairwise_scores():
+    references = ["the cat sat on the mat", "a b c d", ""]
+    candidates = ["the cat on the mat sat", "d c b a", "anything"]
+
+    expected = [
+        calculate_rouge(r, c, "rouge-l") for r, c in zip(references, candidates)
+    ]
+    np.testing.assert_allclose(calculate_rouge_batch(references, candidates), expected)
+    assert expected[0] == 5 / 6
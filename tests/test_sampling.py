@@ -0,0 +1,106 @@
+"""Tests for self-consistency sampling."""
+
+import threading
+import time
+
+from utils.llm_helpers import (
+    LLM_PROVIDERS,
+    extract_answer,
+    get_coalescing_stats,
+    is_llm_error,
+    majority_vote,
+    register_llm_provider,
+    reset_coalescing_stats,
+    sample_llm,
+)
+
+
+def test_sample_llm_fans_out_without_coalescing():
+    calls = []
+    lock = threading.Lock()
+
+    def provider(prompt, model=None, **kwargs):
+        with lock:
+            calls.append(prompt)
+            number = len(calls)
+        # Keep the requests in flight together, as real ones would be
+        time.sleep(0.05)
+        return f"sample {number}"
+
+    register_llm_provider("counting", provider)
+    reset_coalescing_stats()
+    try:
+        samples = sample_llm("Q?", n=6, provider="counting", temperature=0)
+    finally:
+        LLM_PROVIDERS.pop("counting")
+
+    assert len(calls) == 6
+    assert len(set(samples)) == 6
+    assert get_coalescing_stats()["coalesced_calls"] == 0
+
+
+def _counting_provider(name, reply):
+    calls = []
+    lock = threading.Lock()
+
+    def provider(prompt, model=None, **kwargs):
+        with lock:
+            calls.append(prompt)
+            number = len(calls)
+        return reply(number)
+
+    register_llm_provider(name, provider)
+    return calls
+
+
+def test_stop_when_decided_stops_at_a_bare_majority():
+    calls = _counting_provider("unanimous", lambda number: "The answer is 36.")
+    try:
+        samples = sample_llm("Q?", n=9, provider="unanimous", stop_when_decided=True)
+    finally:
+        LLM_PROVIDERS.pop("unanimous")
+
+    assert len(calls) == 5
+    assert len(samples) == 5
+
+
+def test_stop_when_decided_only_requests_samples_that_can_decide():
+    # The first wave of 5 splits 3-2, so 2 more for the leader settle the vote
+    answers = {1: "36", 2: "42", 3: "36", 4: "42", 5: "36", 6: "36", 7: "36"}
+    calls = _counting_provider(
+        "split", lambda number: f"The answer is {answers.get(number, '36')}."
+    )
+    try:
+        samples = sample_llm("Q?", n=9, provider="split", stop_when_decided=True)
+    finally:
+        LLM_PROVIDERS.pop("split")
+
+    assert len(calls) == 7
+    assert majority_vote([extract_answer(s) for s in samples])["answer"] == "36"
+
+
+def test_failed_samples_do_not_vote():
+    error = "Error calling local LLM: HTTPConnectionPool(host='localhost', port=11434)"
+    calls = _counting_provider(
+        "flaky", lambda number: error if number % 2 else "The answer is 36."
+    )
+    try:
+        samples = sample_llm("Q?", n=4, provider="flaky")
+    finally:
+        LLM_PROVIDERS.pop("flaky")
+
+    assert len(calls) == 4
+    assert samples == ["The answer is 36."] * 2
+    assert extract_answer(error) is None
+
+
+def test_all_failed_samples_return_the_errors():
+    _counting_provider("down", lambda number: f"Error calling down: attempt {number}")
+    try:
+        samples = sample_llm("Q?", n=3, provider="down")
+    finally:
+        LLM_PROVIDERS.pop("down")
+
+    assert len(samples) == 3
+    assert all(is_llm_error(s) for s in samples)
+    assert majority_vote([extract_answer(s) for s in samples])["answer"] is None
@@ -0,0 +1,36 @@
+"""Tests for embedding-based semantic similarity."""
+
+import numpy as np
+
+from utils.evaluation_helpers import EmbeddingCache, embed_texts
+
+
+def test_unnamed_embed_fns_do_not_share_cache_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+
+    ones = embed_texts(["hello"], embed_fn=lambda t: np.ones((len(t), 3)), cache=cache)
+    zeros = embed_texts(
+        ["hello"], embed_fn=lambda t: np.zeros((len(t), 3)), cache=cache
+    )
+
+    assert ones.tolist() == [[1.0, 1.0, 1.0]]
+    assert zeros.tolist() == [[0.0, 0.0, 0.0]]
+    assert len(cache) == 0
+
+
+def test_named_embed_fn_is_cached_per_model(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return np.ones((len(texts), 3))
+
+    embed_texts(["a", "b"], model="ones-v1", embed_fn=embed, cache=cache)
+    embed_texts(["b", "c"], model="ones-v1", embed_fn=embed, cache=cache)
+    other = embed_texts(
+        ["a"], model="zeros-v1", embed_fn=lambda t: np.zeros((1, 3)), cache=cache
+    )
+
+    assert calls == [["a", "b"], ["c"]]
+    assert other.tolist() == [[0.0, 0.0, 0.0]]
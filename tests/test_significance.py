@@ -0,0 +1,87 @@
+"""Tests for bootstrap confidence intervals and paired significance tests."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import evaluation_helpers
+from utils.evaluation_helpers import (
+    bootstrap_ci,
+    compare_systems,
+    paired_permutation_test,
+)
+
+SAMPLES = Path(__file__).resolve().parent.parent / "data" / "samples"
+
+
+def test_exact_permutation_test_on_small_samples():
+    result = paired_permutation_test([1, 2, 3], [0, 1, 2], n_permutations=1000)
+
+    assert result["exact"] is True
+    assert result["p_value"] == 0.25
+
+
+def test_compare_systems_on_sample_results():
+    df = pd.read_csv(SAMPLES / "llm_evaluation_results.csv")
+
+    comparison = compare_systems(
+        df,
+        "bleu_score",
+        "model_name",
+        ["prompt_type", "task_category"],
+        baseline="gpt-4",
+        n_resamples=2000,
+        seed=0,
+    )
+
+    assert set(comparison["baseline"]) == {"gpt-4"}
+    assert (comparison["ci_low"] <= comparison["mean_difference"]).all()
+    assert (comparison["mean_difference"] <= comparison["ci_high"]).all()
+
+
+def test_compare_systems_rejects_duplicate_pairs():
+    df = pd.DataFrame(
+        {
+            "task": ["t1", "t1", "t1", "t2", "t2"],
+            "system": ["a", "b", "b", "a", "b"],
+            "score": [0.5, 0.4, 0.9, 0.6, 0.7],
+        }
+    )
+
+    with pytest.raises(ValueError, match="share a"):
+        compare_systems(df, "score", "system", ["task"])
+
+
+def test_bootstrap_ci_is_reproducible_and_brackets_the_estimate():
+    values = np.random.default_rng(0).normal(0.5, 0.1, size=200)
+
+    first = bootstrap_ci(values, seed=1, n_resamples=2000)
+    second = bootstrap_ci(values, seed=1, n_resamples=2000)
+
+    assert first == second
+    assert first["low"] < first["estimate"] < first["high"]
+    assert first["estimate"] == pytest.approx(values.mean())
+
+
+def test_bootstrap_ci_does_not_depend_on_chunking(monkeypatch):
+    values = np.arange(50, dtype=float)
+    whole = bootstrap_ci(values, statistic="median", seed=3, n_resamples=1000)
+
+    monkeypatch.setattr(evaluation_helpers, "_RESAMPLE_CHUNK_ELEMENTS", 50 * 7)
+    chunked = bootstrap_ci(values, statistic="median", seed=3, n_resamples=1000)
+
+    assert chunked == whole
+
+
+def test_bootstrap_ci_covers_the_true_mean_at_its_confidence():
+    rng = np.random.default_rng(4)
+    covered = 0
+    for trial in range(200):
+        values = rng.normal(1.0, 1.0, size=40)
+        result = bootstrap_ci(values, n_resamples=1000, seed=trial)
+        covered += result["low"] <= 1.0 <= result["high"]
+
+    # Percentile intervals undercover slightly for small samples
+    assert 0.88 <= covered / 200 <= 0.99
@@ -0,0 +1,49 @@
+"""Tests for sparse all-pairs similarity."""
+
+import numpy as np
+import pytest
+
+from utils.evaluation_helpers import (
+    calculate_similarity,
+    document_term_matrix,
+    similarity_matrix,
+)
+
+TEXTS = [
+    "the cat sat on the mat",
+    "the dog sat on the log",
+    "a completely different sentence",
+    "",
+    "The cat sat",
+]
+
+
+@pytest.mark.parametrize("method", ["cosine", "jaccard", "overlap"])
+def test_binary_matrix_matches_pairwise_similarity(method):
+    sims = similarity_matrix(TEXTS, method=method)
+
+    expected = np.array(
+        [[calculate_similarity(a, b, method) for b in TEXTS] for a in TEXTS]
+    )
+    np.testing.assert_allclose(sims, expected)
+    np.testing.assert_allclose(sims, sims.T)
+
+
+def test_tfidf_cosine_is_normalized():
+    sims = similarity_matrix(TEXTS, method="cosine", weighting="tfidf")
+
+    non_empty = [i for i, text in enumerate(TEXTS) if text]
+    np.testing.assert_allclose(np.diag(sims)[non_empty], 1.0)
+    assert sims[3].sum() == 0.0
+    # Words shared by fewer texts weigh more than "the"/"sat"/"on"
+    assert sims[0, 4] > sims[0, 1]
+
+
+def test_document_term_matrix_weightings():
+    tf = document_term_matrix(["a a b", "b c"], weighting="tf").toarray()
+    binary = document_term_matrix(["a a b", "b c"]).toarray()
+
+    assert sorted(tf[0][tf[0] > 0]) == [1.0, 2.0]
+    assert binary.max() == 1.0
+    with pytest.raises(ValueError):
+        similarity_matrix(TEXTS, method="euclidean")
@@ -0,0 +1,51 @@
+"""Tests for streaming early termination."""
+
+from utils.llm_helpers import (
+    _stream_until,
+    stop_on_json_object,
+    stop_on_regex,
+    stop_on_sections,
+)
+
+
+def consume(chunks, stop_when):
+    stats = {}
+    text = "".join(_stream_until(iter(chunks), stop_when, stats=stats))
+    return text, stats
+
+
+def test_sections_split_across_chunks():
+    chunks = ["## A\nx\n#", "# B\ny", "\n## C", "\nz\n"]
+
+    text, stats = consume(chunks, stop_on_sections(2))
+
+    assert text == "## A\nx\n## B\ny\n## C"
+    assert stats["stopped_early"] is True
+
+
+def test_regex_split_across_chunks():
+    chunks = ["Reasoning...\nFinal ans", "wer: 4", "2\n", "More text\n"]
+
+    text, _ = consume(chunks, stop_on_regex(r"Final answer: .+\n"))
+
+    assert text == "Reasoning...\nFinal answer: 42\n"
+
+
+def test_json_object_split_across_chunks():
+    chunks = ['Here: {"a": "}', '", "b": {"c"', ": 1}}", " trailing"]
+
+    text, _ = consume(chunks, stop_on_json_object())
+
+    assert text.endswith("1}}")
+
+
+def test_long_streams_are_scanned_in_linear_time():
+    chunks = ["word "] * 100_000
+
+    for stop_when in (stop_on_sections(3), stop_on_regex("ZZZ")):
+        text, stats = consume(chunks, stop_when)
+        assert stats == {
+            "output_tokens": 100_000,
+            "stopped_early": False,
+            "tokens_saved": 0,
+        }
@@ -0,0 +1,22 @@
+"""Tests for the tiktoken cache warm-up."""
+
+import os
+
+import pytest
+
+from utils.llm_helpers import tiktoken_cache_path, warm_tiktoken_cache
+
+
+def test_corrupt_seed_fails_the_warm_up(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    seeds = tmp_path / "seeds"
+    seeds.mkdir()
+    (seeds / "cl100k_base.tiktoken").write_text("not a BPE file\n")
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(cache_dir))
+
+    with pytest.raises(RuntimeError, match="cl100k_base"):
+        warm_tiktoken_cache(["cl100k_base"], source_dir=str(seeds))
+
+    # The corrupt seed never stays in the cache (a valid download may replace it)
+    path = tiktoken_cache_path("cl100k_base")
+    assert not os.path.exists(path) or b"not a BPE" not in open(path, "rb").read()
@@ -0,0 +1,80 @@
+"""Tests for token estimation and calibration."""
+
+import re
+
+import pytest
+
+from utils import llm_helpers
+from utils.llm_helpers import (
+    calibrate_token_estimator,
+    estimate_token_bounds,
+    fits_token_limit,
+)
+
+TEXTS = [
+    " ".join(["word"] * words) + "!" * symbols
+    for words in range(5, 60, 7)
+    for symbols in range(0, 12, 3)
+]
+
+
+def synthetic_count(text):
+    """A tokenizer that is exactly linear in the estimator's features."""
+    return len(re.findall(r"\w+", text)) + len(re.findall(r"[^\w\s]", text))
+
+
+@pytest.fixture
+def llama_family(monkeypatch):
+    # Calibration updates the family in place; restore it after the test
+    family = dict(llm_helpers.TOKEN_ESTIMATOR_FAMILIES["llama"])
+    monkeypatch.setitem(llm_helpers.TOKEN_ESTIMATOR_FAMILIES, "llama", family)
+    return family
+
+
+class Spy:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return synthetic_count(text)
+
+
+def test_calibration_measures_the_error_bound(llama_family):
+    fit = calibrate_token_estimator(TEXTS, "llama2:7b", count_fn=synthetic_count)
+
+    assert fit["error"] == pytest.approx(0.0, abs=1e-3)
+    assert llama_family["measured"] is True
+    assert estimate_token_bounds(TEXTS[0], "llama2:7b")["measured"] is True
+
+
+def test_fits_token_limit_counts_only_inside_the_measured_margin(llama_family):
+    calibrate_token_estimator(TEXTS, "llama2:7b", count_fn=synthetic_count)
+    text = "word " * 40 + "!!!"
+    actual = synthetic_count(text)
+    bounds = estimate_token_bounds(text, "llama2:7b")
+    assert bounds["low"] <= actual <= bounds["high"]
+
+    spy = Spy()
+    assert fits_token_limit(text, bounds["high"], "llama2:7b", count_fn=spy)
+    assert not fits_token_limit(text, bounds["low"] - 1, "llama2:7b", count_fn=spy)
+    assert spy.calls == 0
+
+    assert fits_token_limit(text, actual, "llama2:7b", count_fn=spy)
+    assert not fits_token_limit(text, actual - 1, "llama2:7b", count_fn=spy)
+    assert spy.calls == 2
+
+
+def test_unmeasured_margin_is_widened(llama_family):
+    text = "word " * 40 + "!!!"
+    estimate = estimate_token_bounds(text, "llama2:7b")["estimate"]
+    limit = int(estimate * 1.3)
+
+    # The prior error bound (20%) would accept this; the widened band counts
+    spy = Spy()
+    fits_token_limit(text, limit, "llama2:7b", count_fn=spy)
+    assert spy.calls == 1
+
+    # Without an exact counter only the widened upper bound is trusted
+    assert not fits_token_limit(text, limit, "llama2:7b")
+    assert fits_token_limit(text, estimate * 2, "llama2:7b")
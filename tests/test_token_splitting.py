@@ -0,0 +1,52 @@
+"""Tests for token-exact truncation and splitting (one token per byte here)."""
+
+import pytest
+
+from utils.llm_helpers import split_by_tokens, truncate_to_tokens
+
+TEXT = "Première phrase. Deuxième phrase ici! Troisième? Fin."
+
+
+def test_truncate_keeps_a_prefix_within_the_limit(byte_encoding):
+    assert truncate_to_tokens("short", 10) == "short"
+    assert truncate_to_tokens("abcdefgh", 3) == "abc"
+
+    for limit in range(1, len(TEXT.encode("utf-8"))):
+        prefix = truncate_to_tokens(TEXT, limit)
+        assert TEXT.startswith(prefix)
+        assert len(prefix.encode("utf-8")) <= limit
+
+
+def test_truncate_never_splits_a_character(byte_encoding):
+    # "é" is two tokens; a cut between them backs off to before it
+    assert truncate_to_tokens("hé", 2) == "h"
+
+
+def test_truncate_at_sentence_end(byte_encoding):
+    assert (
+        truncate_to_tokens("One. Two. Three.", 11, respect_sentences=True)
+        == "One. Two."
+    )
+    # A first sentence longer than the limit falls back to a hard cut
+    assert (
+        truncate_to_tokens("Onetwothree. Four.", 5, respect_sentences=True) == "Onetw"
+    )
+
+
+@pytest.mark.parametrize("respect_sentences", [False, True])
+def test_split_pieces_fit_and_rejoin(byte_encoding, respect_sentences):
+    pieces = split_by_tokens(TEXT, 12, respect_sentences=respect_sentences)
+
+    assert "".join(pieces) == TEXT
+    assert all(0 < len(piece.encode("utf-8")) <= 12 for piece in pieces)
+
+
+def test_split_overlap_repeats_the_tail(byte_encoding):
+    pieces = split_by_tokens("abcdefghij", 4, overlap=2)
+
+    assert pieces == ["abcd", "cdef", "efgh", "ghij"]
+
+
+def test_split_rejects_overlap_as_large_as_the_piece(byte_encoding):
+    with pytest.raises(ValueError):
+        split_by_tokens(TEXT, 4, overlap=4)
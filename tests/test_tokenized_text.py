@@ -0,0 +1,48 @@
+"""Tests for shared pre-tokenized texts."""
+
+import pickle
+
+from utils.evaluation_helpers import (
+    TokenizedText,
+    calculate_bleu,
+    calculate_rouge,
+    calculate_similarity,
+)
+
+
+def test_equal_tokens_share_ids_across_texts():
+    first = TokenizedText("The cat sat")
+    second = TokenizedText("the CAT ran")
+
+    assert first.ids[:2] == second.ids[:2]
+    assert first.ids[2] != second.ids[2]
+    assert len(first) == 3
+
+
+def test_ngram_tables_are_built_once():
+    text = TokenizedText("a b a b a")
+
+    assert text.ngrams(2) is text.ngrams(2)
+    assert sum(text.ngrams(2).values()) == 4
+    assert len(text.ngram_set(2)) == 2
+    assert text.ngram_set(1) == set(text.ids)
+
+
+def test_metrics_accept_tokenized_texts():
+    reference, candidate = "the cat sat on the mat", "the cat sat on a mat"
+    ref, cand = TokenizedText(reference), TokenizedText(candidate)
+
+    assert calculate_bleu(ref, cand) == calculate_bleu(reference, candidate)
+    for variant in ("rouge-1", "rouge-2", "rouge-l"):
+        assert calculate_rouge(ref, cand, variant) == calculate_rouge(
+            reference, candidate, variant
+        )
+    assert calculate_similarity(ref, cand) == calculate_similarity(reference, candidate)
+
+
+def test_pickling_retokenizes():
+    text = TokenizedText("Hello world")
+    restored = pickle.loads(pickle.dumps(text))
+
+    assert restored.text == text.text
+    assert restored.ids == text.ids
@@ -0,0 +1,89 @@
+"""Tests for provider call tracing."""
+
+import datetime
+import json
+import sys
+import types
+from contextlib import contextmanager
+
+import pytest
+
+import requests
+from utils.llm_helpers import call_llm, call_local_llm
+from utils.tracing_helpers import JsonlExporter, add_span_exporter, remove_span_exporter
+
+
+@pytest.fixture
+def spans(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = JsonlExporter(str(path))
+    add_span_exporter(exporter)
+
+    def read():
+        lines = path.read_text().splitlines()
+        return {span["name"]: span for span in map(json.loads, lines)}
+
+    yield read
+    remove_span_exporter(exporter)
+
+
+def assert_children(spans, parent, children):
+    for name in children:
+        assert spans[name]["parent_id"] == spans[parent]["span_id"]
+        assert spans[name]["trace_id"] == spans[parent]["trace_id"]
+
+
+class FakeOllamaResponse:
+    status_code = 200
+    elapsed = datetime.timedelta(milliseconds=12)
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"response": "Hi", "prompt_eval_count": 3, "eval_count": 1}
+
+
+def test_ollama_call_has_http_and_parse_children(spans, monkeypatch):
+    monkeypatch.setattr(requests, "post", lambda url, **kwargs: FakeOllamaResponse())
+
+    assert call_local_llm("Hello") == "Hi"
+
+    recorded = spans()
+    assert_children(recorded, "llm.call_local_llm", ["ollama.http", "ollama.parse"])
+    assert recorded["ollama.http"]["attributes"]["ttfb_ms"] == 12
+    assert recorded["ollama.parse"]["attributes"]["eval_count"] == 1
+
+
+class FakeCompletions:
+    """Mimics an OpenAI SDK resource, including with_streaming_response."""
+
+    def __init__(self):
+        self.with_streaming_response = self
+
+    def _result(self):
+        message = types.SimpleNamespace(content="Hi")
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=message)],
+            usage=types.SimpleNamespace(prompt_tokens=3, completion_tokens=1),
+        )
+
+    @contextmanager
+    def create(self, **params):
+        yield types.SimpleNamespace(status_code=200, parse=self._result)
+
+
+def test_openai_call_has_http_and_parse_children(spans, monkeypatch):
+    client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=FakeCompletions())
+    )
+    fake_openai = types.SimpleNamespace(OpenAI=lambda api_key=None: client)
+    monkeypatch.setitem(sys.modules, "openai", fake_openai)
+
+    assert call_llm("Hello", provider="openai", model="gpt-4") == "Hi"
+
+    recorded = spans()
+    assert_children(recorded, "llm.call_llm", ["llm.call_openai"])
+    assert_children(recorded, "llm.call_openai", ["openai.http", "openai.parse"])
+    assert recorded["openai.http"]["attributes"]["status_code"] == 200
+    assert recorded["openai.parse"]["attributes"]["output_tokens"] == 1
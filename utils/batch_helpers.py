@@ -0,0 +1,446 @@
+"""
+Batch Job Helper Functions
+
+Utilities for running large offline LLM jobs through provider Batch APIs
+(OpenAI and Azure OpenAI), plus a local file-based executor with the same
+interface for testing the whole flow without network access.
+"""
+
+from typing import Callable, Dict, List, Optional, Union
+from pathlib import Path
+import json
+import time
+import uuid
+
+# Batch statuses after which polling stops
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_request(
+    custom_id: str,
+    prompt: str,
+    model: str,
+    url: str = "/v1/chat/completions",
+    **kwargs,
+) -> Dict:
+    """
+    Build one line of a Batch API input file.
+
+    Args:
+        custom_id: ID used to match the result back to this request
+        prompt: The prompt text
+        model: Model name (OpenAI) or global-batch deployment name (Azure)
+        url: Endpoint path ("/v1/chat/completions" for OpenAI,
+             "/chat/completions" for Azure)
+        **kwargs: Extra request body fields (temperature, max_tokens, ...)
+
+    Returns:
+        Dict in the OpenAI/Azure batch request format
+
+    Example:
+        >>> build_batch_request("q1", "Explain AI", "gpt-4o-mini", max_tokens=100)
+    """
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    body.update(kwargs)
+
+    return {"custom_id": custom_id, "method": "POST", "url": url, "body": body}
+
+
+def write_batch_file(
+    prompts: Union[Dict[str, str], List[str]],
+    path: str,
+    model: str,
+    url: str = "/v1/chat/completions",
+    **kwargs,
+) -> str:
+    """
+    Serialize prompts to a Batch API JSONL input file.
+
+    Args:
+        prompts: Dict of {id: prompt}, or a list (ids are the list positions)
+        path: Output file path
+        model: Model/deployment name
+        url: Endpoint path for every request
+        **kwargs: Extra request body fields applied to every request
+
+    Returns:
+        str: Path to the written file
+    """
+    if not isinstance(prompts, dict):
+        prompts = dict(enumerate(prompts))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, prompt in prompts.items():
+            request = build_batch_request(str(custom_id), prompt, model, url, **kwargs)
+            f.write(json.dumps(request) + "\n")
+
+    return str(path)
+
+
+def read_batch_results(path: str) -> Dict[str, Dict]:
+    """
+    Parse a Batch API output (or error) file.
+
+    Args:
+        path: Path to the JSONL output file
+
+    Returns:
+        Dict of {custom_id: {"content": str or None, "error": str or None, "usage": dict}}
+    """
+    results = {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            error = record.get("error")
+
+            content = None
+            if not error and response.get("status_code", 200) == 200:
+                choices = body.get("choices") or [{}]
+                content = choices[0].get("message", {}).get("content")
+            elif not error:
+                error = body.get("error", f"HTTP {response.get('status_code')}")
+
+            if isinstance(error, dict):
+                error = error.get("message", str(error))
+
+            results[record["custom_id"]] = {
+                "content": content,
+                "error": error,
+                "usage": body.get("usage", {}),
+            }
+
+    return results
+
+
+class OpenAIBatchExecutor:
+    """
+    Submits batch files to the OpenAI or Azure OpenAI Batch API.
+
+    Attributes:
+        provider (str): "openai" or "azure"
+        endpoint (str): Endpoint path used in request lines and batch creation
+        completion_window (str): Batch completion window (currently only "24h")
+    """
+
+    def __init__(self, provider: str = "openai", completion_window: str = "24h"):
+        self.provider = provider
+        self.endpoint = (
+            "/chat/completions" if provider == "azure" else "/v1/chat/completions"
+        )
+        self.completion_window = completion_window
+        self._client = None
+
+    @property
+    def client(self):
+        """Lazily created OpenAI/AzureOpenAI client."""
+        if self._client is None:
+            import os
+
+            if self.provider == "azure":
+                from openai import AzureOpenAI
+
+                # The Batch API needs 2024-07-01-preview or later
+                self._client = AzureOpenAI(
+                    api_key=os.getenv("AZURE_OPENAI_KEY"),
+                    api_version=os.getenv(
+                        "AZURE_OPENAI_API_VERSION", "2024-07-01-preview"
+                    ),
+                    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                )
+            else:
+                from openai import OpenAI
+
+                self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    def submit(self, input_path: str) -> str:
+        """Upload the input file and create a batch. Returns the batch ID."""
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> Dict:
+        """Return the current batch status."""
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+
+        return {
+            "id": batch.id,
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "request_counts": {
+                "total": counts.total if counts else 0,
+                "completed": counts.completed if counts else 0,
+                "failed": counts.failed if counts else 0,
+            },
+        }
+
+    def download(self, batch_id: str, output_path: str) -> str:
+        """Download the output and error files of a finished batch into one JSONL file."""
+        info = self.status(batch_id)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+        with open(output_path, "wb") as f:
+            for file_id in (info["output_file_id"], info["error_file_id"]):
+                if file_id:
+                    f.write(self.client.files.content(file_id).read())
+
+        return str(output_path)
+
+
+class LocalBatchExecutor:
+    """
+    File-based stand-in for a Batch API, for tests and offline runs.
+
+    Batches are stored under ``work_dir/<batch_id>/``. Requests run on the
+    first ``status`` call after ``submit`` and results are written in the same
+    output format as the OpenAI Batch API, so ``read_batch_results`` and
+    ``run_batch_job`` work unchanged.
+
+    Attributes:
+        work_dir (Path): Directory holding batch inputs, outputs and metadata
+        provider (str): Provider passed to call_llm; "mock" uses canned responses
+        respond (Callable): Optional function mapping a request body to response
+            text; exceptions it raises become failed requests
+        endpoint (str): Endpoint path written into request lines
+
+    Example:
+        >>> executor = LocalBatchExecutor(provider="mock")
+        >>> run_batch_job({"q1": "Explain AI"}, model="gpt-4", executor=executor)
+    """
+
+    def __init__(
+        self,
+        work_dir: str = "outputs/batches",
+        provider: Optional[str] = None,
+        respond: Optional[Callable[[Dict], str]] = None,
+    ):
+        self.work_dir = Path(work_dir)
+        self.provider = provider
+        self.respond = respond
+        self.endpoint = "/v1/chat/completions"
+
+    def _meta_path(self, batch_id: str) -> Path:
+        return self.work_dir / batch_id / "batch.json"
+
+    def _respond(self, body: Dict) -> str:
+        if self.respond is not None:
+            return self.respond(body)
+
+        from .llm_helpers import call_llm, create_mock_llm_response, is_llm_error
+
+        prompt = body["messages"][-1]["content"]
+        if self.provider == "mock":
+            return create_mock_llm_response(prompt, delay=0)["content"]
+
+        options = {k: v for k, v in body.items() if k not in ("model", "messages")}
+        content = call_llm(
+            prompt, provider=self.provider, model=body["model"], **options
+        )
+        if is_llm_error(content):
+            # call_llm reports failures as strings; make them failed requests
+            raise RuntimeError(content or "empty response")
+        return content
+
+    def submit(self, input_path: str) -> str:
+        """Copy the input file into the work directory. Returns the batch ID."""
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        batch_dir = self.work_dir / batch_id
+        batch_dir.mkdir(parents=True, exist_ok=True)
+
+        (batch_dir / "input.jsonl").write_bytes(Path(input_path).read_bytes())
+        meta = {"id": batch_id, "status": "validating", "created_at": time.time()}
+        self._meta_path(batch_id).write_text(json.dumps(meta))
+
+        return batch_id
+
+    def _run(self, batch_id: str) -> Dict:
+        batch_dir = self.work_dir / batch_id
+        counts = {"total": 0, "completed": 0, "failed": 0}
+
+        with open(batch_dir / "input.jsonl", "r", encoding="utf-8") as src, open(
+            batch_dir / "output.jsonl", "w", encoding="utf-8"
+        ) as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                counts["total"] += 1
+                record = {
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": None,
+                    "error": None,
+                }
+                try:
+                    content = self._respond(request["body"])
+                    record["response"] = {
+                        "status_code": 200,
+                        "body": {
+                            "model": request["body"].get("model"),
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": content,
+                                    },
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                        },
+                    }
+                    counts["completed"] += 1
+                except Exception as e:
+                    record["error"] = {"code": "local_error", "message": str(e)}
+                    counts["failed"] += 1
+                dst.write(json.dumps(record) + "\n")
+
+        return counts
+
+    def status(self, batch_id: str) -> Dict:
+        """Return the batch status, running the batch if it has not run yet."""
+        meta = json.loads(self._meta_path(batch_id).read_text())
+
+        if meta["status"] not in TERMINAL_STATUSES:
+            meta["request_counts"] = self._run(batch_id)
+            meta["status"] = "completed"
+            meta["output_file_id"] = str(self.work_dir / batch_id / "output.jsonl")
+            self._meta_path(batch_id).write_text(json.dumps(meta))
+
+        return {
+            "id": batch_id,
+            "status": meta["status"],
+            "output_file_id": meta.get("output_file_id"),
+            "error_file_id": None,
+            "request_counts": meta.get("request_counts", {}),
+        }
+
+    def download(self, batch_id: str, output_path: str) -> str:
+        """Copy the batch output file to output_path."""
+        source = self.work_dir / batch_id / "output.jsonl"
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(output_path).write_bytes(source.read_bytes())
+
+        return str(output_path)
+
+
+def poll_batch(
+    executor, batch_id: str, interval: float = 30.0, timeout: Optional[float] = None
+) -> Dict:
+    """
+    Wait until a batch reaches a terminal status.
+
+    Args:
+        executor: OpenAIBatchExecutor or LocalBatchExecutor
+        batch_id: Batch ID returned by submit
+        interval: Seconds between status checks
+        timeout: Give up after this many seconds (None waits indefinitely)
+
+    Returns:
+        Dict with the final batch status
+
+    Raises:
+        TimeoutError: If the batch is still running after timeout seconds
+    """
+    start = time.time()
+
+    while True:
+        info = executor.status(batch_id)
+        if info["status"] in TERMINAL_STATUSES:
+            return info
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(
+                f"Batch {batch_id} still {info['status']} after {timeout}s"
+            )
+        time.sleep(interval)
+
+
+def run_batch_job(
+    prompts: Union[Dict[str, str], List[str]],
+    model: str,
+    executor=None,
+    work_dir: str = "outputs/batches",
+    poll_interval: float = 30.0,
+    timeout: Optional[float] = None,
+    **kwargs,
+) -> Dict:
+    """
+    Run prompts through a Batch API end to end and map results back to input IDs.
+
+    Args:
+        prompts: Dict of {id: prompt}, or a list (results are keyed by position)
+        model: Model/deployment name
+        executor: Batch executor (default: OpenAIBatchExecutor for LLM_PROVIDER)
+        work_dir: Directory for the input and output JSONL files
+        poll_interval: Seconds between status checks
+        timeout: Maximum seconds to wait for the batch
+        **kwargs: Extra request body fields (temperature, max_tokens, ...)
+
+    Returns:
+        Dict of {id: response text}; failed requests map to "Error: ..." strings
+
+    Example:
+        >>> results = run_batch_job(
+        ...     {"t1": "Summarize ticket 1", "t2": "Summarize ticket 2"},
+        ...     model="gpt-4o-mini",
+        ...     executor=LocalBatchExecutor(provider="mock"),
+        ... )
+    """
+    import os
+
+    if executor is None:
+        executor = OpenAIBatchExecutor(
+            provider=os.getenv("LLM_PROVIDER", "openai").lower()
+        )
+
+    if not isinstance(prompts, dict):
+        prompts = dict(enumerate(prompts))
+    ids = {str(key): key for key in prompts}
+
+    job_name = f"job_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+    input_path = write_batch_file(
+        prompts,
+        Path(work_dir) / f"{job_name}_input.jsonl",
+        model,
+        executor.endpoint,
+        **kwargs,
+    )
+
+    batch_id = executor.submit(input_path)
+    info = poll_batch(executor, batch_id, interval=poll_interval, timeout=timeout)
+
+    if info["status"] != "completed":
+        return {key: f"Error: batch {info['status']}" for key in prompts}
+
+    output_path = executor.download(
+        batch_id, Path(work_dir) / f"{job_name}_output.jsonl"
+    )
+    parsed = read_batch_results(output_path)
+
+    results = {}
+    for custom_id, key in ids.items():
+        record = parsed.get(custom_id)
+        if record is None:
+            results[key] = "Error: no result returned"
+        elif record["error"]:
+            results[key] = f"Error: {record['error']}"
+        else:
+            results[key] = record["content"]
+
+    return results
@@ -0,0 +1,386 @@
+"""
+Cassette Helper Functions
+
+Record/replay of LLM provider traffic. The first run records each provider
+call (including streamed chunks) to a compact cassette file; later runs
+replay the recorded responses exactly, without network access.
+
+Enable it in code with ``use_cassette`` or for a whole process (e.g. a
+notebook kernel) with the LLM_CASSETTE and LLM_CASSETTE_MODE env vars.
+
+Streams are recorded as the raw chunks the provider sent, before any
+``stop_when`` predicate is applied, so replay can re-apply the caller's own
+predicate. A stream its consumer closed early is recorded as partial; a
+later call that reads past the end of a partial recording is a miss.
+"""
+
+from typing import Callable, Dict, List, Optional
+from contextlib import contextmanager
+import functools
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import threading
+
+# Replay recorded calls; record the ones that are missing
+MODE_AUTO = "auto"
+# Always call the provider and record (fresh cassette)
+MODE_RECORD = "record"
+# Only replay; a missing call raises CassetteMissError
+MODE_REPLAY = "replay"
+
+_MODES = (MODE_AUTO, MODE_RECORD, MODE_REPLAY)
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a call was never recorded."""
+
+
+def _encode(value):
+    """Make a provider result JSON-serializable (numpy arrays included)."""
+    if hasattr(value, "tolist") and hasattr(value, "dtype"):
+        return {"__ndarray__": value.tolist(), "dtype": str(value.dtype)}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and "__ndarray__" in value:
+        import numpy as np
+
+        return np.asarray(value["__ndarray__"], dtype=value["dtype"])
+    return value
+
+
+def _is_error(result) -> bool:
+    """Error strings from the helpers are not worth replaying."""
+    from .llm_helpers import LLM_ERROR_PREFIXES
+
+    if isinstance(result, str):
+        return result.startswith(LLM_ERROR_PREFIXES)
+    if isinstance(result, list):
+        # Embedding helpers return [] on failure
+        return not result or (
+            isinstance(result[0], str) and result[0].startswith(LLM_ERROR_PREFIXES)
+        )
+    return False
+
+
+class Cassette:
+    """
+    A file of recorded provider calls, keyed by operation and arguments.
+
+    Records are appended as they happen (gzip-compressed if the path ends in
+    ``.gz``), so a crashed run keeps everything recorded so far. Repeated
+    identical calls (e.g. several samples of the same prompt) are replayed in
+    recording order.
+
+    Attributes:
+        path (str): Cassette file path
+        mode (str): "auto", "record" or "replay"
+        hits (int): Calls served from the cassette
+        recorded (int): Calls recorded during this run
+        misses (List[Dict]): Calls not found in replay mode
+        misses_path (str): File where misses are also logged, so they can be
+                           reported even if the helper turned the error into
+                           an "Error ..." string or ran in another process
+    """
+
+    def __init__(self, path: str, mode: str = MODE_AUTO):
+        if mode not in _MODES:
+            raise ValueError(
+                f"Unknown cassette mode: {mode} (expected one of {_MODES})"
+            )
+
+        self.path = path
+        self.mode = mode
+        self.misses_path = f"{path}.misses.jsonl"
+        self.hits = 0
+        self.recorded = 0
+        self.misses: List[Dict] = []
+        self._records: Dict[str, List[Dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        if mode == MODE_RECORD:
+            if os.path.exists(path):
+                os.remove(path)
+        elif os.path.exists(path):
+            self._load()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        with self._open("r") as f:
+            for line in f:
+                if line.strip():
+                    self._add(json.loads(line))
+
+    def _add(self, record: Dict):
+        """Index a record; complete streams supersede partial ones."""
+        entries = self._records.setdefault(record["key"], [])
+        if record.get("complete", True):
+            entries[:] = [e for e in entries if e.get("complete", True)]
+        elif any(e.get("complete", True) for e in entries):
+            return
+        entries.append(record)
+
+    @staticmethod
+    def make_key(operation: str, arguments: Dict) -> str:
+        """Fingerprint a call from its operation name and arguments."""
+        raw = json.dumps([operation, arguments], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Dict]:
+        """Return the next recorded entry for key, or None if there is none."""
+        if self.mode == MODE_RECORD:
+            return None
+
+        with self._lock:
+            entries = self._records.get(key)
+            if not entries:
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            self.hits += 1
+            return entries[index % len(entries)]
+
+    def record(
+        self,
+        key: str,
+        operation: str,
+        kind: str,
+        result,
+        arguments: Dict,
+        complete: bool = True,
+    ):
+        """Append one call to the cassette (``complete=False`` for a cut-short stream)."""
+        record = {"key": key, "op": operation, "kind": kind, "result": _encode(result)}
+        if kind == "stream":
+            record["result"] = list(result)
+            record["complete"] = complete
+
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._open("a") as f:
+                f.write(line + "\n")
+            self._add(record)
+            self.recorded += 1
+
+    def miss(self, key: str, operation: str, arguments: Dict, reason: str = ""):
+        """Register a replay miss and raise CassetteMissError."""
+        preview = {
+            name: (
+                value[:60] + "..."
+                if isinstance(value, str) and len(value) > 60
+                else value
+            )
+            for name, value in arguments.items()
+        }
+        miss = {"key": key, "op": operation, "arguments": preview}
+        if reason:
+            miss["reason"] = reason
+        with self._lock:
+            self.misses.append(miss)
+            directory = os.path.dirname(self.misses_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.misses_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(miss, default=str) + "\n")
+
+        raise CassetteMissError(
+            f"No recorded {operation} call in cassette {self.path} "
+            f"(key {key[:12]}, arguments {preview}){': ' + reason if reason else ''}. "
+            f"Re-record with LLM_CASSETTE_MODE=auto or record."
+        )
+
+    def summary(self) -> Dict:
+        """Return hit/record/miss counts for this run."""
+        return {
+            "path": self.path,
+            "mode": self.mode,
+            "hits": self.hits,
+            "recorded": self.recorded,
+            "misses": len(self.misses),
+        }
+
+    def __repr__(self) -> str:
+        return f"Cassette(path='{self.path}', mode='{self.mode}')"
+
+
+# Cassette set by use_cassette; takes precedence over the env var cassette
+_active: Optional[Cassette] = None
+_env_cassette: Optional[Cassette] = None
+_env_lock = threading.Lock()
+
+
+def active_cassette() -> Optional[Cassette]:
+    """
+    Return the cassette in use, if any.
+
+    This is the innermost ``use_cassette`` block, otherwise a process-wide
+    cassette created from LLM_CASSETTE / LLM_CASSETTE_MODE on first use.
+    """
+    global _env_cassette
+
+    if _active is not None:
+        return _active
+
+    path = os.getenv("LLM_CASSETTE")
+    if not path:
+        return None
+
+    with _env_lock:
+        if _env_cassette is None or _env_cassette.path != path:
+            _env_cassette = Cassette(path, os.getenv("LLM_CASSETTE_MODE", MODE_AUTO))
+        return _env_cassette
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = MODE_AUTO):
+    """
+    Record or replay all provider calls made inside the block.
+
+    Args:
+        path: Cassette file (use a ``.gz`` suffix for compression)
+        mode: "auto" (replay, record missing), "record" or "replay"
+
+    Yields:
+        Cassette: The cassette, for inspecting hits, recorded calls and misses
+
+    Example:
+        >>> with use_cassette("cassettes/week01.jsonl.gz") as cassette:
+        ...     call_llm("Explain prompt engineering", provider="ollama")
+        >>> cassette.summary()
+    """
+    global _active
+
+    previous = _active
+    _active = Cassette(path, mode)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+def recordable(
+    operation: str,
+    exclude: tuple = ("stats",),
+    normalize: Optional[Callable[[Dict], Dict]] = None,
+):
+    """
+    Decorator that records/replays a provider function through the active cassette.
+
+    Callable arguments and names in ``exclude`` are left out of the
+    recording key, so decorate the layer below anything they change (e.g.
+    the raw provider stream, not the ``stop_when``-filtered one). Generator
+    functions are recorded as the list of chunks they yielded; if the
+    consumer closes the generator early, the chunks read so far are recorded
+    as a partial stream.
+
+    Args:
+        operation: Name stored in the cassette (usually the function name)
+        exclude: Argument names not used for matching
+        normalize: Optional function to drop environment-dependent details
+                   from the arguments before matching
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def arguments(args, kwargs) -> Dict:
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            values = dict(bound.arguments)
+            # Flatten **kwargs so they match however they were passed
+            for name, param in signature.parameters.items():
+                if param.kind == inspect.Parameter.VAR_KEYWORD:
+                    values.update(values.pop(name, {}))
+            values = {
+                name: value
+                for name, value in values.items()
+                if name not in exclude and name != "self" and not callable(value)
+            }
+            return normalize(values) if normalize else values
+
+        if inspect.isgeneratorfunction(fn):
+
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                cassette = active_cassette()
+                if cassette is None:
+                    yield from fn(*args, **kwargs)
+                    return
+
+                call_args = arguments(args, kwargs)
+                key = Cassette.make_key(operation, call_args)
+                entry = cassette.lookup(key)
+                replayed = 0
+                if entry is not None:
+                    yield from entry["result"]
+                    if entry.get("complete", True):
+                        return
+                    # The recording was cut short by its consumer and this
+                    # consumer wants more of the stream
+                    replayed = len(entry["result"])
+                    if cassette.mode == MODE_REPLAY:
+                        cassette.miss(
+                            key,
+                            operation,
+                            call_args,
+                            reason=f"recorded stream ends after {replayed} chunks",
+                        )
+                elif cassette.mode == MODE_REPLAY:
+                    cassette.miss(key, operation, call_args)
+
+                chunks = []
+                stream = fn(*args, **kwargs)
+                try:
+                    for chunk in stream:
+                        chunks.append(chunk)
+                        # Skip the prefix already served from a partial recording
+                        if len(chunks) > replayed:
+                            yield chunk
+                except GeneratorExit:
+                    if chunks and not _is_error(chunks):
+                        cassette.record(
+                            key, operation, "stream", chunks, call_args, complete=False
+                        )
+                    raise
+                finally:
+                    stream.close()
+
+                if not _is_error(chunks):
+                    cassette.record(key, operation, "stream", chunks, call_args)
+
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cassette = active_cassette()
+            if cassette is None:
+                return fn(*args, **kwargs)
+
+            call_args = arguments(args, kwargs)
+            key = Cassette.make_key(operation, call_args)
+            entry = cassette.lookup(key)
+            if entry is not None:
+                return _decode(entry["result"])
+            if cassette.mode == MODE_REPLAY:
+                cassette.miss(key, operation, call_args)
+
+            result = fn(*args, **kwargs)
+            if not _is_error(result):
+                cassette.record(key, operation, "value", result, call_args)
+            return result
+
+        return wrapper
+
+    return decorator
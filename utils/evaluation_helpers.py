@@ -4,136 +4,433 @@ Evaluation Helper Functions
 Utilities for evaluating LLM outputs using various metrics.
 """
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
 import numpy as np
 from collections import Counter
 import re
+import threading
 
 
-def calculate_bleu(reference: str, candidate: str, n: int = 4) -> float:
+# ==================== Tokenized Text ====================
+
+# Token string -> id, shared by every TokenizedText in this process
+_vocabulary: Dict[str, int] = {}
+_vocabulary_lock = threading.Lock()
+
+
+def _tokenize(text: str) -> List[str]:
+    """Tokenization shared by all metrics: lowercase, split on whitespace."""
+    return text.lower().split()
+
+
+def _intern(tokens: List[str]) -> List[int]:
+    ids = []
+    for token in tokens:
+        token_id = _vocabulary.get(token)
+        if token_id is None:
+            with _vocabulary_lock:
+                token_id = _vocabulary.setdefault(token, len(_vocabulary))
+        ids.append(token_id)
+    return ids
+
+
+class TokenizedText:
+    """
+    A text tokenized once and reused across metrics.
+
+    Tokens are interned to integer ids, and n-gram count tables are built on
+    first use and cached. All metric functions accept a TokenizedText in
+    place of a string.
+
+    Attributes:
+        text (str): Original text
+        ids (List[int]): Token ids, in order
+
+    Example:
+        >>> output = TokenizedText(response)
+        >>> bleu = calculate_bleu(reference, output)
+        >>> rouge_l = calculate_rouge(reference, output, "rouge-l")
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.ids = _intern(_tokenize(text))
+        self._ngrams: Dict[int, Counter] = {}
+        self._ngram_sets: Dict[int, set] = {}
+
+    def ngrams(self, n: int) -> Counter:
+        """Return the n-gram counts (keys are tuples of token ids)."""
+        counts = self._ngrams.get(n)
+        if counts is None:
+            counts = self._ngrams[n] = Counter(zip(*[self.ids[i:] for i in range(n)]))
+        return counts
+
+    def ngram_set(self, n: int = 1) -> set:
+        """Return the distinct n-grams (token ids themselves for n=1)."""
+        ngrams = self._ngram_sets.get(n)
+        if ngrams is None:
+            ngrams = self._ngram_sets[n] = (
+                set(self.ids) if n == 1 else set(self.ngrams(n))
+            )
+        return ngrams
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __reduce__(self):
+        # Token ids are only valid in this process; re-tokenize when unpickled
+        return (TokenizedText, (self.text,))
+
+    def __repr__(self) -> str:
+        preview = self.text if len(self.text) <= 40 else self.text[:40] + "..."
+        return f"TokenizedText({preview!r}, tokens={len(self.ids)})"
+
+
+def _as_tokenized(text: Union[str, TokenizedText]) -> TokenizedText:
+    return text if isinstance(text, TokenizedText) else TokenizedText(text)
+
+
+# ==================== Metrics ====================
+
+
+# Smoothing methods for zero n-gram matches (Chen & Cherry, 2014)
+BLEU_SMOOTHING_METHODS = ["none", "floor", "add-k", "exp"]
+
+
+def calculate_bleu(
+    reference: Union[str, TokenizedText, List[Union[str, TokenizedText]]],
+    candidate: Union[str, TokenizedText],
+    n: int = 4,
+    smoothing: str = "none",
+    smooth_value: Optional[float] = None,
+) -> float:
     """
     Calculate BLEU score (simplified implementation).
 
+    Without smoothing the score is 0 whenever an n-gram order has no match,
+    which is common for short sentences; see ``corpus_bleu`` for smoothing
+    methods.
+
     Args:
-        reference: Reference text
-        candidate: Candidate text to evaluate
+        reference: Reference text, or a list of references (str or TokenizedText)
+        candidate: Candidate text to evaluate (str or TokenizedText)
         n: Maximum n-gram size
+        smoothing: "none", "floor", "add-k" or "exp"
+        smooth_value: Epsilon for "floor" (default 0.1), k for "add-k" (default 1)
 
     Returns:
         float: BLEU score (0-1)
     """
+    stats = _bleu_statistics(_as_references(reference), _as_tokenized(candidate), n)
+    return _bleu_from_statistics(stats, n, smoothing, smooth_value)["bleu"]
 
-    def get_ngrams(text: str, n: int) -> Counter:
-        words = text.lower().split()
-        return Counter([tuple(words[i : i + n]) for i in range(len(words) - n + 1)])
 
-    scores = []
-    for i in range(1, n + 1):
-        ref_ngrams = get_ngrams(reference, i)
-        cand_ngrams = get_ngrams(candidate, i)
+def _as_references(reference) -> List[TokenizedText]:
+    if isinstance(reference, (str, TokenizedText)):
+        return [_as_tokenized(reference)]
+    references = [_as_tokenized(r) for r in reference]
+    if not references:
+        raise ValueError("At least one reference is required")
+    return references
+
 
+def _bleu_statistics(
+    refs: List[TokenizedText], cand: TokenizedText, n: int = 4
+) -> np.ndarray:
+    """
+    Sufficient statistics for BLEU as one integer row.
+
+    Layout: clipped matches for orders 1..n, candidate n-gram totals for
+    orders 1..n, candidate length, closest reference length. Rows can be
+    summed across a corpus.
+    """
+    stats = np.zeros(2 * n + 2, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        cand_ngrams = cand.ngrams(i)
         if not cand_ngrams:
-            scores.append(0.0)
-            continue
+            break
+
+        # Multi-reference clipping: each n-gram counts up to its maximum
+        # count in any single reference
+        ref_ngrams = refs[0].ngrams(i)
+        if len(refs) > 1:
+            ref_ngrams = Counter(ref_ngrams)
+            for ref in refs[1:]:
+                ref_ngrams |= ref.ngrams(i)
+
+        stats[i - 1] = sum((cand_ngrams & ref_ngrams).values())
+        stats[n + i - 1] = len(cand) - i + 1
+
+    cand_len = len(cand)
+    stats[2 * n] = cand_len
+    # Closest reference length; ties go to the shorter reference
+    stats[2 * n + 1] = min(
+        (len(ref) for ref in refs), key=lambda length: (abs(length - cand_len), length)
+    )
+    return stats
 
-        matches = sum((cand_ngrams & ref_ngrams).values())
-        total = sum(cand_ngrams.values())
-        scores.append(matches / total if total > 0 else 0)
 
-    # Geometric mean
-    if all(s > 0 for s in scores):
-        bleu = np.exp(np.mean([np.log(s) for s in scores]))
+def _bleu_from_statistics(
+    stats: np.ndarray,
+    n: int,
+    smoothing: str = "none",
+    smooth_value: Optional[float] = None,
+) -> Dict:
+    if smoothing not in BLEU_SMOOTHING_METHODS:
+        raise ValueError(
+            f"Unknown smoothing: {smoothing} "
+            f"(expected one of {BLEU_SMOOTHING_METHODS})"
+        )
+
+    matches = stats[:n].astype(float)
+    totals = stats[n : 2 * n].astype(float)
+    cand_len, ref_len = int(stats[2 * n]), int(stats[2 * n + 1])
+
+    if smoothing == "add-k":
+        # Add k to orders above unigrams (Lin & Och)
+        k = 1.0 if smooth_value is None else smooth_value
+        matches[1:] += k
+        totals[1:] += k
+    elif smoothing == "floor":
+        # Replace zero matches by a small epsilon
+        epsilon = 0.1 if smooth_value is None else smooth_value
+        matches[matches == 0] = epsilon
+    elif smoothing == "exp":
+        # Halve the precision for each successive order without matches
+        zeros = matches == 0
+        matches[zeros] = 1.0 / 2.0 ** np.arange(1, zeros.sum() + 1)
+
+    precisions = np.divide(matches, totals, out=np.zeros(n), where=totals > 0)
+
+    if cand_len == 0:
+        brevity_penalty = 0.0
+    elif cand_len < ref_len:
+        brevity_penalty = float(np.exp(1 - ref_len / cand_len))
     else:
-        bleu = 0.0
+        brevity_penalty = 1.0
 
-    # Apply brevity penalty
-    ref_len = len(reference.split())
-    cand_len = len(candidate.split())
-    if cand_len < ref_len:
-        bp = np.exp(1 - ref_len / cand_len)
+    # With smoothing, candidates shorter than n are scored on the orders
+    # they can contain (effective order)
+    orders = precisions if smoothing == "none" else precisions[totals > 0]
+    if cand_len == 0 or orders.size == 0 or np.any(orders <= 0):
+        bleu = 0.0
     else:
-        bp = 1.0
+        bleu = brevity_penalty * float(np.exp(np.mean(np.log(orders))))
+
+    return {
+        "bleu": bleu,
+        "precisions": precisions.tolist(),
+        "brevity_penalty": brevity_penalty,
+        "length_ratio": cand_len / ref_len if ref_len > 0 else 0.0,
+        "candidate_length": cand_len,
+        "reference_length": ref_len,
+    }
+
 
-    return bleu * bp
+def _bleu_from_tokens(ref: TokenizedText, cand: TokenizedText, n: int = 4) -> float:
+    return _bleu_from_statistics(_bleu_statistics([ref], cand, n), n)["bleu"]
 
 
-def calculate_rouge(reference: str, candidate: str, variant: str = "rouge-1") -> float:
+def corpus_bleu(
+    references: List[Union[str, TokenizedText, List[Union[str, TokenizedText]]]],
+    candidates: List[Union[str, TokenizedText]],
+    n: int = 4,
+    smoothing: str = "none",
+    smooth_value: Optional[float] = None,
+) -> Dict:
     """
-    Calculate ROUGE score (simplified implementation).
+    Corpus-level BLEU.
+
+    Clipped n-gram matches, n-gram totals and lengths are summed over the
+    whole corpus in an integer array and combined once, as in standard
+    BLEU, rather than averaging per-sentence scores.
 
     Args:
-        reference: Reference text
-        candidate: Candidate text
-        variant: ROUGE variant ("rouge-1", "rouge-2", "rouge-l")
+        references: One reference, or a list of references, per candidate
+        candidates: Candidate texts
+        n: Maximum n-gram size
+        smoothing: "none", "floor" (epsilon for zero matches), "add-k"
+                   (add k to orders above unigrams) or "exp" (halve the
+                   precision for each successive order without matches)
+        smooth_value: Epsilon for "floor" (default 0.1), k for "add-k" (default 1)
 
     Returns:
-        float: ROUGE score (0-1)
+        Dict with bleu, precisions (per order), brevity_penalty,
+        length_ratio, candidate_length and reference_length
+
+    Example:
+        >>> corpus_bleu([[ref_a1, ref_a2], ref_b], [output_a, output_b])["bleu"]
+        0.4231
     """
+    if len(references) != len(candidates):
+        raise ValueError(
+            f"Got {len(references)} references for {len(candidates)} candidates"
+        )
 
-    def get_tokens(text: str) -> List[str]:
-        return text.lower().split()
+    totals = np.zeros(2 * n + 2, dtype=np.int64)
+    for reference, candidate in zip(references, candidates):
+        totals += _bleu_statistics(
+            _as_references(reference), _as_tokenized(candidate), n
+        )
 
-    def lcs_length(seq1: List[str], seq2: List[str]) -> int:
-        m, n = len(seq1), len(seq2)
-        dp = [[0] * (n + 1) for _ in range(m + 1)]
+    return _bleu_from_statistics(totals, n, smoothing, smooth_value)
 
-        for i in range(1, m + 1):
-            for j in range(1, n + 1):
-                if seq1[i - 1] == seq2[j - 1]:
-                    dp[i][j] = dp[i - 1][j - 1] + 1
-                else:
-                    dp[i][j] = max(dp[i - 1][j], dp[i][j - 1])
 
-        return dp[m][n]
+def lcs_length(seq1: List, seq2: List) -> int:
+    """
+    Length of the longest common subsequence of two token sequences.
+
+    Uses the bit-parallel algorithm of Allison-Dix/Hyyrö: one Python integer
+    holds a bit per position of ``seq1`` and is updated once per token of
+    ``seq2``, giving O(len(seq1) * len(seq2) / word size) time and linear
+    memory instead of a full DP table.
+
+    Args:
+        seq1: First sequence of hashable tokens
+        seq2: Second sequence of hashable tokens
+
+    Returns:
+        int: LCS length
+
+    Example:
+        >>> lcs_length("the cat sat".split(), "the cat on the mat sat".split())
+        3
+    """
+    if len(seq1) < len(seq2):
+        seq1, seq2 = seq2, seq1
+    if not seq2:
+        return 0
+
+    # Bit i of masks[token] is set where seq1[i] == token
+    masks: Dict = {}
+    for i, token in enumerate(seq1):
+        masks[token] = masks.get(token, 0) | (1 << i)
+
+    full = (1 << len(seq1)) - 1
+    v = full
+    for token in seq2:
+        match = masks.get(token)
+        if match:
+            u = v & match
+            v = ((v + u) | (v - u)) & full
+
+    # Zero bits in v mark LCS positions (bin().count keeps Python 3.8 support)
+    return len(seq1) - bin(v).count("1")
+
 
-    ref_tokens = get_tokens(reference)
-    cand_tokens = get_tokens(candidate)
+def _rouge_l_f1(ref_tokens: List, cand_tokens: List) -> float:
+    if len(cand_tokens) == 0:
+        return 0.0
+    lcs_len = lcs_length(ref_tokens, cand_tokens)
+    precision = lcs_len / len(cand_tokens)
+    recall = lcs_len / len(ref_tokens) if len(ref_tokens) > 0 else 0
+    if precision + recall == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
 
+
+def calculate_rouge(
+    reference: Union[str, TokenizedText],
+    candidate: Union[str, TokenizedText],
+    variant: str = "rouge-1",
+) -> float:
+    """
+    Calculate ROUGE score (simplified implementation).
+
+    Args:
+        reference: Reference text (str or TokenizedText)
+        candidate: Candidate text (str or TokenizedText)
+        variant: ROUGE variant ("rouge-1", "rouge-2", "rouge-l")
+
+    Returns:
+        float: ROUGE score (0-1)
+    """
+    return _rouge_from_tokens(
+        _as_tokenized(reference), _as_tokenized(candidate), variant
+    )
+
+
+def _rouge_from_tokens(ref: TokenizedText, cand: TokenizedText, variant: str) -> float:
     if variant == "rouge-l":
-        lcs_len = lcs_length(ref_tokens, cand_tokens)
-        if len(cand_tokens) == 0:
-            return 0.0
-        precision = lcs_len / len(cand_tokens)
-        recall = lcs_len / len(ref_tokens) if len(ref_tokens) > 0 else 0
-        if precision + recall == 0:
-            return 0.0
-        f1 = 2 * precision * recall / (precision + recall)
-        return f1
+        return _rouge_l_f1(ref.ids, cand.ids)
 
     elif variant == "rouge-1":
-        ref_set = set(ref_tokens)
-        cand_set = set(cand_tokens)
+        ref_set = ref.ngram_set(1)
+        cand_set = cand.ngram_set(1)
         overlap = len(ref_set & cand_set)
         return overlap / len(ref_set) if ref_set else 0.0
 
     elif variant == "rouge-2":
-        ref_bigrams = set(zip(ref_tokens[:-1], ref_tokens[1:]))
-        cand_bigrams = set(zip(cand_tokens[:-1], cand_tokens[1:]))
+        ref_bigrams = ref.ngram_set(2)
+        cand_bigrams = cand.ngram_set(2)
         overlap = len(ref_bigrams & cand_bigrams)
         return overlap / len(ref_bigrams) if ref_bigrams else 0.0
 
     return 0.0
 
 
-def calculate_similarity(text1: str, text2: str, method: str = "jaccard") -> float:
+def calculate_rouge_batch(
+    references: List[Union[str, TokenizedText]],
+    candidates: List[Union[str, TokenizedText]],
+    variant: str = "rouge-l",
+) -> np.ndarray:
+    """
+    Calculate ROUGE scores for many reference/candidate pairs.
+
+    Texts are tokenized to interned ids, so the LCS inner loop compares
+    small ints; scores match ``calculate_rouge`` pair by pair.
+
+    Args:
+        references: Reference texts (str or TokenizedText)
+        candidates: Candidate texts (same length as references)
+        variant: ROUGE variant ("rouge-1", "rouge-2", "rouge-l")
+
+    Returns:
+        np.ndarray: One score per pair
+
+    Example:
+        >>> scores = calculate_rouge_batch(df["reference"], df["summary"])
+        >>> scores.mean()
+    """
+    references = list(references)
+    candidates = list(candidates)
+    if len(references) != len(candidates):
+        raise ValueError(
+            f"Got {len(references)} references but {len(candidates)} candidates"
+        )
+
+    return np.array(
+        [
+            _rouge_from_tokens(_as_tokenized(ref), _as_tokenized(cand), variant)
+            for ref, cand in zip(references, candidates)
+        ],
+        dtype=float,
+    )
+
+
+def calculate_similarity(
+    text1: Union[str, TokenizedText],
+    text2: Union[str, TokenizedText],
+    method: str = "jaccard",
+) -> float:
     """
     Calculate similarity between two texts.
 
     Args:
-        text1: First text
-        text2: Second text
+        text1: First text (str or TokenizedText)
+        text2: Second text (str or TokenizedText)
         method: Similarity method ("jaccard", "cosine", "overlap")
 
     Returns:
         float: Similarity score (0-1)
     """
+    return _similarity_from_sets(
+        _as_tokenized(text1).ngram_set(1), _as_tokenized(text2).ngram_set(1), method
+    )
 
-    def tokenize(text: str) -> set:
-        return set(text.lower().split())
-
-    tokens1 = tokenize(text1)
-    tokens2 = tokenize(text2)
 
+def _similarity_from_sets(tokens1: set, tokens2: set, method: str) -> float:
     if method == "jaccard":
         intersection = len(tokens1 & tokens2)
         union = len(tokens1 | tokens2)
@@ -145,17 +442,16 @@ def calculate_similarity(text1: str, text2: str, method: str = "jaccard") -> flo
         return intersection / min_len if min_len > 0 else 0.0
 
     elif method == "cosine":
-        all_words = list(tokens1 | tokens2)
-        vec1 = [1 if word in tokens1 else 0 for word in all_words]
-        vec2 = [1 if word in tokens2 else 0 for word in all_words]
+        # Binary vectors: dot product is the intersection, norms are sqrt(size)
+        magnitude = np.sqrt(len(tokens1) * len(tokens2))
+        return len(tokens1 & tokens2) / magnitude if magnitude > 0 else 0.0
 
-        dot_product = sum(v1 * v2 for v1, v2 in zip(vec1, vec2))
-        mag1 = np.sqrt(sum(v * v for v in vec1))
-        mag2 = np.sqrt(sum(v * v for v in vec2))
+    return 0.0
 
-        return dot_product / (mag1 * mag2) if (mag1 * mag2) > 0 else 0.0
 
-    return 0.0
+def _is_missing(value) -> bool:
+    """None or NaN marks a failed measurement (e.g. a judge reply that never parsed)."""
+    return value is None or (isinstance(value, (float, np.floating)) and value != value)
 
 
 def create_evaluation_report(
@@ -164,6 +460,9 @@ def create_evaluation_report(
     """
     Create a comprehensive evaluation report.
 
+    Missing (None/NaN) metric values are left out of the statistics and of
+    the best/worst sample selection.
+
     Args:
         results: List of evaluation results
         metrics: Metrics to include in report
@@ -178,7 +477,9 @@ def create_evaluation_report(
 
     # Calculate statistics for each metric
     for metric in metrics:
-        values = [r.get(metric, 0) for r in results if metric in r]
+        values = [
+            r[metric] for r in results if metric in r and not _is_missing(r[metric])
+        ]
 
         if values:
             report["metrics"][metric] = {
@@ -192,9 +493,12 @@ def create_evaluation_report(
     # Add best and worst performing samples
     if results and any(metrics):
         primary_metric = metrics[0]
-        sorted_results = sorted(
-            results, key=lambda x: x.get(primary_metric, 0), reverse=True
-        )
+        scored = [
+            r
+            for r in results
+            if primary_metric in r and not _is_missing(r[primary_metric])
+        ]
+        sorted_results = sorted(scored, key=lambda x: x[primary_metric], reverse=True)
 
         report["best_sample"] = sorted_results[0] if sorted_results else None
         report["worst_sample"] = sorted_results[-1] if sorted_results else None
@@ -219,26 +523,1205 @@ def evaluate_multiple_outputs(
     if metrics is None:
         metrics = ["bleu", "rouge-1", "rouge-l", "similarity"]
 
-    results = {}
+    # Shared pass: the reference is tokenized once for all candidates
+    metrics = [m for m in DEFAULT_CORPUS_METRICS if m in metrics]
+    names = list(candidates)
+    columns = _evaluate_shard(
+        [reference] * len(names), [candidates[name] for name in names], metrics
+    )
+
+    return {
+        name: {metric: columns[metric][i] for metric in metrics}
+        for i, name in enumerate(names)
+    }
 
-    for name, candidate in candidates.items():
-        scores = {}
 
-        if "bleu" in metrics:
-            scores["bleu"] = calculate_bleu(reference, candidate)
+# ==================== Corpus Evaluation ====================
 
-        if "rouge-1" in metrics:
-            scores["rouge-1"] = calculate_rouge(reference, candidate, "rouge-1")
+DEFAULT_CORPUS_METRICS = ["bleu", "rouge-1", "rouge-2", "rouge-l", "similarity"]
 
-        if "rouge-2" in metrics:
-            scores["rouge-2"] = calculate_rouge(reference, candidate, "rouge-2")
 
-        if "rouge-l" in metrics:
-            scores["rouge-l"] = calculate_rouge(reference, candidate, "rouge-l")
+def _evaluate_shard(
+    references: List[str], candidates: List[str], metrics: List[str]
+) -> Dict[str, List[float]]:
+    """Score one shard of pairs, tokenizing each distinct text once."""
+    columns: Dict[str, List[float]] = {metric: [] for metric in metrics}
+    tokenized: Dict[str, TokenizedText] = {}
 
-        if "similarity" in metrics:
-            scores["similarity"] = calculate_similarity(reference, candidate)
+    def lookup(text) -> TokenizedText:
+        if isinstance(text, TokenizedText):
+            return text
+        result = tokenized.get(text)
+        if result is None:
+            result = tokenized[text] = TokenizedText(text)
+        return result
 
-        results[name] = scores
+    for reference, candidate in zip(references, candidates):
+        ref = lookup(reference)
+        cand = lookup(candidate)
+
+        for metric in metrics:
+            if metric == "bleu":
+                score = _bleu_from_tokens(ref, cand)
+            elif metric in ("rouge-1", "rouge-2", "rouge-l"):
+                score = _rouge_from_tokens(ref, cand, metric)
+            elif metric == "similarity":
+                score = _similarity_from_sets(
+                    ref.ngram_set(1), cand.ngram_set(1), "jaccard"
+                )
+            else:
+                raise ValueError(f"Unknown metric: {metric}")
+            columns[metric].append(float(score))
+
+    return columns
+
+
+def evaluate_corpus(
+    references: List[str],
+    candidates: List[str],
+    metrics: Optional[List[str]] = None,
+    max_workers: Optional[int] = None,
+    shard_size: int = 1000,
+    **embedding_kwargs,
+):
+    """
+    Score many reference/candidate pairs with several metrics in one pass.
+
+    Each distinct text is tokenized once per shard and the tokens are shared
+    by all metrics. With ``max_workers`` > 1, shards are scored in a process
+    pool. The optional "semantic" metric embeds all texts in one batch in
+    this process (see ``semantic_similarity_batch``).
+
+    Args:
+        references: Reference texts (str or TokenizedText)
+        candidates: Candidate texts (same length as references)
+        metrics: Metrics to compute ("bleu", "rouge-1", "rouge-2", "rouge-l",
+                 "similarity", "semantic"); default all but "semantic"
+        max_workers: Worker processes (default: score in this process)
+        shard_size: Pairs per worker task
+        **embedding_kwargs: Backend options for the "semantic" metric
+
+    Returns:
+        pd.DataFrame: One row per pair, one column per metric
+
+    Example:
+        >>> scores = evaluate_corpus(df["reference"], df["output"], max_workers=4)
+        >>> scores.mean()
+    """
+    import pandas as pd
+
+    references = list(references)
+    candidates = list(candidates)
+    if len(references) != len(candidates):
+        raise ValueError(
+            f"Got {len(references)} references but {len(candidates)} candidates"
+        )
+
+    metrics = list(metrics or DEFAULT_CORPUS_METRICS)
+    unknown = [m for m in metrics if m not in DEFAULT_CORPUS_METRICS + ["semantic"]]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+
+    lexical = [m for m in metrics if m != "semantic"]
+    shards = [
+        (references[i : i + shard_size], candidates[i : i + shard_size], lexical)
+        for i in range(0, len(references), shard_size)
+    ]
+
+    if max_workers and max_workers > 1 and len(shards) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_evaluate_shard, *zip(*shards)))
+    else:
+        results = [_evaluate_shard(*shard) for shard in shards]
+
+    columns = {
+        metric: np.fromiter(
+            (score for result in results for score in result[metric]),
+            dtype=float,
+            count=len(references),
+        )
+        for metric in lexical
+    }
+    if "semantic" in metrics:
+        columns["semantic"] = semantic_similarity_batch(
+            references, candidates, **embedding_kwargs
+        )
+
+    return pd.DataFrame(columns, columns=metrics)
+
+
+# ==================== Similarity Matrices ====================
+
+
+def document_term_matrix(
+    texts: List[Union[str, TokenizedText]], weighting: str = "binary"
+):
+    """
+    Build a sparse document-term matrix (one row per text).
+
+    Args:
+        texts: Texts (str or TokenizedText)
+        weighting: "binary" (presence), "tf" (counts) or "tfidf"
+                   (counts times smoothed IDF, log((1 + n) / (1 + df)) + 1)
+
+    Returns:
+        scipy.sparse.csr_matrix: Shape (len(texts), vocabulary size)
+
+    Example:
+        >>> matrix = document_term_matrix(outputs, weighting="tfidf")
+    """
+    from scipy import sparse
+
+    if weighting not in ("binary", "tf", "tfidf"):
+        raise ValueError(f"Unknown weighting: {weighting}")
+
+    texts = list(texts)
+    rows, cols, counts = [], [], []
+    for row, text in enumerate(texts):
+        term_counts = Counter(_as_tokenized(text).ids)
+        rows.extend([row] * len(term_counts))
+        cols.extend(term_counts.keys())
+        counts.extend(term_counts.values())
+
+    # Map the global token ids onto consecutive columns
+    terms, columns = np.unique(np.asarray(cols, dtype=np.int64), return_inverse=True)
+    values = (
+        np.ones(len(counts)) if weighting == "binary" else np.asarray(counts, float)
+    )
+    matrix = sparse.csr_matrix(
+        (values, (np.asarray(rows, dtype=np.int64), columns)),
+        shape=(len(texts), len(terms)),
+    )
+
+    if weighting == "tfidf":
+        n_docs = matrix.shape[0]
+        df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+        idf = np.log((1 + n_docs) / (1 + df)) + 1
+        matrix = matrix @ sparse.diags(idf)
+
+    return matrix.tocsr()
+
+
+def similarity_matrix(
+    texts: List[Union[str, TokenizedText]],
+    method: str = "cosine",
+    weighting: str = "binary",
+) -> np.ndarray:
+    """
+    Calculate all-pairs similarity between texts with sparse matrix products.
+
+    With binary weighting, entries equal ``calculate_similarity`` for each
+    pair. Jaccard and overlap are set measures and always use binary
+    presence; ``weighting`` applies to cosine.
+
+    Args:
+        texts: Texts (str or TokenizedText), e.g. generations for one prompt
+        method: "cosine", "jaccard" or "overlap"
+        weighting: "binary", "tf" or "tfidf" (cosine only)
+
+    Returns:
+        np.ndarray: Symmetric (n, n) similarity matrix
+
+    Example:
+        >>> sims = similarity_matrix(outputs, method="cosine", weighting="tfidf")
+        >>> diversity = 1 - sims[np.triu_indices(len(outputs), k=1)].mean()
+    """
+    if method not in ("cosine", "jaccard", "overlap"):
+        raise ValueError(f"Unknown method: {method}")
+
+    texts = [_as_tokenized(text) for text in texts]
+
+    if method == "cosine":
+        from scipy import sparse
+
+        matrix = document_term_matrix(texts, weighting)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        matrix = sparse.diags(inverse) @ matrix
+        return (matrix @ matrix.T).toarray()
+
+    matrix = document_term_matrix(texts, "binary")
+    intersection = (matrix @ matrix.T).toarray()
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+
+    if method == "jaccard":
+        denominator = sizes[:, None] + sizes[None, :] - intersection
+    else:
+        denominator = np.minimum(sizes[:, None], sizes[None, :])
+
+    return np.divide(
+        intersection,
+        denominator,
+        out=np.zeros_like(intersection),
+        where=denominator > 0,
+    )
+
+
+# ==================== Near-Duplicate Detection ====================
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _lsh_bands(threshold: float, num_perm: int) -> tuple:
+    """Pick (bands, rows) whose S-curve midpoint (1/b)^(1/r) is closest to threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        midpoint = (1 / bands) ** (1 / rows)
+        error = abs(midpoint - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """
+    MinHash signatures with an LSH banding index for near-duplicate search.
+
+    Each text is reduced to ``num_perm`` MinHash values over its word
+    shingles; the fraction of equal values estimates the Jaccard similarity
+    of the shingle sets. Signatures are split into bands and hashed into
+    buckets, so a query only compares against texts sharing a bucket instead
+    of the whole collection.
+
+    Attributes:
+        threshold (float): Default Jaccard threshold for queries
+        num_perm (int): Number of hash permutations
+        shingle_size (int): Words per shingle (1 matches calculate_similarity)
+        bands (int): LSH bands
+        rows (int): Signature values per band
+
+    Example:
+        >>> index = MinHashLSH(threshold=0.8)
+        >>> for i, output in enumerate(outputs):
+        ...     index.insert(i, output)
+        >>> index.query("The capital of France is Paris.")
+        [(17, 0.92)]
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        shingle_size: int = 1,
+        seed: int = 1,
+    ):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _lsh_bands(threshold, num_perm)
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 1 << 61, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 61, size=num_perm, dtype=np.uint64)
+
+        self._tables: List[Dict[bytes, List]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict = {}
+
+    def _shingles(self, text: Union[str, TokenizedText]) -> set:
+        words = _tokenize(text.text if isinstance(text, TokenizedText) else text)
+        k = self.shingle_size
+        if len(words) <= k:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i : i + k]) for i in range(len(words) - k + 1)}
+
+    def signature(self, text: Union[str, TokenizedText]) -> np.ndarray:
+        """
+        Compute the MinHash signature of a text.
+
+        Args:
+            text: Text (str or TokenizedText)
+
+        Returns:
+            np.ndarray: ``num_perm`` uint32 values (all max for an empty text)
+        """
+        import zlib
+
+        shingles = self._shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # Universal hashing (a * x + b) mod p, one column per permutation
+        with np.errstate(over="ignore"):
+            permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        r = self.rows
+        return [signature[i * r : (i + 1) * r].tobytes() for i in range(self.bands)]
+
+    def insert(self, key, text: Union[str, TokenizedText]):
+        """
+        Add a text to the index.
+
+        Args:
+            key: Identifier returned by queries (e.g. row index or sample ID)
+            text: Text (str or TokenizedText)
+        """
+        if key in self._signatures:
+            raise ValueError(f"Key already in index: {key}")
+
+        signature = self.signature(text)
+        self._signatures[key] = signature
+        for table, band in zip(self._tables, self._band_keys(signature)):
+            table.setdefault(band, []).append(key)
+
+    def candidates(self, signature: np.ndarray) -> set:
+        """Return keys sharing at least one band bucket with a signature."""
+        found = set()
+        for table, band in zip(self._tables, self._band_keys(signature)):
+            found.update(table.get(band, ()))
+        return found
+
+    def query(
+        self, text: Union[str, TokenizedText], threshold: Optional[float] = None
+    ) -> List[tuple]:
+        """
+        Find indexed texts whose estimated Jaccard similarity meets a threshold.
+
+        Args:
+            text: Query text (str or TokenizedText)
+            threshold: Minimum estimated Jaccard (default: the index threshold)
+
+        Returns:
+            List of (key, estimated Jaccard) tuples, most similar first
+        """
+        threshold = self.threshold if threshold is None else threshold
+        signature = self.signature(text)
+
+        matches = []
+        for key in self.candidates(signature):
+            similarity = self.estimate_jaccard(signature, self._signatures[key])
+            if similarity >= threshold:
+                matches.append((key, similarity))
+
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    @staticmethod
+    def estimate_jaccard(signature1: np.ndarray, signature2: np.ndarray) -> float:
+        """Estimate Jaccard similarity as the fraction of equal MinHash values."""
+        return float(np.mean(signature1 == signature2))
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key) -> bool:
+        return key in self._signatures
+
+    def __repr__(self) -> str:
+        return (
+            f"MinHashLSH(threshold={self.threshold}, num_perm={self.num_perm}, "
+            f"bands={self.bands}, rows={self.rows}, size={len(self)})"
+        )
+
+
+def find_near_duplicates(
+    texts: List[Union[str, TokenizedText]],
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 1,
+) -> List[tuple]:
+    """
+    Find near-duplicate pairs in a collection without comparing every pair.
+
+    Args:
+        texts: Texts (str or TokenizedText), e.g. generations or prompts
+        threshold: Minimum estimated Jaccard similarity
+        num_perm: MinHash permutations (more is more accurate and slower)
+        shingle_size: Words per shingle
+
+    Returns:
+        List of (i, j, estimated Jaccard) tuples with i < j
+
+    Example:
+        >>> pairs = find_near_duplicates(df["output"], threshold=0.9)
+    """
+    index = MinHashLSH(threshold, num_perm, shingle_size)
+    pairs = []
+
+    for j, text in enumerate(texts):
+        for i, similarity in index.query(text):
+            pairs.append((i, j, similarity))
+        index.insert(j, text)
+
+    return sorted(pairs)
+
+
+# ==================== Semantic Similarity ====================
+
+# Default model per embedding provider (same env vars as llm_helpers)
+_EMBEDDING_MODEL_DEFAULTS = {
+    "sentence-transformers": ("SENTENCE_TRANSFORMERS_MODEL", "all-MiniLM-L6-v2"),
+    "ollama": ("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text"),
+    "azure": ("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002"),
+}
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache in SQLite, keyed by model and text hash.
+
+    Re-running an evaluation only encodes texts that were never seen with
+    the same model.
+
+    Attributes:
+        path (str): SQLite database file
+
+    Example:
+        >>> cache = EmbeddingCache("outputs/cache/embeddings.sqlite")
+        >>> semantic_similarity_batch(refs, outputs, cache=cache)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        import os
+
+        self.path = path or os.getenv(
+            "EMBEDDING_CACHE_PATH", "outputs/cache/embeddings.sqlite"
+        )
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+
+    def _connect(self):
+        import sqlite3
+
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        import hashlib
+
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Return {text: vector} for the texts already cached for a model."""
+        hashes = {self.text_hash(text): text for text in texts}
+        found = {}
+
+        keys = list(hashes)
+        with self._connect() as connection:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows = connection.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                )
+                for text_hash, blob in rows:
+                    found[hashes[text_hash]] = np.frombuffer(blob, dtype=np.float32)
+
+        return found
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        """Store vectors for texts under a model name."""
+        rows = [
+            (model, self.text_hash(text), np.asarray(vector, np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows
+            )
+
+    def __len__(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __repr__(self) -> str:
+        return f"EmbeddingCache(path='{self.path}')"
+
+
+_default_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def embed_texts(
+    texts: List[Union[str, TokenizedText]],
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    embed_fn=None,
+    cache: Union[bool, EmbeddingCache] = True,
+) -> np.ndarray:
+    """
+    Encode texts to embedding vectors, reusing cached encodings.
+
+    Duplicate texts are encoded once, and only texts missing from the cache
+    are sent to the backend, in a single batch.
+
+    Args:
+        texts: Texts (str or TokenizedText)
+        provider: Provider for ``get_embeddings`` (default: EMBEDDING_PROVIDER
+                  env var, else "sentence-transformers", which runs locally)
+        model: Model name (provider default if None); also the cache namespace
+               when ``embed_fn`` is given. A custom ``embed_fn`` without a
+               model name is never cached, since its vectors cannot be told
+               apart from another function's
+        embed_fn: Custom backend, ``fn(texts) -> (n, dim) array``
+        cache: True for the default cache (EMBEDDING_CACHE_PATH env var),
+               an EmbeddingCache, or False to disable caching
+
+    Returns:
+        np.ndarray: (len(texts), dim) float32 array
+
+    Raises:
+        RuntimeError: If the backend returns no vectors
+    """
+    import os
+
+    global _default_embedding_cache
+
+    texts = [t.text if isinstance(t, TokenizedText) else t for t in texts]
+
+    if embed_fn is None:
+        from .llm_helpers import get_embeddings
+
+        provider = provider or os.getenv("EMBEDDING_PROVIDER", "sentence-transformers")
+        env_var, fallback = _EMBEDDING_MODEL_DEFAULTS.get(provider, (None, ""))
+        model = model or (os.getenv(env_var, fallback) if env_var else fallback)
+        backend = provider
+
+        def embed_fn(batch):
+            return get_embeddings(batch, provider=provider, model=model, as_array=True)
+
+    else:
+        backend = "custom"
+        if model is None:
+            cache = False
+
+    if cache is True:
+        if _default_embedding_cache is None:
+            _default_embedding_cache = EmbeddingCache()
+        cache = _default_embedding_cache
+    elif cache is False:
+        cache = None
+
+    cache_model = f"{backend}/{model}"
+    unique = list(dict.fromkeys(texts))
+    vectors = cache.get_many(cache_model, unique) if cache is not None else {}
+
+    missing = [text for text in unique if text not in vectors]
+    if missing:
+        encoded = np.asarray(embed_fn(missing), dtype=np.float32)
+        if len(encoded) != len(missing):
+            raise RuntimeError(
+                f"Embedding backend returned {len(encoded)} vectors "
+                f"for {len(missing)} texts"
+            )
+        if cache is not None:
+            cache.put_many(cache_model, missing, encoded)
+        vectors.update(zip(missing, encoded))
+
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    return np.stack([vectors[text] for text in texts])
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def semantic_similarity_batch(
+    references: List[Union[str, TokenizedText]],
+    candidates: List[Union[str, TokenizedText]],
+    **kwargs,
+) -> np.ndarray:
+    """
+    Embedding cosine similarity for many reference/candidate pairs.
+
+    All distinct texts are encoded in one batch (through the cache), and
+    the pairwise cosines are computed as one normalized matrix operation.
+
+    Args:
+        references: Reference texts
+        candidates: Candidate texts (same length as references)
+        **kwargs: Backend options for ``embed_texts`` (provider, model,
+                  embed_fn, cache)
+
+    Returns:
+        np.ndarray: One cosine similarity per pair
+
+    Example:
+        >>> scores = semantic_similarity_batch(df["reference"], df["output"])
+    """
+    references = list(references)
+    candidates = list(candidates)
+    if len(references) != len(candidates):
+        raise ValueError(
+            f"Got {len(references)} references but {len(candidates)} candidates"
+        )
+    if not references:
+        return np.zeros(0)
+
+    vectors = _normalize_rows(
+        embed_texts(references + candidates, **kwargs).astype(np.float64)
+    )
+    n = len(references)
+
+    return np.einsum("ij,ij->i", vectors[:n], vectors[n:]).astype(float)
+
+
+def semantic_similarity(
+    text1: Union[str, TokenizedText], text2: Union[str, TokenizedText], **kwargs
+) -> float:
+    """
+    Calculate meaning-level similarity between two texts with embeddings.
+
+    Unlike the word-overlap metrics, paraphrases score high. Encodings are
+    cached persistently, so re-running an evaluation does not re-encode.
+
+    Args:
+        text1: First text (str or TokenizedText)
+        text2: Second text (str or TokenizedText)
+        **kwargs: Backend options for ``embed_texts`` (provider, model,
+                  embed_fn, cache)
+
+    Returns:
+        float: Cosine similarity (-1 to 1, typically 0-1)
+
+    Example:
+        >>> semantic_similarity("The meeting was postponed.", "They delayed the meeting.")
+    """
+    return float(semantic_similarity_batch([text1], [text2], **kwargs)[0])
+
+
+# ==================== Streaming Reports ====================
+
+
+class _P2Quantile:
+    """
+    Running quantile estimate with the P² algorithm (Jain & Chlamtac, 1985).
+
+    Keeps five markers instead of the observations; exact for the first five.
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self._initial: List[float] = []
+        self._heights: Optional[List[float]] = None
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        q = self._heights
+        if q is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+            return
+
+        n, desired = self._positions, self._desired
+        if x < q[0]:
+            q[0] = x
+            k = 1
+        elif x >= q[4]:
+            q[4] = x
+            k = 4
+        else:
+            k = 1
+            while x >= q[k]:
+                k += 1
+
+        for i in range(k, 5):
+            n[i] += 1
+        desired[1] += self._increments[1]
+        desired[2] += self._increments[2]
+        desired[3] += self._increments[3]
+        desired[4] += 1
+
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self) -> float:
+        if self._heights is None:
+            if not self._initial:
+                return float("nan")
+            return float(np.quantile(self._initial, self.p))
+        return float(self._heights[2])
+
+
+class _RunningStats:
+    """Welford mean/variance plus min, max and P² quantiles for one metric."""
+
+    def __init__(self, quantiles: tuple):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.quantiles = {q: _P2Quantile(q) for q in quantiles}
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        for estimator in self.quantiles.values():
+            estimator.add(x)
+
+    def summary(self) -> Dict:
+        summary = {
+            "mean": self.mean,
+            "median": self.quantiles[0.5].value(),
+            # Population std, like np.std in create_evaluation_report
+            "std": float(np.sqrt(self._m2 / self.count)),
+            "min": self.min,
+            "max": self.max,
+        }
+        for q, estimator in self.quantiles.items():
+            if q != 0.5:
+                summary[f"p{round(q * 100):g}"] = estimator.value()
+        return summary
+
+
+class StreamingEvaluationReport:
+    """
+    Incremental, bounded-memory version of ``create_evaluation_report``.
+
+    Results are consumed one at a time. Each metric keeps a running mean and
+    variance (Welford), approximate quantiles (P²), and the best and worst
+    samples by the primary metric are kept in size-k heaps, so memory does
+    not grow with the number of results. Missing (None/NaN) values are
+    skipped, as in ``create_evaluation_report``.
+
+    Example:
+        >>> report = StreamingEvaluationReport(["bleu", "rouge-l"], top_k=5)
+        >>> for result in iter_results("outputs/eval.jsonl"):
+        ...     report.update(result)
+        >>> report.report()["metrics"]["bleu"]["p90"]
+    """
+
+    def __init__(
+        self,
+        metrics: List[str] = ["bleu", "rouge-1", "rouge-l"],
+        top_k: int = 1,
+        quantiles: tuple = (0.5, 0.9),
+    ):
+        self.metrics = list(metrics)
+        self.top_k = top_k
+        self.num_samples = 0
+        self._stats = {
+            metric: _RunningStats(tuple(sorted(set(quantiles) | {0.5})))
+            for metric in self.metrics
+        }
+        self._best: List[tuple] = []
+        self._worst: List[tuple] = []
+
+    def update(self, result: Dict):
+        """Add one evaluation result (a dict of metric values and details)."""
+        import heapq
+
+        index = self.num_samples
+        self.num_samples += 1
+
+        for metric, stats in self._stats.items():
+            if metric in result and not _is_missing(result[metric]):
+                stats.add(float(result[metric]))
+
+        # Like create_evaluation_report, samples without a primary metric
+        # value are not ranked
+        if not self.metrics or _is_missing(result.get(self.metrics[0])):
+            return
+
+        # Same ordering as create_evaluation_report: ties keep the first
+        # sample as best and the last one as worst
+        value = float(result[self.metrics[0]])
+        best = (value, -index, index, result)
+        worst = (-value, index, index, result)
+        for heap, entry in ((self._best, best), (self._worst, worst)):
+            if len(heap) < self.top_k:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+    def update_many(self, results) -> "StreamingEvaluationReport":
+        """Consume an iterable (e.g. a generator) of results."""
+        for result in results:
+            self.update(result)
+        return self
+
+    def report(self) -> Dict:
+        """
+        Return the report in the ``create_evaluation_report`` format.
+
+        Adds quantiles to each metric (e.g. "p90") and, when ``top_k`` > 1,
+        "best_samples" and "worst_samples" lists.
+        """
+        if self.num_samples == 0:
+            return {}
+
+        report = {
+            "num_samples": self.num_samples,
+            "metrics": {
+                metric: stats.summary()
+                for metric, stats in self._stats.items()
+                if stats.count
+            },
+        }
+
+        if self.metrics:
+            best = [e[3] for e in sorted(self._best, key=lambda e: e[:2], reverse=True)]
+            worst = [
+                e[3] for e in sorted(self._worst, key=lambda e: e[:2], reverse=True)
+            ]
+            report["best_sample"] = best[0] if best else None
+            report["worst_sample"] = worst[0] if worst else None
+            if self.top_k > 1:
+                report["best_samples"] = best
+                report["worst_samples"] = worst
+
+        return report
+
+    def __repr__(self) -> str:
+        return (
+            f"StreamingEvaluationReport(metrics={self.metrics}, "
+            f"num_samples={self.num_samples})"
+        )
+
+
+def create_streaming_evaluation_report(
+    results,
+    metrics: List[str] = ["bleu", "rouge-1", "rouge-l"],
+    top_k: int = 1,
+    quantiles: tuple = (0.5, 0.9),
+) -> Dict:
+    """
+    Create an evaluation report from an iterable of results in bounded memory.
+
+    Args:
+        results: Iterable of evaluation results, e.g. a generator over a file
+        metrics: Metrics to include in report (the first ranks best/worst)
+        top_k: Number of best and worst samples to keep
+        quantiles: Quantiles to estimate per metric (the median is always kept)
+
+    Returns:
+        Dict with aggregated statistics (``create_evaluation_report`` format)
+
+    Example:
+        >>> rows = (json.loads(line) for line in open("outputs/eval.jsonl"))
+        >>> report = create_streaming_evaluation_report(rows, top_k=10)
+    """
+    return (
+        StreamingEvaluationReport(metrics, top_k, quantiles)
+        .update_many(results)
+        .report()
+    )
+
+
+# ==================== Significance Testing ====================
+
+# Resample matrices are generated in chunks of at most this many elements
+_RESAMPLE_CHUNK_ELEMENTS = 4_000_000
+
+
+def _resample_chunks(n_resamples: int, n: int):
+    """Yield chunk sizes so each (chunk, n) matrix stays bounded in memory."""
+    chunk = max(1, _RESAMPLE_CHUNK_ELEMENTS // max(n, 1))
+    for start in range(0, n_resamples, chunk):
+        yield min(chunk, n_resamples - start)
+
+
+def _statistic_fn(statistic):
+    if callable(statistic):
+        return statistic
+    if statistic == "mean":
+        return np.mean
+    if statistic == "median":
+        return np.median
+    raise ValueError(f"Unknown statistic: {statistic}")
+
+
+def bootstrap_ci(
+    values,
+    statistic="mean",
+    n_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> Dict:
+    """
+    Percentile bootstrap confidence interval for a per-sample metric.
+
+    All resamples are drawn as one NumPy index matrix (chunked for large
+    inputs) and the statistic is computed along rows, without Python loops.
+
+    Args:
+        values: Per-sample metric values (e.g. a DataFrame column)
+        statistic: "mean", "median", or ``fn(matrix, axis=1)``
+        n_resamples: Bootstrap resamples
+        confidence: Confidence level
+        seed: Random seed for reproducible intervals
+
+    Returns:
+        Dict with estimate, low, high and confidence
+
+    Example:
+        >>> bootstrap_ci(scores["rouge-l"], seed=0)
+        {'estimate': 0.41, 'low': 0.38, 'high': 0.44, 'confidence': 0.95}
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        raise ValueError("bootstrap_ci needs at least one value")
+
+    fn = _statistic_fn(statistic)
+    rng = np.random.default_rng(seed)
+    n = len(values)
+
+    stats = np.concatenate(
+        [
+            fn(values[rng.integers(0, n, size=(size, n))], axis=1)
+            for size in _resample_chunks(n_resamples, n)
+        ]
+    )
+    alpha = (1 - confidence) / 2
+
+    return {
+        "estimate": float(fn(values)),
+        "low": float(np.quantile(stats, alpha)),
+        "high": float(np.quantile(stats, 1 - alpha)),
+        "confidence": confidence,
+    }
+
+
+def _paired_differences(a, b) -> np.ndarray:
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    if a.shape != b.shape:
+        raise ValueError(f"Paired samples differ in length: {len(a)} vs {len(b)}")
+    if a.size == 0:
+        raise ValueError("Paired tests need at least one pair")
+    return a - b
+
+
+def paired_bootstrap_ci(
+    a,
+    b,
+    n_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> Dict:
+    """
+    Paired bootstrap CI for the mean difference between two systems.
+
+    Both systems must be scored on the same samples in the same order; the
+    same resampled indices are applied to both.
+
+    Args:
+        a: Per-sample metric values for system A
+        b: Per-sample metric values for system B
+        n_resamples: Bootstrap resamples
+        confidence: Confidence level
+        seed: Random seed
+
+    Returns:
+        Dict with mean_difference (A - B), low, high, confidence and
+        prob_a_better (share of resamples where A beats B)
+
+    Example:
+        >>> paired_bootstrap_ci(scores_v2["bleu"], scores_v1["bleu"], seed=0)
+    """
+    differences = _paired_differences(a, b)
+    rng = np.random.default_rng(seed)
+    n = len(differences)
+
+    means = np.concatenate(
+        [
+            differences[rng.integers(0, n, size=(size, n))].mean(axis=1)
+            for size in _resample_chunks(n_resamples, n)
+        ]
+    )
+    alpha = (1 - confidence) / 2
+
+    return {
+        "mean_difference": float(differences.mean()),
+        "low": float(np.quantile(means, alpha)),
+        "high": float(np.quantile(means, 1 - alpha)),
+        "confidence": confidence,
+        "prob_a_better": float(np.mean(means > 0)),
+    }
+
+
+def paired_permutation_test(
+    a,
+    b,
+    n_permutations: int = 10000,
+    alternative: str = "two-sided",
+    seed: Optional[int] = None,
+) -> Dict:
+    """
+    Paired (sign-flip) permutation test for a difference in mean metric.
+
+    Under the null hypothesis the A/B labels of each pair are exchangeable,
+    so each difference keeps or flips its sign at random. Small samples
+    (2**n <= n_permutations) are tested exactly over all sign patterns.
+
+    Args:
+        a: Per-sample metric values for system A
+        b: Per-sample metric values for system B
+        n_permutations: Random sign patterns to draw
+        alternative: "two-sided", "greater" (A > B) or "less" (A < B)
+        seed: Random seed
+
+    Returns:
+        Dict with mean_difference, p_value, n_permutations and exact
+
+    Example:
+        >>> paired_permutation_test(scores_v2["rouge-l"], scores_v1["rouge-l"])["p_value"]
+    """
+    if alternative not in ("two-sided", "greater", "less"):
+        raise ValueError(f"Unknown alternative: {alternative}")
+
+    differences = _paired_differences(a, b)
+    n = len(differences)
+    observed = differences.mean()
+    exact = n <= 20 and 2**n <= n_permutations
+
+    if exact:
+        patterns = (np.arange(2**n)[:, None] >> np.arange(n)) & 1
+        stats = ((1 - 2 * patterns) * differences).mean(axis=1)
+    else:
+        rng = np.random.default_rng(seed)
+        stats = np.concatenate(
+            [
+                (rng.choice((-1.0, 1.0), size=(size, n)) * differences).mean(axis=1)
+                for size in _resample_chunks(n_permutations, n)
+            ]
+        )
+
+    # Small tolerance so floating-point ties count as "at least as extreme"
+    tolerance = 1e-12
+    if alternative == "greater":
+        extreme = np.sum(stats >= observed - tolerance)
+    elif alternative == "less":
+        extreme = np.sum(stats <= observed + tolerance)
+    else:
+        extreme = np.sum(np.abs(stats) >= abs(observed) - tolerance)
+
+    if exact:
+        p_value = extreme / len(stats)
+    else:
+        # Add-one correction: the observed labelling is one of the permutations
+        p_value = (extreme + 1) / (len(stats) + 1)
+
+    return {
+        "mean_difference": float(observed),
+        "p_value": float(p_value),
+        "n_permutations": len(stats),
+        "exact": exact,
+    }
+
+
+def compare_systems(
+    df,
+    metric: str,
+    system_col: str,
+    pair_on: List[str],
+    baseline: Optional[str] = None,
+    n_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+):
+    """
+    Compare every system against a baseline with paired significance tests.
+
+    Rows are paired across systems by the ``pair_on`` columns (e.g. the
+    sample ID, or prompt type and task); only pairs present for both
+    systems are used. Each (pair_on, system) combination must occur once.
+
+    Args:
+        df: Long-format results with one row per system and sample
+        metric: Metric column to compare
+        system_col: Column naming the system (model or prompt variant)
+        pair_on: Columns identifying a sample
+        baseline: Baseline system (default: the first system in df)
+        n_resamples: Resamples for the bootstrap and permutation test
+        confidence: Confidence level
+        seed: Random seed
+
+    Returns:
+        pd.DataFrame: One row per system with n_pairs, mean_difference,
+        ci_low, ci_high, prob_better and p_value
+
+    Raises:
+        ValueError: If several rows share a (pair_on, system) key
+
+    Example:
+        >>> df = pd.read_csv("data/samples/llm_evaluation_results.csv")
+        >>> compare_systems(df, "bleu_score", "model_name",
+        ...                 ["prompt_type", "task_category"], baseline="gpt-4")
+    """
+    import pandas as pd
+
+    # Averaging duplicates would hide their variance from the tests
+    duplicated = df.duplicated(subset=list(pair_on) + [system_col], keep=False)
+    if duplicated.any():
+        examples = df.loc[duplicated, list(pair_on) + [system_col]].drop_duplicates()
+        raise ValueError(
+            f"{int(duplicated.sum())} rows share a ({', '.join(pair_on)}, "
+            f"{system_col}) key, e.g. {examples.head(3).to_dict('records')}; "
+            "add columns to pair_on so each row is one sample"
+        )
+
+    wide = df.pivot(index=pair_on, columns=system_col, values=metric)
+    systems = list(dict.fromkeys(df[system_col]))
+    baseline = baseline if baseline is not None else systems[0]
+
+    rows = []
+    for system in systems:
+        if system == baseline:
+            continue
+        pairs = wide[[system, baseline]].dropna()
+        if pairs.empty:
+            continue
+
+        ci = paired_bootstrap_ci(
+            pairs[system], pairs[baseline], n_resamples, confidence, seed
+        )
+        test = paired_permutation_test(
+            pairs[system], pairs[baseline], n_resamples, seed=seed
+        )
+        rows.append(
+            {
+                "system": system,
+                "baseline": baseline,
+                "n_pairs": len(pairs),
+                "mean_difference": ci["mean_difference"],
+                "ci_low": ci["low"],
+                "ci_high": ci["high"],
+                "prob_better": ci["prob_a_better"],
+                "p_value": test["p_value"],
+            }
+        )
 
-    return results
+    return pd.DataFrame(rows)
@@ -0,0 +1,648 @@
+"""
+Judge Helper Functions
+
+LLM-as-judge evaluation: rubric prompt templates, concurrent judging through
+call_llm, a persistent judgment cache, structured score parsing with retries
+on malformed replies, and position-swap debiasing for pairwise comparisons.
+
+Scores come back as DataFrames whose records can be passed straight to
+``create_evaluation_report``.
+"""
+
+from typing import Callable, Dict, List, Optional, Union
+import hashlib
+import json
+import os
+import re
+
+# Appended to the prompt when a judge reply could not be parsed
+RETRY_INSTRUCTION = (
+    "\n\nYour previous reply could not be parsed: {error}. "
+    "Reply with only the JSON object described above."
+)
+
+
+class Rubric:
+    """
+    A rubric prompt for scoring a single output on several criteria.
+
+    The template may use {output}, {input}, {reference}, {criteria} and
+    {scale}. The judge is asked for a JSON object with an integer score per
+    criterion and a short rationale.
+
+    Attributes:
+        name (str): Rubric name
+        criteria (Dict[str, str]): Criterion name -> what it measures
+        scale (tuple): Lowest and highest allowed score
+        template (str): Prompt template
+    """
+
+    def __init__(
+        self,
+        name: str,
+        criteria: Dict[str, str],
+        scale: tuple = (1, 5),
+        template: Optional[str] = None,
+    ):
+        if not criteria:
+            raise ValueError("A rubric needs at least one criterion")
+
+        self.name = name
+        self.criteria = dict(criteria)
+        self.scale = tuple(scale)
+        self.template = template or DEFAULT_RUBRIC_TEMPLATE
+
+    @property
+    def metrics(self) -> List[str]:
+        """Score columns produced by judge_outputs (criteria + judge_score)."""
+        return list(self.criteria) + ["judge_score"]
+
+    def fill(
+        self, output: str, input: Optional[str] = None, reference: Optional[str] = None
+    ) -> str:
+        """Render the judge prompt for one output."""
+        low, high = self.scale
+        criteria = "\n".join(
+            f"- {name}: {description}" for name, description in self.criteria.items()
+        )
+        example = json.dumps(
+            {**{name: high for name in self.criteria}, "rationale": "..."}
+        )
+        return self.template.format(
+            output=output,
+            input=input or "(not provided)",
+            reference=reference or "(not provided)",
+            criteria=criteria,
+            scale=f"{low} (worst) to {high} (best)",
+            example=example,
+        )
+
+    def fingerprint(self) -> str:
+        """Hash of everything that affects the judgment, used for caching."""
+        raw = json.dumps(
+            [self.name, self.criteria, self.scale, self.template], sort_keys=True
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def __repr__(self) -> str:
+        return f"Rubric(name='{self.name}', criteria={list(self.criteria)})"
+
+
+DEFAULT_RUBRIC_TEMPLATE = """You are an impartial evaluator.
+Score the response below on each criterion.
+
+Task / question:
+{input}
+
+Reference answer:
+{reference}
+
+Response to evaluate:
+{output}
+
+Criteria:
+{criteria}
+
+Use integer scores from {scale}. Reply with only a JSON object, for example:
+{example}"""
+
+PAIRWISE_TEMPLATE = """You are an impartial evaluator. Compare the two responses to the task below.
+
+Task / question:
+{input}
+
+Criteria:
+{criteria}
+
+Response A:
+{output_a}
+
+Response B:
+{output_b}
+
+Do not let the order or length of the responses influence you. Reply with only a JSON object:
+{{"winner": "A" or "B" or "tie", "rationale": "..."}}"""
+
+# Built-in rubrics, usable by name
+RUBRICS: Dict[str, Rubric] = {
+    "quality": Rubric(
+        "quality",
+        {
+            "relevance": "Does the response address the task?",
+            "coherence": "Is it logically structured and consistent?",
+            "fluency": "Is the language natural and grammatically correct?",
+            "accuracy": "Is the information factually correct?",
+            "completeness": "Does it cover all necessary aspects?",
+        },
+    ),
+    "faithfulness": Rubric(
+        "faithfulness",
+        {
+            "faithfulness": "Is every claim supported by the reference answer?",
+            "completeness": "Does it include the key points of the reference?",
+        },
+    ),
+    "business": Rubric(
+        "business",
+        {
+            "actionability": "Does it give concrete, usable recommendations?",
+            "accuracy": "Are facts, figures and reasoning correct?",
+            "clarity": "Is it clear and well organized for an executive reader?",
+            "tone": "Is the tone appropriate for the business context?",
+        },
+    ),
+}
+
+
+def get_rubric(rubric: Union[str, Rubric]) -> Rubric:
+    """Return a Rubric, looking names up in RUBRICS."""
+    if isinstance(rubric, Rubric):
+        return rubric
+    if rubric not in RUBRICS:
+        raise ValueError(f"Unknown rubric: {rubric} (available: {list(RUBRICS)})")
+    return RUBRICS[rubric]
+
+
+# ==================== Parsing ====================
+
+
+def _first_json_object(text: str) -> Dict:
+    """Decode the first JSON object in text (ignoring code fences and prose)."""
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    raise ValueError("no JSON object found")
+
+
+def parse_scores(text: str, rubric: Union[str, Rubric]) -> Dict:
+    """
+    Parse a judge reply into integer scores per criterion.
+
+    Accepts a JSON object anywhere in the reply; falls back to
+    ``criterion: score`` lines.
+
+    Args:
+        text: Judge reply
+        rubric: Rubric (or name) the reply answers
+
+    Returns:
+        Dict with one score per criterion and a rationale
+
+    Raises:
+        ValueError: If a criterion is missing or outside the scale
+    """
+    rubric = get_rubric(rubric)
+    low, high = rubric.scale
+
+    try:
+        data = _first_json_object(text)
+    except ValueError:
+        data = {
+            name: match.group(1)
+            for name in rubric.criteria
+            for match in [
+                re.search(
+                    rf"{re.escape(name)}\W{{0,5}}(\d+(?:\.\d+)?)", text, re.IGNORECASE
+                )
+            ]
+            if match
+        }
+
+    lowered = {str(key).lower(): value for key, value in data.items()}
+    scores = {}
+    for name in rubric.criteria:
+        value = lowered.get(name.lower())
+        if value is None:
+            raise ValueError(f"missing score for '{name}'")
+        try:
+            score = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"score for '{name}' is not a number: {value!r}")
+        if not low <= score <= high:
+            raise ValueError(f"score for '{name}' outside {low}-{high}: {score}")
+        scores[name] = score
+
+    scores["rationale"] = str(lowered.get("rationale", ""))
+    return scores
+
+
+def parse_pairwise(text: str) -> str:
+    """
+    Parse a pairwise judge reply into "A", "B" or "tie".
+
+    Raises:
+        ValueError: If no verdict can be found
+    """
+    try:
+        winner = str(_first_json_object(text).get("winner", ""))
+    except ValueError:
+        match = re.search(r"winner\W{0,5}(A|B|tie)\b", text, re.IGNORECASE)
+        winner = match.group(1) if match else ""
+
+    winner = winner.strip().strip("\"'").lower()
+    if winner in ("a", "response a"):
+        return "A"
+    if winner in ("b", "response b"):
+        return "B"
+    if winner in ("tie", "draw", "equal"):
+        return "tie"
+    raise ValueError(f"no verdict found (winner={winner!r})")
+
+
+def _judge_with_retries(prompt: str, parse: Callable, judge_fn: Callable, retries: int):
+    """Call the judge, re-asking with the parse error until a reply parses."""
+    from .llm_helpers import is_llm_error
+
+    current = prompt
+    error = None
+    for attempt in range(1, retries + 2):
+        reply = judge_fn(current)
+        if is_llm_error(reply):
+            # Provider failures are retried with the original prompt
+            error = reply
+            continue
+        try:
+            return parse(reply), attempt
+        except ValueError as e:
+            error = str(e)
+            current = prompt + RETRY_INSTRUCTION.format(error=error)
+
+    raise RuntimeError(
+        f"Judge reply could not be parsed after {attempt} attempts: {error}"
+    )
+
+
+# ==================== Cache ====================
+
+
+class JudgmentCache:
+    """
+    Persistent cache of parsed judgments in SQLite.
+
+    Keys combine the rubric fingerprint, the judge (provider/model) and the
+    judged texts, so re-running an evaluation only judges new outputs and a
+    changed rubric never reuses stale scores.
+
+    Attributes:
+        path (str): SQLite database file
+
+    Example:
+        >>> cache = JudgmentCache("outputs/cache/judgments.sqlite")
+        >>> judge_outputs(outputs, rubric="quality", cache=cache)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            "JUDGE_CACHE_PATH", "outputs/cache/judgments.sqlite"
+        )
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS judgments ("
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL)"
+            )
+
+    def _connect(self):
+        import sqlite3
+
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT result FROM judgments WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, result: Dict):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO judgments VALUES (?, ?)",
+                (key, json.dumps(result)),
+            )
+
+    def __len__(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM judgments").fetchone()[0]
+
+    def __repr__(self) -> str:
+        return f"JudgmentCache(path='{self.path}')"
+
+
+def _resolve_cache(cache) -> Optional[JudgmentCache]:
+    if cache is True:
+        return JudgmentCache()
+    if cache is False or cache is None:
+        return None
+    return cache
+
+
+def _default_judge(provider: Optional[str], model: Optional[str], **kwargs):
+    from .llm_helpers import call_llm
+
+    kwargs.setdefault("temperature", 0)
+
+    def judge(prompt: str) -> str:
+        return call_llm(prompt, provider=provider, model=model, **kwargs)
+
+    return judge
+
+
+def _run_concurrently(fn: Callable, items: List, max_workers: int) -> List:
+    """Apply fn to each item on a thread pool, preserving order."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+def _broadcast(values, n: int, name: str) -> List:
+    if values is None or isinstance(values, str):
+        return [values] * n
+    values = list(values)
+    if len(values) != n:
+        raise ValueError(f"Got {len(values)} {name} for {n} outputs")
+    return values
+
+
+# ==================== Rubric Judging ====================
+
+
+def judge_outputs(
+    outputs: List[str],
+    rubric: Union[str, Rubric] = "quality",
+    inputs: Optional[Union[str, List[str]]] = None,
+    references: Optional[Union[str, List[str]]] = None,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    judge_fn: Optional[Callable[[str], str]] = None,
+    cache: Union[bool, JudgmentCache] = True,
+    max_workers: int = 8,
+    max_retries: int = 2,
+    **kwargs,
+):
+    """
+    Score outputs with an LLM judge against a rubric.
+
+    Identical (output, input, reference) triples are judged once, cached
+    judgments are reused, and the rest are judged concurrently. Replies that
+    do not parse are retried with the parse error appended to the prompt.
+
+    Args:
+        outputs: Outputs to judge
+        rubric: Rubric or name from RUBRICS
+        inputs: Task/question per output (or one for all)
+        references: Reference answer per output (or one for all)
+        provider: LLM provider for the judge (see call_llm)
+        model: Judge model
+        judge_fn: Custom ``fn(prompt) -> reply`` instead of call_llm
+        cache: True (default cache), False, or a JudgmentCache
+        max_workers: Concurrent judge requests
+        max_retries: Extra attempts for malformed or failed replies
+        **kwargs: Additional arguments for call_llm (temperature defaults to 0)
+
+    Returns:
+        pd.DataFrame: One row per output with a score column per criterion,
+        judge_score (mean of the criteria), rationale, attempts, cached and
+        error. Failed judgments have NaN scores.
+
+    Example:
+        >>> df = judge_outputs(responses, rubric="quality", inputs=questions)
+        >>> rubric = get_rubric("quality")
+        >>> create_evaluation_report(df.to_dict("records"), metrics=rubric.metrics)
+    """
+    import pandas as pd
+
+    rubric = get_rubric(rubric)
+    outputs = list(outputs)
+    inputs = _broadcast(inputs, len(outputs), "inputs")
+    references = _broadcast(references, len(outputs), "references")
+    cache = _resolve_cache(cache)
+    judge = judge_fn or _default_judge(provider, model, **kwargs)
+    judge_id = "custom" if judge_fn else [provider or os.getenv("LLM_PROVIDER"), model]
+
+    items = list(dict.fromkeys(zip(outputs, inputs, references)))
+
+    def judge_one(item) -> Dict:
+        output, input, reference = item
+        key = JudgmentCache.make_key(
+            rubric.fingerprint(), judge_id, output, input, reference
+        )
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return {**cached, "attempts": 0, "cached": True, "error": None}
+
+        prompt = rubric.fill(output, input, reference)
+        try:
+            scores, attempts = _judge_with_retries(
+                prompt, lambda reply: parse_scores(reply, rubric), judge, max_retries
+            )
+        except RuntimeError as e:
+            failed = {name: float("nan") for name in rubric.criteria}
+            return {
+                **failed,
+                "rationale": "",
+                "attempts": max_retries + 1,
+                "cached": False,
+                "error": str(e),
+            }
+
+        if cache is not None:
+            cache.put(key, scores)
+        return {**scores, "attempts": attempts, "cached": False, "error": None}
+
+    judged = dict(zip(items, _run_concurrently(judge_one, items, max_workers)))
+
+    rows = []
+    for item in zip(outputs, inputs, references):
+        result = judged[item]
+        scores = [result[name] for name in rubric.criteria]
+        rows.append(
+            {
+                "output": item[0],
+                **{name: result[name] for name in rubric.criteria},
+                "judge_score": sum(scores) / len(scores),
+                "rationale": result["rationale"],
+                "attempts": result["attempts"],
+                "cached": result["cached"],
+                "error": result["error"],
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+def judge_output(
+    output: str,
+    rubric: Union[str, Rubric] = "quality",
+    input: Optional[str] = None,
+    reference: Optional[str] = None,
+    **kwargs,
+) -> Dict:
+    """
+    Score a single output against a rubric.
+
+    Args:
+        output: Output to judge
+        rubric: Rubric or name from RUBRICS
+        input: Task/question
+        reference: Reference answer
+        **kwargs: Arguments for judge_outputs
+
+    Returns:
+        Dict with the scores, judge_score and rationale
+
+    Example:
+        >>> judge_output(response, "business", input=prompt)["judge_score"]
+        4.25
+    """
+    df = judge_outputs([output], rubric, [input], [reference], **kwargs)
+    return df.iloc[0].to_dict()
+
+
+# ==================== Pairwise Judging ====================
+
+
+def judge_pairwise(
+    outputs_a: List[str],
+    outputs_b: List[str],
+    inputs: Optional[Union[str, List[str]]] = None,
+    rubric: Union[str, Rubric] = "quality",
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    judge_fn: Optional[Callable[[str], str]] = None,
+    cache: Union[bool, JudgmentCache] = True,
+    max_workers: int = 8,
+    max_retries: int = 2,
+    swap: bool = True,
+    **kwargs,
+):
+    """
+    Compare two sets of outputs pairwise with an LLM judge.
+
+    With ``swap=True`` each pair is judged twice, once in each order, to
+    cancel the judge's position bias: a verdict only counts if it survives
+    the swap, otherwise the pair is scored as a tie.
+
+    Args:
+        outputs_a: Outputs of system A
+        outputs_b: Outputs of system B (same order as outputs_a)
+        inputs: Task/question per pair (or one for all)
+        rubric: Rubric whose criteria guide the comparison
+        provider: LLM provider for the judge
+        model: Judge model
+        judge_fn: Custom ``fn(prompt) -> reply`` instead of call_llm
+        cache: True (default cache), False, or a JudgmentCache
+        max_workers: Concurrent judge requests
+        max_retries: Extra attempts for malformed or failed replies
+        swap: Also judge with the responses swapped
+        **kwargs: Additional arguments for call_llm (temperature defaults to 0)
+
+    Returns:
+        pd.DataFrame: One row per pair with winner ("A", "B" or "tie"),
+        score_a (1 win, 0.5 tie, 0 loss), consistent (verdict survived the
+        swap) and error
+
+    Example:
+        >>> df = judge_pairwise(new_prompt_outputs, old_prompt_outputs, questions)
+        >>> df["score_a"].mean()  # win rate of the new prompt
+    """
+    import pandas as pd
+
+    rubric = get_rubric(rubric)
+    outputs_a, outputs_b = list(outputs_a), list(outputs_b)
+    if len(outputs_a) != len(outputs_b):
+        raise ValueError(
+            f"Got {len(outputs_a)} A outputs and {len(outputs_b)} B outputs"
+        )
+
+    inputs = _broadcast(inputs, len(outputs_a), "inputs")
+    cache = _resolve_cache(cache)
+    judge = judge_fn or _default_judge(provider, model, **kwargs)
+    judge_id = "custom" if judge_fn else [provider or os.getenv("LLM_PROVIDER"), model]
+    criteria = "\n".join(
+        f"- {name}: {description}" for name, description in rubric.criteria.items()
+    )
+
+    # Each (first, second, input) ordering is one judgment
+    orderings = [(a, b, x) for a, b, x in zip(outputs_a, outputs_b, inputs)]
+    if swap:
+        orderings += [(b, a, x) for a, b, x in zip(outputs_a, outputs_b, inputs)]
+    orderings = list(dict.fromkeys(orderings))
+
+    def judge_one(ordering) -> Dict:
+        first, second, input = ordering
+        key = JudgmentCache.make_key(
+            "pairwise", rubric.fingerprint(), judge_id, first, second, input
+        )
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return {**cached, "error": None}
+
+        prompt = PAIRWISE_TEMPLATE.format(
+            input=input or "(not provided)",
+            criteria=criteria,
+            output_a=first,
+            output_b=second,
+        )
+        try:
+            winner, _ = _judge_with_retries(prompt, parse_pairwise, judge, max_retries)
+        except RuntimeError as e:
+            return {"winner": None, "error": str(e)}
+
+        if cache is not None:
+            cache.put(key, {"winner": winner})
+        return {"winner": winner, "error": None}
+
+    verdicts = dict(
+        zip(orderings, _run_concurrently(judge_one, orderings, max_workers))
+    )
+
+    rows = []
+    for a, b, x in zip(outputs_a, outputs_b, inputs):
+        forward = verdicts[(a, b, x)]
+        votes = [forward["winner"]]
+        errors = [forward["error"]]
+        if swap:
+            backward = verdicts[(b, a, x)]
+            # Map the swapped verdict back to the original labels
+            votes.append(
+                {"A": "B", "B": "A"}.get(backward["winner"], backward["winner"])
+            )
+            errors.append(backward["error"])
+
+        if None in votes:
+            winner, consistent = None, False
+        else:
+            consistent = len(set(votes)) == 1
+            winner = votes[0] if consistent else "tie"
+
+        rows.append(
+            {
+                "output_a": a,
+                "output_b": b,
+                "winner": winner,
+                "score_a": {"A": 1.0, "tie": 0.5, "B": 0.0}.get(winner, float("nan")),
+                "consistent": consistent,
+                "error": next((e for e in errors if e), None),
+            }
+        )
+
+    return pd.DataFrame(rows)
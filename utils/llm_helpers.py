@@ -5,9 +5,149 @@ Utilities for working with Large Language Models in notebooks.
 """
 
 import tiktoken
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
+from collections import deque
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
 import time
 
+from .cassette_helpers import recordable
+from .metrics_helpers import metrics_enabled, record_llm_request
+from .tracing_helpers import trace_span, traced, tracing_enabled
+
+logger = logging.getLogger(__name__)
+
+# ==================== Tokenizer Cache ====================
+
+# BPE files tiktoken downloads on first use of each encoding
+TIKTOKEN_ENCODING_URLS = {
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+    "p50k_base": "https://openaipublic.blob.core.windows.net/encodings/p50k_base.tiktoken",
+    "r50k_base": "https://openaipublic.blob.core.windows.net/encodings/r50k_base.tiktoken",
+}
+
+# Project-local cache used when TIKTOKEN_CACHE_DIR is not set
+DEFAULT_TIKTOKEN_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "tiktoken_cache",
+)
+
+
+def _tiktoken_cache_dir() -> str:
+    """
+    Return tiktoken's cache directory, pointing it at the project cache if unset.
+
+    tiktoken reads TIKTOKEN_CACHE_DIR itself whenever it loads an encoding, so
+    the default is only set here, on the first tokenizer use, rather than when
+    the module is imported.
+    """
+    return os.environ.setdefault("TIKTOKEN_CACHE_DIR", DEFAULT_TIKTOKEN_CACHE_DIR)
+
+
+def tiktoken_cache_path(encoding_name: str) -> str:
+    """Return the file tiktoken caches an encoding under (TIKTOKEN_CACHE_DIR/sha1(url))."""
+    url = TIKTOKEN_ENCODING_URLS[encoding_name]
+    return os.path.join(_tiktoken_cache_dir(), hashlib.sha1(url.encode()).hexdigest())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str):
+    """
+    Load a tiktoken encoding once per process.
+
+    Sets TIKTOKEN_CACHE_DIR to ``DEFAULT_TIKTOKEN_CACHE_DIR`` if it is unset.
+    With TIKTOKEN_OFFLINE=1, an encoding missing from the cache raises
+    immediately instead of attempting a download that hangs without network.
+    """
+    cache_dir = _tiktoken_cache_dir()
+    if (
+        os.getenv("TIKTOKEN_OFFLINE", "0") == "1"
+        and encoding_name in TIKTOKEN_ENCODING_URLS
+        and not os.path.exists(tiktoken_cache_path(encoding_name))
+    ):
+        raise RuntimeError(
+            f"tiktoken encoding {encoding_name} is not cached in "
+            f"{cache_dir}; run scripts/warm_tiktoken_cache.py"
+        )
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def warm_tiktoken_cache(
+    encodings: List[str] = ("cl100k_base", "o200k_base"),
+    source_dir: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Make encodings available offline and load them into memory.
+
+    Files in ``source_dir`` named ``<encoding>.tiktoken`` (e.g. copied into an
+    air-gapped image) are seeded into the cache first and must load as that
+    encoding; anything still missing is downloaded once.
+
+    Args:
+        encodings: Encoding names to prepare
+        source_dir: Optional directory with pre-downloaded ``.tiktoken`` files
+
+    Returns:
+        Dict mapping encoding name to its cache file
+
+    Raises:
+        RuntimeError: If a seed file does not load as its encoding
+
+    Example:
+        >>> warm_tiktoken_cache(source_dir="vendor/tiktoken")
+        {'cl100k_base': 'data/tiktoken_cache/9b5ad71b...', ...}
+    """
+    import shutil
+
+    os.makedirs(_tiktoken_cache_dir(), exist_ok=True)
+    cached = {}
+
+    for name in encodings:
+        path = tiktoken_cache_path(name)
+        seed = os.path.join(source_dir, f"{name}.tiktoken") if source_dir else None
+        if seed and os.path.exists(seed) and not os.path.exists(path):
+            shutil.copyfile(seed, path)
+            _check_seed(name, seed, path)
+
+        _get_encoding(name)
+        cached[name] = path
+
+    return cached
+
+
+def _check_seed(encoding_name: str, seed: str, path: str):
+    """Load a freshly seeded encoding, removing the cache file if tiktoken rejects it."""
+    import filecmp
+
+    try:
+        tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+        raise RuntimeError(
+            f"Seed file {seed} does not load as {encoding_name}: {str(e)}"
+        ) from e
+
+    # tiktoken silently replaces a cache file that fails its hash check with
+    # a fresh download, so a bad seed can "load" without being used
+    if not os.path.exists(path) or not filecmp.cmp(seed, path, shallow=False):
+        raise RuntimeError(f"Seed file {seed} failed the {encoding_name} hash check")
+
+
+def _encoding_name(model: str) -> str:
+    """Return the tiktoken encoding for a model (cl100k_base if tiktoken does not know it)."""
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return "cl100k_base"
+
 
 def count_tokens(text: str, model: str = "gpt-4") -> int:
     """
@@ -24,14 +164,19 @@ def count_tokens(text: str, model: str = "gpt-4") -> int:
         >>> count_tokens("Hello, how are you?")
         5
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = _get_encoding(_encoding_name(model))
 
     return len(encoding.encode(text))
 
 
+def _safe_count_tokens(text: str) -> int:
+    """Count tokens for sizing decisions, estimating if tiktoken is unavailable."""
+    try:
+        return count_tokens(text)
+    except Exception:
+        return estimate_tokens(text)
+
+
 def estimate_cost(
     input_tokens: int, output_tokens: int, model: str = "gpt-4"
 ) -> Dict[str, float]:
@@ -224,304 +369,1829 @@ def calculate_cost_comparison(
     return comparison
 
 
-# ==================== Local LLM (Ollama) Support ====================
+# ==================== Token Estimation ====================
+
+# Linear token models per tokenizer family, over the features of
+# _token_features: (words, word characters, symbols, extra UTF-8 bytes).
+# "error" is the relative error bound; "measured" is True once it is the
+# maximum relative error observed against the real tokenizer (see
+# calibrate_token_estimator and scripts/calibrate_token_estimator.py) rather
+# than a rough prior. "encoding" is the tiktoken encoding used for exact
+# counts (None when tiktoken does not model the tokenizer).
+TOKEN_ESTIMATOR_FAMILIES = {
+    "cl100k": {
+        "coefficients": (0.55, 0.10, 0.85, 0.55),
+        "error": 0.15,
+        "measured": False,
+        "encoding": "cl100k_base",
+    },
+    "o200k": {
+        "coefficients": (0.55, 0.09, 0.80, 0.35),
+        "error": 0.15,
+        "measured": False,
+        "encoding": "o200k_base",
+    },
+    "claude": {
+        "coefficients": (0.60, 0.11, 0.90, 0.60),
+        "error": 0.20,
+        "measured": False,
+        "encoding": None,
+    },
+    "llama": {
+        "coefficients": (0.70, 0.14, 1.00, 0.90),
+        "error": 0.20,
+        "measured": False,
+        "encoding": None,
+    },
+    "llama3": {
+        "coefficients": (0.55, 0.09, 0.85, 0.45),
+        "error": 0.15,
+        "measured": False,
+        "encoding": None,
+    },
+}
+
+# Relative band around the estimate inside which fits_token_limit does not
+# trust an unmeasured error bound and counts exactly instead
+_UNMEASURED_TOKEN_BAND = 0.5
+
+# Slack added to both bounds so very short texts stay covered
+_TOKEN_ESTIMATE_SLACK = 2
+
+_WORD_RE = re.compile(r"\w+")
+_SYMBOL_RE = re.compile(r"[^\w\s]")
+
+
+def token_family(model: str) -> str:
+    """
+    Map a model name to its tokenizer family in ``TOKEN_ESTIMATOR_FAMILIES``.
 
+    Example:
+        >>> token_family("llama2:7b")
+        'llama'
+    """
+    name = (model or "").lower()
 
-def call_local_llm(
-    prompt: str,
-    model: str = "llama2:7b",
-    temperature: float = 0.7,
-    max_tokens: int = 500,
-    options: Optional[Dict] = None,
-) -> str:
+    if name.startswith(("gpt-4o", "gpt-4.1", "o1", "o3", "o4")):
+        return "o200k"
+    if name.startswith("claude"):
+        return "claude"
+    if name.startswith(("llama3", "llama-3")):
+        return "llama3"
+    if name.startswith(("llama", "mistral", "mixtral", "vicuna", "codellama")):
+        return "llama"
+    return "cl100k"
+
+
+def _token_features(text: str) -> tuple:
+    """Cheap statistics that track BPE token counts."""
+    words = _WORD_RE.findall(text)
+    symbols = len(_SYMBOL_RE.findall(text))
+    extra_bytes = 0 if text.isascii() else len(text.encode("utf-8")) - len(text)
+    return (len(words), sum(map(len, words)), symbols, extra_bytes)
+
+
+def estimate_token_bounds(text: str, model: str = "gpt-4") -> Dict:
     """
-    Call local LLM via Ollama.
+    Estimate a token count with its error bounds, without tokenizing.
 
     Args:
-        prompt: The prompt text
-        model: Ollama model name
-        temperature: Sampling temperature
-        max_tokens: Maximum tokens to generate
-        options: Additional Ollama options
+        text: The text to estimate
+        model: Model name (selects the calibrated tokenizer family)
 
     Returns:
-        str: Generated text
+        Dict with estimate, low and high token counts, the family used, and
+        whether the family's error bound was measured
 
     Example:
-        >>> response = call_local_llm("Explain AI", model="llama2:7b")
+        >>> estimate_token_bounds("Hello, how are you?")
+        {'estimate': 5, 'low': 2, 'high': 9, 'family': 'cl100k', 'measured': False}
     """
-    import requests
-    import os
-
-    base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    family = token_family(model)
+    spec = TOKEN_ESTIMATOR_FAMILIES[family]
+    raw = sum(c * f for c, f in zip(spec["coefficients"], _token_features(text)))
 
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-        "options": options or {},
+    return {
+        "estimate": int(round(raw)),
+        **_token_bounds(raw, spec["error"]),
+        "family": family,
+        "measured": bool(spec.get("measured")),
     }
 
-    if temperature:
-        payload["options"]["temperature"] = temperature
-    if max_tokens:
-        payload["options"]["num_predict"] = max_tokens
 
-    try:
-        response = requests.post(f"{base_url}/api/generate", json=payload, timeout=120)
-        response.raise_for_status()
-        return response.json().get("response", "")
-    except Exception as e:
-        return f"Error calling local LLM: {str(e)}"
+def _token_bounds(raw: float, error: float) -> Dict:
+    import math
+
+    return {
+        "low": max(0, int(raw * (1 - error)) - _TOKEN_ESTIMATE_SLACK),
+        "high": int(math.ceil(raw * (1 + error))) + _TOKEN_ESTIMATE_SLACK,
+    }
 
 
-def chat_local_llm(
-    messages: List[Dict],
-    model: str = "llama2:7b",
-    temperature: float = 0.7,
-    max_tokens: int = 500,
-) -> str:
+def estimate_tokens(text: str, model: str = "gpt-4") -> int:
     """
-    Chat with local LLM using message format.
+    Estimate the number of tokens in a text from byte and word statistics.
+
+    Much faster than exact encoding for large documents, and covers
+    tokenizers tiktoken does not model (Claude, llama). Accuracy is within
+    the family's ``error`` in ``TOKEN_ESTIMATOR_FAMILIES``; use
+    ``fits_token_limit`` when a hard limit matters.
 
     Args:
-        messages: List of message dicts with 'role' and 'content'
-        model: Ollama model name
-        temperature: Sampling temperature
-        max_tokens: Maximum tokens to generate
+        text: The text to estimate
+        model: Model name (selects the calibrated tokenizer family)
 
     Returns:
-        str: Assistant response
+        int: Estimated number of tokens
 
     Example:
-        >>> messages = [
-        ...     {"role": "user", "content": "Hello!"}
-        ... ]
-        >>> response = chat_local_llm(messages)
+        >>> estimate_tokens("Explain prompt engineering", model="llama2:7b")
+        5
     """
-    import requests
-    import os
+    return estimate_token_bounds(text, model)["estimate"]
 
-    base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": False,
-        "options": {"temperature": temperature, "num_predict": max_tokens},
-    }
+def _count_with_encoding(encoding_name: str, text: str) -> int:
+    return len(_get_encoding(encoding_name).encode(text))
 
-    try:
-        response = requests.post(f"{base_url}/api/chat", json=payload, timeout=120)
-        response.raise_for_status()
-        return response.json().get("message", {}).get("content", "")
-    except Exception as e:
-        return f"Error calling local LLM: {str(e)}"
 
+def fits_token_limit(
+    text: str,
+    limit: int,
+    model: str = "gpt-4",
+    count_fn: Optional[Callable[[str], int]] = None,
+) -> bool:
+    """
+    Check whether a text fits in ``limit`` tokens, counting exactly only near it.
+
+    The estimate's error bounds settle most texts. Only when the limit falls
+    inside the bounds is the text tokenized, with ``count_fn`` or the family's
+    tiktoken encoding. Until a family's error bound has been measured, the
+    bounds are widened to ``_UNMEASURED_TOKEN_BAND``, and without an exact
+    tokenizer a text inside them is only accepted if even the upper bound fits.
 
-def stream_local_llm(prompt: str, model: str = "llama2:7b"):
+    Args:
+        text: The text to check
+        limit: Token limit (e.g. context window minus the completion budget)
+        model: Model name
+        count_fn: Optional exact token counter for this model
+
+    Returns:
+        bool: True if the text fits
+
+    Example:
+        >>> fits_token_limit(document, 8000, model="gpt-4")
+        True
     """
-    Stream responses from local LLM.
+    bounds = estimate_token_bounds(text, model)
+    if not bounds["measured"]:
+        spec = TOKEN_ESTIMATOR_FAMILIES[bounds["family"]]
+        raw = sum(c * f for c, f in zip(spec["coefficients"], _token_features(text)))
+        bounds.update(_token_bounds(raw, max(spec["error"], _UNMEASURED_TOKEN_BAND)))
+
+    if bounds["high"] <= limit:
+        return True
+    if bounds["low"] > limit:
+        return False
+
+    if count_fn is None:
+        encoding = TOKEN_ESTIMATOR_FAMILIES[bounds["family"]]["encoding"]
+        if encoding is not None:
+            count_fn = functools.partial(_count_with_encoding, encoding)
+
+    if count_fn is not None:
+        try:
+            return count_fn(text) <= limit
+        except Exception as e:
+            logger.debug("Exact token count failed, using estimate: %s", e)
+
+    if not bounds["measured"]:
+        return bounds["high"] <= limit
+    return bounds["estimate"] <= limit
+
+
+def calibrate_token_estimator(
+    texts: List[str],
+    model: str = "gpt-4",
+    count_fn: Optional[Callable[[str], int]] = None,
+    quantile: float = 1.0,
+    update: bool = True,
+) -> Dict:
+    """
+    Fit the estimator for a model's tokenizer family against a real tokenizer.
 
     Args:
-        prompt: The prompt text
-        model: Ollama model name
+        texts: Representative sample texts (a few hundred is plenty)
+        model: Model name whose family is calibrated
+        count_fn: Exact token counter (default: ``count_tokens`` for the model)
+        quantile: Quantile of relative errors used as the new error bound
+                  (1.0, the default, uses the maximum observed error)
+        update: Store the fit in ``TOKEN_ESTIMATOR_FAMILIES`` and mark the
+                family's error bound as measured
 
-    Yields:
-        str: Text chunks
+    Returns:
+        Dict with family, coefficients, error, max_error and samples
 
     Example:
-        >>> for chunk in stream_local_llm("Write a story"):
-        ...     print(chunk, end='')
+        >>> from transformers import AutoTokenizer
+        >>> tok = AutoTokenizer.from_pretrained("meta-llama/Llama-2-7b-hf")
+        >>> calibrate_token_estimator(
+        ...     samples, "llama2:7b", count_fn=lambda t: len(tok.encode(t))
+        ... )
     """
-    import requests
-    import os
-    import json
+    import numpy as np
 
-    base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    family = token_family(model)
+    if count_fn is None:
+        count_fn = functools.partial(count_tokens, model=model)
 
-    payload = {"model": model, "prompt": prompt, "stream": True}
+    texts = [t for t in texts if t]
+    features = np.array([_token_features(t) for t in texts], dtype=float)
+    actual = np.array([count_fn(t) for t in texts], dtype=float)
 
-    try:
-        response = requests.post(
-            f"{base_url}/api/generate", json=payload, stream=True, timeout=120
+    coefficients, *_ = np.linalg.lstsq(features, actual, rcond=None)
+    coefficients = np.round(np.clip(coefficients, 0.0, None), 4)
+
+    predicted = features @ coefficients
+    relative = np.abs(predicted - actual) / np.maximum(actual, 1.0)
+
+    fit = {
+        "family": family,
+        "coefficients": tuple(float(c) for c in coefficients),
+        "error": round(float(np.quantile(relative, quantile)), 4),
+        "max_error": round(float(relative.max()), 4),
+        "samples": len(texts),
+    }
+
+    if update:
+        TOKEN_ESTIMATOR_FAMILIES[family].update(
+            coefficients=fit["coefficients"], error=fit["error"], measured=True
         )
-        response.raise_for_status()
 
-        for line in response.iter_lines():
-            if line:
-                chunk = json.loads(line)
-                if "response" in chunk:
-                    yield chunk["response"]
-    except Exception as e:
-        yield f"Error: {str(e)}"
+    return fit
 
 
-# ==================== Azure OpenAI Support ====================
+# ==================== Corpus Token Counting ====================
 
+# Large files are read and encoded in blocks of about this many characters
+_CORPUS_BLOCK_CHARS = 1 << 20
 
-def call_azure_openai(
-    prompt: str,
-    deployment: str = "gpt-4",
-    temperature: float = 0.7,
-    max_tokens: int = 500,
-) -> str:
+
+def _block_boundary(text: str) -> int:
     """
-    Call Azure OpenAI Service.
+    Return the index after the last newline that starts a new pre-token.
+
+    tiktoken's pre-tokenizer never merges across a newline followed by
+    non-whitespace, so encoding the two sides separately gives the same count.
+    """
+    end = len(text) - 1
+    while end > 0:
+        index = text.rfind("\n", 0, end)
+        if index < 0:
+            return -1
+        if not text[index + 1].isspace():
+            return index + 1
+        end = index
+    return -1
+
+
+def _count_text_tokens(text: str, encoding) -> int:
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode_ordinary(text))
+
+
+def _count_file_tokens(path: str, encoding) -> int:
+    """Count a file's tokens block by block, so no full token list is held."""
+    total = 0
+    buffer = ""
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(_CORPUS_BLOCK_CHARS)
+            if not block:
+                break
+            buffer += block
+            cut = _block_boundary(buffer)
+            if cut > 0:
+                total += _count_text_tokens(buffer[:cut], encoding)
+                buffer = buffer[cut:]
+
+    return total + _count_text_tokens(buffer, encoding)
+
+
+def _count_tokens_batch(documents: List[str], encoding_name: str, files: bool):
+    """Worker: count one batch of documents (or file paths)."""
+    try:
+        encoding = _get_encoding(encoding_name)
+    except Exception:
+        # No tokenizer files available offline; estimate instead
+        encoding = None
+
+    if files:
+        counts = [_count_file_tokens(path, encoding) for path in documents]
+    else:
+        counts = [_count_text_tokens(text, encoding) for text in documents]
+
+    return counts, encoding is None
+
+
+def count_tokens_corpus(
+    documents,
+    model: str = "gpt-4",
+    files: bool = False,
+    max_workers: Optional[int] = None,
+    batch_size: int = 32,
+) -> Dict:
+    """
+    Count tokens for a large corpus in parallel.
+
+    Documents are streamed to a process pool in batches, with a bounded number
+    of batches in flight, so neither the corpus nor any token list has to fit
+    in memory at once. Counts are returned in input order.
 
     Args:
-        prompt: The prompt text
-        deployment: Azure deployment name
-        temperature: Sampling temperature
-        max_tokens: Maximum tokens to generate
+        documents: Iterable of texts (e.g. a DataFrame column), or of file
+                   paths when ``files=True``
+        model: Model name (for tokenizer selection)
+        files: Treat documents as paths and read them inside the workers
+        max_workers: Worker processes (default: CPU count; 1 runs in-process)
+        batch_size: Documents per task sent to a worker
 
     Returns:
-        str: Generated text
+        Dict with per-document counts, total, documents, max_tokens,
+        mean_tokens and estimated (True if tiktoken was unavailable)
 
     Example:
-        >>> response = call_azure_openai("Explain AI", deployment="gpt-4")
+        >>> result = count_tokens_corpus(df["content"], model="gpt-4")
+        >>> df["tokens"] = result["counts"]
+        >>> count_tokens_corpus(["class_content.txt"], files=True)["total"]
     """
-    try:
-        from openai import AzureOpenAI
-        import os
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import islice
 
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        )
+    encoding_name = _encoding_name(model)
 
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+    if files:
+        documents = (os.fspath(path) for path in documents)
+    else:
+        # Missing values (None/NaN) in DataFrame columns count as empty
+        documents = (doc if isinstance(doc, str) else "" for doc in documents)
+
+    batches = iter(lambda: list(islice(documents, batch_size)), [])
+    max_workers = max_workers or os.cpu_count() or 1
+    counts: List[int] = []
+    estimated = False
+
+    if max_workers == 1:
+        for batch in batches:
+            batch_counts, batch_estimated = _count_tokens_batch(
+                batch, encoding_name, files
+            )
+            counts.extend(batch_counts)
+            estimated = estimated or batch_estimated
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(
+                    pool.submit(_count_tokens_batch, batch, encoding_name, files)
+                )
+                # Keep the pool busy without reading the whole corpus ahead
+                while len(pending) >= max_workers * 2 or (
+                    pending and pending[0].done()
+                ):
+                    batch_counts, batch_estimated = pending.popleft().result()
+                    counts.extend(batch_counts)
+                    estimated = estimated or batch_estimated
+            for future in pending:
+                batch_counts, batch_estimated = future.result()
+                counts.extend(batch_counts)
+                estimated = estimated or batch_estimated
+
+    total = sum(counts)
 
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error calling Azure OpenAI: {str(e)}"
+    return {
+        "counts": counts,
+        "total": total,
+        "documents": len(counts),
+        "max_tokens": max(counts, default=0),
+        "mean_tokens": total / len(counts) if counts else 0.0,
+        "estimated": estimated,
+    }
 
 
-def chat_azure_openai(
-    messages: List[Dict],
-    deployment: str = "gpt-4",
-    temperature: float = 0.7,
-    max_tokens: int = 500,
+# ==================== Token Truncation and Splitting ====================
+
+_SENTENCE_TERMINATORS = (b".", b"!", b"?", b'."', b'!"', b'?"', b".)", b".'")
+
+
+def _sentence_ends(token_bytes: List[bytes]) -> List[int]:
+    """
+    Token positions where a sentence (or line) ends.
+
+    A position ``i`` means a cut between tokens ``i - 1`` and ``i``: after a
+    newline, or after terminal punctuation followed by whitespace.
+    """
+    ends = []
+    last = len(token_bytes) - 1
+    for i, piece in enumerate(token_bytes):
+        if b"\n" in piece:
+            ends.append(i + 1)
+        elif piece.rstrip().endswith(_SENTENCE_TERMINATORS) and (
+            i == last or piece[-1:].isspace() or token_bytes[i + 1][:1].isspace()
+        ):
+            ends.append(i + 1)
+    return ends
+
+
+def _char_boundary(token_bytes: List[bytes], position: int, lowest: int) -> int:
+    """Move a cut back so it does not fall inside a multi-byte UTF-8 character."""
+    cut = position
+    while cut > lowest and cut < len(token_bytes) and token_bytes[cut][:1]:
+        if token_bytes[cut][0] & 0xC0 != 0x80:
+            return cut
+        cut -= 1
+    return cut if cut > lowest else position
+
+
+def _decode_span(token_bytes: List[bytes], start: int, end: int) -> str:
+    return b"".join(token_bytes[start:end]).decode("utf-8", errors="replace")
+
+
+def truncate_to_tokens(
+    text: str,
+    max_tokens: int,
+    model: str = "gpt-4",
+    respect_sentences: bool = False,
 ) -> str:
     """
-    Chat with Azure OpenAI using message format.
+    Return the longest prefix of a text that fits in ``max_tokens`` tokens.
+
+    The text is encoded once and the token array is sliced, instead of
+    repeatedly counting shrinking strings.
 
     Args:
-        messages: List of message dicts
-        deployment: Azure deployment name
-        temperature: Sampling temperature
-        max_tokens: Maximum tokens
+        text: The text to truncate
+        max_tokens: Maximum number of tokens to keep
+        model: Model name (for tokenizer selection)
+        respect_sentences: Cut at the last sentence end that fits (falls back
+                           to a hard cut if the first sentence is too long)
 
     Returns:
-        str: Assistant response
+        str: The truncated text (unchanged if it already fits)
+
+    Example:
+        >>> truncate_to_tokens(document, 1000, respect_sentences=True)
     """
-    try:
-        from openai import AzureOpenAI
-        import os
+    encoding = _get_encoding(_encoding_name(model))
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
 
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        )
+    token_bytes = encoding.decode_tokens_bytes(tokens)
+    cut = max_tokens
 
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+    if respect_sentences:
+        import bisect
 
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error calling Azure OpenAI: {str(e)}"
+        ends = _sentence_ends(token_bytes)
+        index = bisect.bisect_right(ends, max_tokens) - 1
+        if index >= 0:
+            cut = ends[index]
 
+    cut = _char_boundary(token_bytes, cut, 0)
 
-def get_azure_embeddings(
-    texts: List[str], deployment: str = "text-embedding-ada-002"
-) -> List[List[float]]:
+    return _decode_span(token_bytes, 0, cut)
+
+
+def split_by_tokens(
+    text: str,
+    max_tokens: int,
+    model: str = "gpt-4",
+    overlap: int = 0,
+    respect_sentences: bool = False,
+) -> List[str]:
     """
-    Get embeddings from Azure OpenAI.
+    Split a text into pieces of at most ``max_tokens`` tokens.
+
+    The text is encoded once; each piece is a slice of the token array.
+    Consecutive pieces share ``overlap`` tokens, which helps retrieval chunks
+    keep context across their edges.
 
     Args:
-        texts: List of texts to embed
-        deployment: Azure embedding deployment name
+        text: The text to split
+        max_tokens: Maximum tokens per piece
+        model: Model name (for tokenizer selection)
+        overlap: Tokens repeated at the start of the next piece
+        respect_sentences: End pieces (and start overlaps) at sentence
+                           boundaries where possible
 
     Returns:
-        List of embedding vectors
-    """
-    try:
-        from openai import AzureOpenAI
-        import os
+        List[str]: The pieces, in order
 
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
+    Raises:
+        ValueError: If overlap is not smaller than max_tokens
+
+    Example:
+        >>> chunks = split_by_tokens(document, 500, overlap=50, respect_sentences=True)
+    """
+    if overlap >= max_tokens:
+        raise ValueError(
+            f"overlap ({overlap}) must be smaller than max_tokens ({max_tokens})"
+        )
+
+    import bisect
+
+    encoding = _get_encoding(_encoding_name(model))
+    tokens = encoding.encode_ordinary(text)
+    if not tokens:
+        return []
+
+    token_bytes = encoding.decode_tokens_bytes(tokens)
+    ends = _sentence_ends(token_bytes) if respect_sentences else []
+    total = len(tokens)
+    pieces = []
+    start = 0
+
+    while True:
+        end = min(start + max_tokens, total)
+        if end < total:
+            if ends:
+                index = bisect.bisect_right(ends, end) - 1
+                if index >= 0 and ends[index] > start + overlap:
+                    end = ends[index]
+            end = _char_boundary(token_bytes, end, start)
+
+        pieces.append(_decode_span(token_bytes, start, end))
+        if end >= total:
+            break
+
+        next_start = end - overlap
+        if overlap and ends:
+            # Start the overlap at a sentence start inside the window
+            index = bisect.bisect_left(ends, next_start)
+            if index < len(ends) and ends[index] < end:
+                next_start = ends[index]
+        next_start = max(next_start, start + 1)
+        while (
+            next_start < end
+            and token_bytes[next_start][:1]
+            and (token_bytes[next_start][0] & 0xC0 == 0x80)
+        ):
+            next_start += 1
+        start = next_start
+
+    return pieces
+
+
+# ==================== Streaming Early Termination ====================
+
+# Predicates are called with the text so far after every chunk. The built-in
+# ones remember how far they have scanned and only look at the new tail, so a
+# long stream costs linear rather than quadratic time; create one per stream.
+
+
+def stop_on_regex(pattern: str, lookback: int = 1000) -> Callable[[str], bool]:
+    """
+    Stop a stream once the generated text matches a regex.
+
+    Each call rescans from the start of the last incomplete line, but at most
+    ``lookback`` characters before the new text, so matches should not span
+    several lines or be longer than ``lookback``.
+
+    Example:
+        >>> stop = stop_on_regex(r"Final answer: .+\\n")
+    """
+    import re
+
+    compiled = re.compile(pattern)
+    line_start = 0
+    scanned = 0
+
+    def predicate(text: str) -> bool:
+        nonlocal line_start, scanned
+
+        start = max(line_start, scanned - lookback)
+        if compiled.search(text, start) is not None:
+            return True
+        line_start = text.rfind("\n", scanned) + 1 or line_start
+        scanned = len(text)
+        return False
+
+    return predicate
+
+
+def stop_on_json_object() -> Callable[[str], bool]:
+    """
+    Stop a stream once the first top-level JSON object is closed.
+
+    The returned predicate scans incrementally, so create a new one per stream.
+
+    Example:
+        >>> for chunk in stream_local_llm(prompt, stop_when=stop_on_json_object()):
+        ...     print(chunk, end="")
+    """
+    position = 0
+    depth = 0
+    started = False
+    in_string = False
+    escaped = False
+
+    def predicate(text: str) -> bool:
+        nonlocal position, depth, started, in_string, escaped
+
+        for char in text[position:]:
+            position += 1
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"' and started:
+                in_string = True
+            elif char == "{":
+                depth += 1
+                started = True
+            elif char == "}" and started:
+                depth -= 1
+                if depth == 0:
+                    return True
+
+        return False
+
+    return predicate
+
+
+def stop_on_sections(count: int, marker: str = "## ") -> Callable[[str], bool]:
+    """
+    Stop a stream once ``count`` sections are complete.
+
+    A section is complete when the next line starting with ``marker`` begins,
+    so the last yielded chunk may contain the start of that next heading.
+
+    Example:
+        >>> # Only Strengths and Weaknesses of a SWOT analysis
+        >>> stop = stop_on_sections(2)
+    """
+    import re
+
+    heading = re.compile(r"(?m)^" + re.escape(marker))
+    complete = 0
+    line_start = 0
+    scanned = 0
+
+    def predicate(text: str) -> bool:
+        nonlocal complete, line_start, scanned
+
+        # Count headings on newly completed lines once; the last, incomplete
+        # line is checked again on the next call
+        last_line = text.rfind("\n", scanned) + 1 or line_start
+        complete += len(heading.findall(text, line_start, last_line))
+        line_start = last_line
+        scanned = len(text)
+        return complete + text.startswith(marker, last_line) > count
+
+    return predicate
+
+
+def _stream_until(
+    chunks,
+    stop_when: Optional[Callable[[str], bool]] = None,
+    max_tokens: Optional[int] = None,
+    stats: Optional[Dict] = None,
+):
+    """
+    Yield text chunks until ``stop_when`` returns True for the text so far.
+
+    Stopping returns from the generator, which lets the caller close the
+    underlying HTTP stream so no further tokens are generated or billed.
+    ``stats`` (if given) is filled with ``output_tokens`` (one per chunk),
+    ``stopped_early`` and ``tokens_saved`` (relative to ``max_tokens``).
+    """
+    text = ""
+    emitted = 0
+    stopped = False
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            # CPython extends a string in place when it holds the only
+            # reference, so the running text is not rebuilt per chunk
+            text += chunk
+            emitted += 1
+            yield chunk
+
+            if stop_when is not None and stop_when(text):
+                stopped = True
+                break
+    finally:
+        if stats is not None:
+            stats["output_tokens"] = emitted
+            stats["stopped_early"] = stopped
+            stats["tokens_saved"] = (
+                max(0, max_tokens - emitted) if stopped and max_tokens else 0
+            )
+
+
+# ==================== Local LLM (Ollama) Support ====================
+
+
+def _ollama_base_url() -> str:
+    """Return the Ollama server URL from the environment."""
+    import os
+
+    return os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+
+def _ollama_options(
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    options: Optional[Dict] = None,
+) -> Dict:
+    """Build the Ollama ``options`` dict without mutating the caller's copy."""
+    merged = dict(options or {})
+
+    if temperature is not None:
+        merged["temperature"] = temperature
+    if max_tokens:
+        merged["num_predict"] = max_tokens
+
+    return merged
+
+
+# num_ctx values are rounded up to these sizes so that nearby prompt lengths
+# share one KV cache allocation instead of forcing a model reload each call
+OLLAMA_NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+def size_num_ctx(
+    prompt_tokens: int,
+    max_tokens: Optional[int] = None,
+    cap: Optional[int] = None,
+    model: str = "llama2:7b",
+) -> int:
+    """
+    Choose an Ollama ``num_ctx`` large enough for the prompt and the completion.
+
+    Prompt sizes are estimates (see estimate_tokens), so the prompt is padded
+    to the upper error bound of the model's tokenizer family in
+    ``TOKEN_ESTIMATOR_FAMILIES``. The requirement is rounded up to the next
+    entry of ``OLLAMA_NUM_CTX_BUCKETS``
+    and limited to ``cap`` (default: ``OLLAMA_MAX_NUM_CTX`` env var, else 32768).
+    A warning is logged when the request does not fit under the cap, since
+    Ollama silently truncates the prompt in that case.
+
+    Args:
+        prompt_tokens: Number of tokens in the prompt
+        max_tokens: Maximum tokens to generate
+        cap: Largest num_ctx allowed
+        model: Model name (selects the estimator error bound)
+
+    Returns:
+        int: num_ctx value to send
+
+    Example:
+        >>> size_num_ctx(2500, 500)
+        4096
+    """
+    import os
+
+    if cap is None:
+        cap = int(os.getenv("OLLAMA_MAX_NUM_CTX", "32768"))
+
+    error = TOKEN_ESTIMATOR_FAMILIES[token_family(model)]["error"]
+    needed = _token_bounds(prompt_tokens, error)["high"] + (max_tokens or 0)
+
+    for bucket in OLLAMA_NUM_CTX_BUCKETS:
+        if bucket > cap:
+            break
+        if bucket >= needed:
+            return bucket
+
+    if needed > cap:
+        logger.warning(
+            "Request needs ~%d context tokens but num_ctx is capped at %d; "
+            "Ollama will truncate the prompt",
+            needed,
+            cap,
+        )
+
+    return cap
+
+
+def _without_num_ctx(arguments: Dict) -> Dict:
+    """Drop num_ctx from cassette keys; it depends on the local tokenizer setup."""
+    payload = dict(arguments.get("payload", {}))
+    payload["options"] = {
+        k: v for k, v in payload.get("options", {}).items() if k != "num_ctx"
+    }
+    return {**arguments, "payload": payload}
+
+
+@recordable("ollama_post", exclude=("timeout",), normalize=_without_num_ctx)
+def _ollama_post(endpoint: str, payload: Dict, timeout: int = 120) -> Dict:
+    """POST a JSON payload to an Ollama endpoint and return the decoded body."""
+    import requests
+
+    with trace_span("ollama.http", endpoint=endpoint) as span:
+        response = requests.post(
+            f"{_ollama_base_url()}{endpoint}", json=payload, timeout=timeout
+        )
+        span.set_attribute("status_code", response.status_code)
+        span.set_attribute("ttfb_ms", response.elapsed.total_seconds() * 1000)
+        response.raise_for_status()
+
+    with trace_span("ollama.parse") as span:
+        data = response.json()
+        span.set_attribute("prompt_eval_count", data.get("prompt_eval_count"))
+        span.set_attribute("eval_count", data.get("eval_count"))
+
+    return data
+
+
+def _sdk_create(span_prefix: str, resource, **params):
+    """
+    Call an OpenAI/Anthropic SDK resource's create() with http and parse child spans.
+
+    While tracing is on, the SDK's streaming-response wrapper is used so the
+    ``<prefix>.http`` span ends when the response headers arrive (its
+    ``ttfb_ms``) and ``<prefix>.parse`` covers reading and decoding the body,
+    matching the spans of _ollama_post.
+    """
+    import contextlib
+
+    if not tracing_enabled():
+        return resource.create(**params)
+
+    with contextlib.ExitStack() as stack:
+        with trace_span(f"{span_prefix}.http") as span:
+            start = time.perf_counter()
+            response = stack.enter_context(
+                resource.with_streaming_response.create(**params)
+            )
+            span.set_attribute("status_code", response.status_code)
+            span.set_attribute("ttfb_ms", (time.perf_counter() - start) * 1000)
+
+        with trace_span(f"{span_prefix}.parse") as span:
+            result = response.parse()
+            usage = getattr(result, "usage", None)
+            span.set_attribute(
+                "input_tokens",
+                getattr(usage, "prompt_tokens", getattr(usage, "input_tokens", None)),
+            )
+            span.set_attribute(
+                "output_tokens",
+                getattr(
+                    usage, "completion_tokens", getattr(usage, "output_tokens", None)
+                ),
+            )
+
+    return result
+
+
+@traced("llm.call_local_llm", attrs=("model",))
+def call_local_llm(
+    prompt: str,
+    model: str = "llama2:7b",
+    temperature: float = 0.7,
+    max_tokens: int = 500,
+    options: Optional[Dict] = None,
+) -> str:
+    """
+    Call local LLM via Ollama.
+
+    Args:
+        prompt: The prompt text
+        model: Ollama model name
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens to generate
+        options: Additional Ollama options
+
+    Returns:
+        str: Generated text
+
+    Example:
+        >>> response = call_local_llm("Explain AI", model="llama2:7b")
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": False,
+        "options": _ollama_options(temperature, max_tokens, options),
+    }
+    payload["options"].setdefault(
+        "num_ctx", size_num_ctx(estimate_tokens(prompt, model), max_tokens, model=model)
+    )
+
+    try:
+        return _ollama_post("/api/generate", payload).get("response", "")
+    except Exception as e:
+        return f"Error calling local LLM: {str(e)}"
+
+
+def _chat_prompt_tokens(messages: List[Dict], model: str = "llama2:7b") -> int:
+    """Approximate prompt tokens for a chat request, including per-message overhead."""
+    return sum(estimate_tokens(m.get("content", ""), model) + 4 for m in messages)
+
+
+@traced("llm.chat_local_llm", attrs=("model",))
+def chat_local_llm(
+    messages: List[Dict],
+    model: str = "llama2:7b",
+    temperature: float = 0.7,
+    max_tokens: int = 500,
+    options: Optional[Dict] = None,
+) -> str:
+    """
+    Chat with local LLM using message format.
+
+    Args:
+        messages: List of message dicts with 'role' and 'content'
+        model: Ollama model name
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens to generate
+        options: Additional Ollama options
+
+    Returns:
+        str: Assistant response
+
+    Example:
+        >>> messages = [
+        ...     {"role": "user", "content": "Hello!"}
+        ... ]
+        >>> response = chat_local_llm(messages)
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "options": _ollama_options(temperature, max_tokens, options),
+    }
+    payload["options"].setdefault(
+        "num_ctx",
+        size_num_ctx(_chat_prompt_tokens(messages, model), max_tokens, model=model),
+    )
+
+    try:
+        return _ollama_post("/api/chat", payload).get("message", {}).get("content", "")
+    except Exception as e:
+        return f"Error calling local LLM: {str(e)}"
+
+
+class LocalLLMSession:
+    """
+    Stateful multi-turn conversation with a local Ollama model.
+
+    Each turn sends only the new prompt to ``/api/generate`` together with the
+    ``context`` token array returned by the previous turn, so earlier turns are
+    not prefilled again. If the server stops returning ``context`` or the
+    generate call fails, the session switches to ``/api/chat`` and resends the
+    full message history from then on.
+
+    Attributes:
+        context (List[int]): Token context returned by the last generate call
+        messages (List[Dict]): Conversation history in chat format
+        turns (List[Dict]): Per-turn stats, including ``prefill_tokens_saved``
+
+    Example:
+        >>> session = LocalLLMSession(system="You are a strategy consultant")
+        >>> session.send("Summarize Porter's five forces")
+        >>> session.send("Apply them to cloud computing")
+        >>> session.turns[-1]["prefill_tokens_saved"]
+    """
+
+    def __init__(
+        self,
+        model: str = "llama2:7b",
+        system: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 500,
+        options: Optional[Dict] = None,
+        use_context: bool = True,
+    ):
+        self.model = model
+        self.system = system
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.options = options or {}
+        self.use_context = use_context
+        self.reset()
+
+    def reset(self):
+        """Forget the conversation so far."""
+        self.context: Optional[List[int]] = None
+        self.messages: List[Dict] = []
+        self.turns: List[Dict] = []
+
+        if self.system:
+            self.messages.append(format_chat_message("system", self.system))
+
+    @property
+    def prefill_tokens_saved(self) -> int:
+        """Total prompt tokens the server did not have to re-process."""
+        return sum(turn["prefill_tokens_saved"] for turn in self.turns)
+
+    def _generate(self, prompt: str) -> Optional[Dict]:
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "options": _ollama_options(self.temperature, self.max_tokens, self.options),
+        }
+        if self.context:
+            payload["context"] = self.context
+        elif self.system:
+            payload["system"] = self.system
+
+        prompt_tokens = len(self.context or []) + estimate_tokens(prompt, self.model)
+        if not self.context and self.system:
+            prompt_tokens += estimate_tokens(self.system, self.model)
+        payload["options"].setdefault(
+            "num_ctx", size_num_ctx(prompt_tokens, self.max_tokens, model=self.model)
+        )
+
+        try:
+            return _ollama_post("/api/generate", payload)
+        except Exception:
+            return None
+
+    def _chat(self) -> Dict:
+        payload = {
+            "model": self.model,
+            "messages": self.messages,
+            "stream": False,
+            "options": _ollama_options(self.temperature, self.max_tokens, self.options),
+        }
+        payload["options"].setdefault(
+            "num_ctx",
+            size_num_ctx(
+                _chat_prompt_tokens(self.messages, self.model),
+                self.max_tokens,
+                model=self.model,
+            ),
+        )
+        return _ollama_post("/api/chat", payload)
+
+    @traced("llm.local_session_send")
+    def send(self, prompt: str) -> str:
+        """
+        Send the next user turn and return the assistant response.
+
+        Args:
+            prompt: The new user message (previous turns are not repeated)
+
+        Returns:
+            str: Assistant response
+        """
+        self.messages.append(format_chat_message("user", prompt))
+
+        data = None
+        saved = 0
+        if self.use_context:
+            saved = len(self.context) if self.context else 0
+            data = self._generate(prompt)
+
+        if data is not None:
+            endpoint = "generate"
+            content = data.get("response", "")
+            self.context = data.get("context")
+            if self.context is None:
+                self.use_context = False
+        else:
+            endpoint = "chat"
+            saved = 0
+            try:
+                data = self._chat()
+            except Exception as e:
+                self.messages.pop()
+                return f"Error calling local LLM: {str(e)}"
+            content = data.get("message", {}).get("content", "")
+            # The generate context (if any) no longer covers this turn
+            self.use_context = False
+            self.context = None
+
+        self.messages.append(format_chat_message("assistant", content))
+        self.turns.append(
+            {
+                "turn": len(self.turns) + 1,
+                "endpoint": endpoint,
+                "prompt_eval_count": data.get("prompt_eval_count", 0),
+                "eval_count": data.get("eval_count", 0),
+                "prefill_tokens_saved": saved,
+            }
+        )
+
+        return content
+
+
+@recordable("ollama_stream")
+def _ollama_stream(prompt: str, model: str, max_tokens: Optional[int] = None):
+    """Yield the raw response chunks of a streaming Ollama generate request."""
+    import requests
+    import json
+
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    if max_tokens:
+        payload["options"] = {"num_predict": max_tokens}
+
+    response = requests.post(
+        f"{_ollama_base_url()}/api/generate", json=payload, stream=True, timeout=120
+    )
+    try:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line).get("response", "")
+    finally:
+        response.close()
+
+
+@traced("llm.stream_local_llm", attrs=("model",))
+def stream_local_llm(
+    prompt: str,
+    model: str = "llama2:7b",
+    max_tokens: Optional[int] = None,
+    stop_when: Optional[Callable[[str], bool]] = None,
+    stats: Optional[Dict] = None,
+):
+    """
+    Stream responses from local LLM.
+
+    Args:
+        prompt: The prompt text
+        model: Ollama model name
+        max_tokens: Maximum tokens to generate
+        stop_when: Predicate on the text so far; the stream is closed as soon
+                   as it returns True (see stop_on_regex, stop_on_json_object,
+                   stop_on_sections)
+        stats: Optional dict filled with output_tokens, stopped_early and tokens_saved
+
+    Yields:
+        str: Text chunks
+
+    Example:
+        >>> for chunk in stream_local_llm("Write a story"):
+        ...     print(chunk, end='')
+    """
+    try:
+        chunks = _ollama_stream(prompt, model, max_tokens)
+        try:
+            yield from _stream_until(chunks, stop_when, max_tokens, stats)
+        finally:
+            # Closes the HTTP stream so no further tokens are generated
+            chunks.close()
+    except Exception as e:
+        yield f"Error: {str(e)}"
+
+
+# ==================== Azure OpenAI Support ====================
+
+
+@traced("llm.call_azure_openai", attrs=("deployment",))
+@recordable("call_azure_openai")
+def call_azure_openai(
+    prompt: str,
+    deployment: str = "gpt-4",
+    temperature: float = 0.7,
+    max_tokens: int = 500,
+) -> str:
+    """
+    Call Azure OpenAI Service.
+
+    Args:
+        prompt: The prompt text
+        deployment: Azure deployment name
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens to generate
+
+    Returns:
+        str: Generated text
+
+    Example:
+        >>> response = call_azure_openai("Explain AI", deployment="gpt-4")
+    """
+    try:
+        from openai import AzureOpenAI
+        import os
+
+        client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
             api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
             azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
         )
 
-        response = client.embeddings.create(model=deployment, input=texts)
+        response = _sdk_create(
+            "azure",
+            client.chat.completions,
+            model=deployment,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"Error calling Azure OpenAI: {str(e)}"
+
+
+@traced("llm.chat_azure_openai", attrs=("deployment",))
+@recordable("chat_azure_openai")
+def chat_azure_openai(
+    messages: List[Dict],
+    deployment: str = "gpt-4",
+    temperature: float = 0.7,
+    max_tokens: int = 500,
+) -> str:
+    """
+    Chat with Azure OpenAI using message format.
+
+    Args:
+        messages: List of message dicts
+        deployment: Azure deployment name
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens
+
+    Returns:
+        str: Assistant response
+    """
+    try:
+        from openai import AzureOpenAI
+        import os
+
+        client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        )
+
+        response = _sdk_create(
+            "azure",
+            client.chat.completions,
+            model=deployment,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"Error calling Azure OpenAI: {str(e)}"
+
+
+@traced("llm.get_azure_embeddings", attrs=("deployment",))
+@recordable("get_azure_embeddings")
+def get_azure_embeddings(
+    texts: List[str], deployment: str = "text-embedding-ada-002"
+) -> List[List[float]]:
+    """
+    Get embeddings from Azure OpenAI.
+
+    Args:
+        texts: List of texts to embed
+        deployment: Azure embedding deployment name
+
+    Returns:
+        List of embedding vectors
+    """
+    try:
+        from openai import AzureOpenAI
+        import os
+
+        client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        )
+
+        response = _sdk_create(
+            "azure", client.embeddings, model=deployment, input=texts
+        )
+
+        return [item.embedding for item in response.data]
+    except Exception as e:
+        print(f"Error getting embeddings: {str(e)}")
+        return []
+
+
+@recordable("azure_openai_stream")
+def _azure_openai_stream(
+    prompt: str, deployment: str, max_tokens: Optional[int] = None
+):
+    """Yield the raw content chunks of a streaming Azure OpenAI completion."""
+    from openai import AzureOpenAI
+    import os
+
+    client = AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    )
+
+    options = {"max_tokens": max_tokens} if max_tokens else {}
+    stream = client.chat.completions.create(
+        model=deployment,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        **options,
+    )
+
+    try:
+        for chunk in stream:
+            # Azure sends content-filter chunks with no choices
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.response.close()
+
+
+@traced("llm.stream_azure_openai", attrs=("deployment",))
+def stream_azure_openai(
+    prompt: str,
+    deployment: str = "gpt-4",
+    max_tokens: Optional[int] = None,
+    stop_when: Optional[Callable[[str], bool]] = None,
+    stats: Optional[Dict] = None,
+):
+    """
+    Stream responses from Azure OpenAI.
+
+    Args:
+        prompt: The prompt text
+        deployment: Azure deployment name
+        max_tokens: Maximum tokens to generate
+        stop_when: Predicate on the text so far; the stream is closed as soon
+                   as it returns True
+        stats: Optional dict filled with output_tokens, stopped_early and tokens_saved
+
+    Yields:
+        str: Text chunks
+    """
+    try:
+        chunks = _azure_openai_stream(prompt, deployment, max_tokens)
+        try:
+            yield from _stream_until(chunks, stop_when, max_tokens, stats)
+        finally:
+            chunks.close()
+    except Exception as e:
+        yield f"Error: {str(e)}"
+
+
+# ==================== Local Embeddings ====================
+
+
+def _as_float32(vectors):
+    """Convert a list of embedding vectors to a float32 matrix."""
+    import numpy as np
 
-        return [item.embedding for item in response.data]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+@traced("llm.get_local_embeddings", attrs=("model", "batch_size"))
+def get_local_embeddings(
+    texts: List[str],
+    model: Optional[str] = None,
+    batch_size: int = 64,
+    as_array: bool = False,
+):
+    """
+    Get embeddings from a local Ollama server via ``/api/embed``.
+
+    Texts are sent ``batch_size`` at a time so large corpora do not produce
+    one huge request.
+
+    Args:
+        texts: List of texts to embed
+        model: Ollama embedding model (default: OLLAMA_EMBEDDING_MODEL env var,
+               else "nomic-embed-text")
+        batch_size: Number of texts per request
+        as_array: Return a float32 numpy array instead of lists
+
+    Returns:
+        List of embedding vectors (or an (n, dim) float32 array)
+
+    Example:
+        >>> vectors = get_local_embeddings(["refund policy", "shipping delays"])
+    """
+    import os
+
+    model = model or os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+
+    try:
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            payload = {"model": model, "input": texts[start : start + batch_size]}
+            vectors.extend(_ollama_post("/api/embed", payload).get("embeddings", []))
+
+        return _as_float32(vectors) if as_array else vectors
     except Exception as e:
         print(f"Error getting embeddings: {str(e)}")
         return []
 
 
-def stream_azure_openai(prompt: str, deployment: str = "gpt-4"):
+# Loaded SentenceTransformer models, keyed by (model name, device)
+_sentence_transformers = {}
+
+
+def _load_sentence_transformer(model: str, device: Optional[str] = None):
+    key = (model, device)
+    if key not in _sentence_transformers:
+        from sentence_transformers import SentenceTransformer
+
+        _sentence_transformers[key] = SentenceTransformer(model, device=device)
+    return _sentence_transformers[key]
+
+
+@traced("llm.get_sentence_transformer_embeddings", attrs=("model", "batch_size"))
+@recordable("get_sentence_transformer_embeddings")
+def get_sentence_transformer_embeddings(
+    texts: List[str],
+    model: Optional[str] = None,
+    batch_size: int = 32,
+    device: Optional[str] = None,
+    multi_process: bool = False,
+    num_workers: Optional[int] = None,
+    normalize: bool = False,
+    as_array: bool = False,
+):
     """
-    Stream responses from Azure OpenAI.
+    Get embeddings in-process with sentence-transformers (no server needed).
+
+    The model is loaded once per process and reused. With ``multi_process=True``
+    the texts are encoded by a pool of CPU worker processes, which pays off for
+    thousands of texts but is slower than a single process for small inputs.
 
     Args:
-        prompt: The prompt text
-        deployment: Azure deployment name
+        texts: List of texts to embed
+        model: Model name (default: SENTENCE_TRANSFORMERS_MODEL env var,
+               else "all-MiniLM-L6-v2")
+        batch_size: Texts per forward pass
+        device: Torch device ("cpu", "cuda", ...); auto-detected if None
+        multi_process: Encode with a pool of CPU processes
+        num_workers: Pool size for multi_process (default: CPU count)
+        normalize: L2-normalize the vectors (dot product == cosine)
+        as_array: Return a float32 numpy array instead of lists
 
-    Yields:
-        str: Text chunks
+    Returns:
+        List of embedding vectors (or an (n, dim) float32 array)
+
+    Example:
+        >>> vectors = get_sentence_transformer_embeddings(docs, as_array=True)
+        >>> vectors.shape
+        (1000, 384)
     """
+    import os
+    import numpy as np
+
+    model = model or os.getenv("SENTENCE_TRANSFORMERS_MODEL", "all-MiniLM-L6-v2")
+
     try:
-        from openai import AzureOpenAI
-        import os
+        encoder = _load_sentence_transformer(model, device)
+
+        if multi_process:
+            workers = num_workers or os.cpu_count() or 1
+            pool = encoder.start_multi_process_pool(target_devices=["cpu"] * workers)
+            try:
+                vectors = encoder.encode_multi_process(
+                    texts, pool, batch_size=batch_size
+                )
+            finally:
+                encoder.stop_multi_process_pool(pool)
+        else:
+            vectors = encoder.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
 
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+
+        return vectors if as_array else vectors.tolist()
+    except Exception as e:
+        print(f"Error getting embeddings: {str(e)}")
+        return []
+
+
+def get_embeddings(
+    texts: List[str],
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    as_array: bool = False,
+    **kwargs,
+):
+    """
+    Unified interface to get embeddings from any provider.
+
+    Args:
+        texts: List of texts to embed
+        provider: Embedding provider ('azure', 'ollama', 'sentence-transformers')
+                 If None, reads from EMBEDDING_PROVIDER env var
+        model: Model/deployment name (provider-specific)
+        as_array: Return a float32 numpy array instead of lists
+        **kwargs: Additional arguments for the provider (e.g. batch_size)
+
+    Returns:
+        List of embedding vectors (or an (n, dim) float32 array)
+
+    Example:
+        >>> # Fully offline
+        >>> vectors = get_embeddings(chunks, provider="sentence-transformers")
+    """
+    import os
+
+    if provider is None:
+        provider = os.getenv("EMBEDDING_PROVIDER", "azure").lower()
+
+    if provider == "ollama":
+        return get_local_embeddings(texts, model=model, as_array=as_array, **kwargs)
+
+    elif provider == "sentence-transformers":
+        return get_sentence_transformer_embeddings(
+            texts, model=model, as_array=as_array, **kwargs
         )
 
-        stream = client.chat.completions.create(
-            model=deployment,
-            messages=[{"role": "user", "content": prompt}],
-            stream=True,
+    elif provider == "azure":
+        model = model or os.getenv(
+            "AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002"
         )
+        vectors = get_azure_embeddings(texts, deployment=model)
+        return _as_float32(vectors) if as_array and vectors else vectors
 
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
-    except Exception as e:
-        yield f"Error: {str(e)}"
+    else:
+        print(f"Unknown embedding provider: {provider}")
+        return []
+
+
+# ==================== Output Length Profiles ====================
+
+# Starting max_tokens per task type, used until a template has enough history
+TASK_MAX_TOKENS = {
+    "classification": 16,
+    "short-answer": 128,
+    "extraction": 256,
+    "summary": 400,
+    "structured-output": 1000,
+    "chain-of-thought": 1200,
+    "analysis": 1200,
+    "generation": 1500,
+}
+
+
+class OutputLengthProfiles:
+    """
+    Observed completion lengths per prompt template, used to size max_tokens.
+
+    Once a template has ``min_samples`` recorded completions, its suggested
+    ``max_tokens`` is the ``percentile`` of recent output lengths times
+    ``headroom``. Outputs cut off at the limit pull the percentile up to the
+    limit, so the suggestion grows again if it was set too low.
+
+    Attributes:
+        window (int): Number of recent completions kept per template
+        percentile (float): Percentile of observed lengths to target
+        headroom (float): Multiplier applied on top of the percentile
+        min_samples (int): Completions needed before the history is trusted
+        lengths (Dict[str, deque]): Recent output token counts per template
+    """
+
+    def __init__(
+        self,
+        window: int = 200,
+        percentile: float = 95,
+        headroom: float = 1.2,
+        min_samples: int = 5,
+    ):
+        self.window = window
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.lengths: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, template: str, output_tokens: int):
+        """Record the token length of one completion for a template."""
+        with self._lock:
+            if template not in self.lengths:
+                self.lengths[template] = deque(maxlen=self.window)
+            self.lengths[template].append(output_tokens)
+
+    def suggest(
+        self,
+        template: Optional[str] = None,
+        task: Optional[str] = None,
+        default: int = 500,
+    ) -> int:
+        """
+        Suggest max_tokens for a template, falling back to the task profile.
+
+        Args:
+            template: Template name with recorded history
+            task: Task type from TASK_MAX_TOKENS (e.g. "classification")
+            default: Value used when neither is known
+
+        Returns:
+            int: Suggested max_tokens
+        """
+        with self._lock:
+            history = sorted(self.lengths.get(template, ()))
+
+        if len(history) >= self.min_samples:
+            index = min(len(history) - 1, int(len(history) * self.percentile / 100))
+            return max(16, int(history[index] * self.headroom))
+
+        return TASK_MAX_TOKENS.get(task, default)
+
+    def save(self, path: str):
+        """Save recorded lengths to a JSON file."""
+        import json
+
+        with self._lock:
+            data = {name: list(values) for name, values in self.lengths.items()}
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    def load(self, path: str):
+        """Load recorded lengths from a JSON file written by save."""
+        import json
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        for name, values in data.items():
+            for value in values:
+                self.record(name, value)
+
+    def __repr__(self) -> str:
+        return f"OutputLengthProfiles(templates={len(self.lengths)})"
+
+
+# Profiles used by call_llm when a template or task is given
+output_profiles = OutputLengthProfiles()
+
+
+def estimate_request_tokens(
+    prompt: str, template: Optional[str] = None, task: Optional[str] = None
+) -> int:
+    """
+    Estimate the total tokens a request may consume (prompt plus suggested output).
+
+    Use this as the token reservation against a tokens-per-minute budget instead
+    of a fixed worst case.
+
+    Args:
+        prompt: The prompt text
+        template: Template name with recorded history
+        task: Task type from TASK_MAX_TOKENS
+
+    Returns:
+        int: Prompt tokens plus suggested max_tokens
+    """
+    return _safe_count_tokens(prompt) + output_profiles.suggest(template, task)
 
 
 # ==================== Unified LLM Interface ====================
 
+# call_llm reports failures as strings starting with one of these
+LLM_ERROR_PREFIXES = ("Error calling ", "Unknown provider")
+
+
+def is_llm_error(text) -> bool:
+    """
+    Check whether a call_llm result is an error string rather than a completion.
+
+    Only the exact prefixes call_llm produces count, so a completion that
+    merely starts with "Error" (e.g. "Error handling in Python ...") does not.
+
+    Args:
+        text: A call_llm result
+
+    Returns:
+        bool: True for a missing result or a call_llm error string
+
+    Example:
+        >>> is_llm_error("Error calling OpenAI: rate limited")
+        True
+    """
+    return not text or (isinstance(text, str) and text.startswith(LLM_ERROR_PREFIXES))
+
+
+class _Flight:
+    """A call_llm request in progress that identical callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# In-flight coalesced requests, keyed by request fingerprint
+_inflight: Dict[str, _Flight] = {}
+_inflight_lock = threading.Lock()
+_coalescing_stats = {"upstream_calls": 0, "coalesced_calls": 0}
+
+
+def _request_key(prompt: str, provider: str, model: Optional[str], kwargs: Dict) -> str:
+    """Fingerprint a call_llm request for coalescing."""
+    import hashlib
+    import json
+
+    raw = json.dumps([prompt, provider, model, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _single_flight(key: str, fn):
+    """
+    Run fn once per key at a time; concurrent callers with the same key share the result.
+
+    Returns a (result, shared) tuple, where shared is True for callers that
+    waited on another caller's request.
+    """
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+            _coalescing_stats["upstream_calls"] += 1
+        else:
+            _coalescing_stats["coalesced_calls"] += 1
+
+    if not leader:
+        with trace_span("llm.coalesce_wait"):
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    try:
+        flight.result = fn()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        flight.done.set()
+
+    return flight.result, False
+
+
+def get_coalescing_stats() -> Dict[str, int]:
+    """
+    Report how many call_llm requests were served by another in-flight call.
+
+    Returns:
+        Dict with upstream_calls (requests sent to a provider) and
+        coalesced_calls (requests that shared an in-flight result)
+
+    Example:
+        >>> get_coalescing_stats()
+        {'upstream_calls': 3, 'coalesced_calls': 27}
+    """
+    with _inflight_lock:
+        return dict(_coalescing_stats)
+
+
+def reset_coalescing_stats():
+    """Reset the counters reported by get_coalescing_stats."""
+    with _inflight_lock:
+        for name in _coalescing_stats:
+            _coalescing_stats[name] = 0
+
 
 def call_llm(
-    prompt: str, provider: Optional[str] = None, model: Optional[str] = None, **kwargs
+    prompt: str,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    coalesce: Optional[bool] = None,
+    template: Optional[str] = None,
+    task: Optional[str] = None,
+    **kwargs,
 ) -> str:
     """
     Unified interface to call any LLM provider.
 
+    Identical deterministic requests (``temperature=0``) issued concurrently,
+    e.g. a whole class running the same notebook cell against a shared
+    deployment, are coalesced: one request goes to the provider and every
+    caller receives its result. See get_coalescing_stats for the savings.
+
     Args:
         prompt: The prompt text
         provider: LLM provider ('openai', 'azure', 'ollama', 'anthropic')
                  If None, reads from LLM_PROVIDER env var
         model: Model/deployment name (provider-specific)
+        coalesce: Share in-flight identical requests. None (default) coalesces
+                  only when temperature is 0
+        template: Prompt template name. Completion lengths are recorded per
+                  template and used to size max_tokens when it is not given
+        task: Task type from TASK_MAX_TOKENS, used to size max_tokens until
+              the template has enough history
         **kwargs: Additional arguments for the provider
 
     Returns:
@@ -533,51 +2203,397 @@ def call_llm(
         >>>
         >>> # Specify provider
         >>> response = call_llm("Explain AI", provider="ollama", model="llama2:7b")
+        >>>
+        >>> # Size max_tokens from past swot_analysis outputs
+        >>> response = call_llm(prompt, template="swot_analysis")
     """
     import os
 
     if provider is None:
         provider = os.getenv("LLM_PROVIDER", "openai").lower()
 
-    if provider == "ollama":
-        model = model or os.getenv("OLLAMA_MODEL", "llama2:7b")
-        return call_local_llm(prompt, model=model, **kwargs)
+    if "max_tokens" not in kwargs and (template or task):
+        kwargs["max_tokens"] = output_profiles.suggest(template, task)
+
+    if coalesce is None:
+        coalesce = kwargs.get("temperature") == 0
+
+    start = time.perf_counter()
+    shared = False
+
+    with trace_span(
+        "llm.call_llm", provider=provider, model=model, template=template
+    ) as span:
+        span.set_attribute("max_tokens", kwargs.get("max_tokens"))
+        if not coalesce:
+            result = _dispatch_llm(prompt, provider, model, **kwargs)
+        else:
+            key = _request_key(prompt, provider, model, kwargs)
+            result, shared = _single_flight(
+                key, lambda: _dispatch_llm(prompt, provider, model, **kwargs)
+            )
+        span.set_attribute("shared", shared)
+
+    failed = is_llm_error(result)
+
+    if metrics_enabled():
+        record_llm_request(
+            provider,
+            model,
+            template,
+            prompt,
+            result,
+            time.perf_counter() - start,
+            error=failed,
+            shared=shared,
+        )
 
-    elif provider == "azure":
+    if template and not failed:
+        output_profiles.record(template, _safe_count_tokens(result))
+
+    return result
+
+
+def _call_ollama(prompt: str, model: Optional[str] = None, **kwargs) -> str:
+    import os
+
+    model = model or os.getenv("OLLAMA_MODEL", "llama2:7b")
+    return call_local_llm(prompt, model=model, **kwargs)
+
+
+def _call_azure(prompt: str, model: Optional[str] = None, **kwargs) -> str:
+    import os
+
+    model = model or os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+    return call_azure_openai(prompt, deployment=model, **kwargs)
+
+
+@traced("llm.call_openai", attrs=("model",))
+@recordable("call_openai")
+def _call_openai(prompt: str, model: Optional[str] = None, **kwargs) -> str:
+    import os
+
+    # Use standard OpenAI client
+    try:
+        from openai import OpenAI
+
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        model = model or os.getenv("OPENAI_MODEL", "gpt-4")
+
+        response = _sdk_create(
+            "openai",
+            client.chat.completions,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            **kwargs,
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"Error calling OpenAI: {str(e)}"
+
+
+@traced("llm.call_anthropic", attrs=("model",))
+@recordable("call_anthropic")
+def _call_anthropic(prompt: str, model: Optional[str] = None, **kwargs) -> str:
+    import os
+
+    # Use Anthropic client
+    try:
+        from anthropic import Anthropic
+
+        client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        model = model or os.getenv("ANTHROPIC_MODEL", "claude-3-opus-20240229")
+
+        response = _sdk_create(
+            "anthropic",
+            client.messages,
+            model=model,
+            max_tokens=kwargs.get("max_tokens", 1024),
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return response.content[0].text
+    except Exception as e:
+        return f"Error calling Anthropic: {str(e)}"
+
+
+# Provider name -> function(prompt, model=None, **kwargs) used by call_llm
+LLM_PROVIDERS = {
+    "ollama": _call_ollama,
+    "azure": _call_azure,
+    "openai": _call_openai,
+    "anthropic": _call_anthropic,
+}
+
+
+def register_llm_provider(name: str, fn: Callable[..., str]):
+    """
+    Make a provider available to call_llm.
+
+    Args:
+        name: Provider name passed as ``call_llm(provider=...)``
+        fn: Function taking (prompt, model=None, **kwargs) and returning text
+
+    Example:
+        >>> register_llm_provider("echo", lambda prompt, model=None, **kw: prompt)
+        >>> call_llm("hi", provider="echo")
+        'hi'
+    """
+    LLM_PROVIDERS[name] = fn
+
+
+def _dispatch_llm(prompt: str, provider: str, model: Optional[str], **kwargs) -> str:
+    """Send a prompt to the provider registered under the given name."""
+    fn = LLM_PROVIDERS.get(provider)
+    if fn is None:
+        return f"Unknown provider: {provider}"
+
+    return fn(prompt, model=model, **kwargs)
+
+
+# ==================== Self-Consistency Sampling ====================
+
+# Providers whose chat completions API can return several choices per request
+_NATIVE_N_PROVIDERS = ("openai", "azure")
+
+
+def extract_answer(text: str, pattern: Optional[str] = None) -> Optional[str]:
+    """
+    Extract the final answer from a chain-of-thought completion.
+
+    Looks for (in order) a custom ``pattern``, ``\\boxed{...}``, an
+    "answer is ..." / "Answer: ..." phrase, and finally the last number in the
+    text. The result is normalized (lowercase, no trailing punctuation, no
+    thousands separators) so equivalent answers vote together.
+
+    Args:
+        text: Model output
+        pattern: Optional regex; group 1 (or the whole match) is the answer
+
+    Returns:
+        str: Normalized answer, or None if nothing answer-like was found (or
+        the text is a call_llm error string)
+
+    Example:
+        >>> extract_answer("First 12 * 3 = 36, so the answer is 36.")
+        '36'
+    """
+    import re
+
+    if is_llm_error(text):
+        return None
+
+    candidates = []
+    if pattern:
+        candidates = [
+            m.group(1) if m.groups() else m.group(0) for m in re.finditer(pattern, text)
+        ]
+    if not candidates:
+        candidates = re.findall(r"\\boxed\{([^}]*)\}", text)
+    if not candidates:
+        candidates = re.findall(
+            r"(?:final answer|answer)\s*(?:is|:)\s*\**([^\n*]+)", text, re.IGNORECASE
+        )
+    if not candidates:
+        candidates = re.findall(r"-?\$?\d[\d,]*(?:\.\d+)?%?", text)
+    if not candidates:
+        return None
+
+    answer = candidates[-1].strip().lower().rstrip(".!")
+    if re.fullmatch(r"-?\$?\d[\d,]*(?:\.\d+)?%?", answer):
+        answer = answer.replace(",", "").replace("$", "")
+
+    return answer or None
+
+
+def majority_vote(answers: List[Optional[str]]) -> Dict:
+    """
+    Pick the most common answer from a list of sampled answers.
+
+    Args:
+        answers: Extracted answers (None entries are ignored)
+
+    Returns:
+        Dict with the winning answer, its vote count, agreement ratio and all counts
+
+    Example:
+        >>> majority_vote(["36", "36", "42"])["answer"]
+        '36'
+    """
+    from collections import Counter
+
+    counts = Counter(a for a in answers if a is not None)
+    total = sum(counts.values())
+
+    if not counts:
+        return {"answer": None, "votes": 0, "total": 0, "agreement": 0.0, "counts": {}}
+
+    answer, votes = counts.most_common(1)[0]
+
+    return {
+        "answer": answer,
+        "votes": votes,
+        "total": total,
+        "agreement": votes / total,
+        "counts": dict(counts),
+    }
+
+
+def _vote_decided(counts, remaining: int) -> bool:
+    """True if the remaining samples can no longer change the leading answer."""
+    ranked = counts.most_common(2)
+    if not ranked:
+        return False
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return ranked[0][1] - runner_up > remaining
+
+
+def _samples_to_decide(counts, remaining: int) -> int:
+    """Fewest further samples after which the vote could be decided."""
+    ranked = counts.most_common(2)
+    lead = ranked[0][1] - (ranked[1][1] if len(ranked) > 1 else 0) if ranked else 0
+    # Each sample for the leader widens the lead by one and uses up one
+    # remaining sample, so k samples decide the vote once lead + k > remaining - k
+    return max(1, (remaining - lead) // 2 + 1)
+
+
+@traced("llm.sample_native", attrs=("provider", "model", "n"))
+@recordable("sample_native")
+def _sample_native(
+    prompt: str, provider: str, model: Optional[str], n: int, **kwargs
+) -> List[str]:
+    """Request n choices in a single OpenAI/Azure chat completion."""
+    import os
+
+    if provider == "azure":
+        from openai import AzureOpenAI
+
+        client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        )
         model = model or os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
-        return call_azure_openai(prompt, deployment=model, **kwargs)
+    else:
+        from openai import OpenAI
 
-    elif provider == "openai":
-        # Use standard OpenAI client
-        try:
-            from openai import OpenAI
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        model = model or os.getenv("OPENAI_MODEL", "gpt-4")
 
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            model = model or os.getenv("OPENAI_MODEL", "gpt-4")
+    response = _sdk_create(
+        provider,
+        client.chat.completions,
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        n=n,
+        **kwargs,
+    )
+    return [choice.message.content for choice in response.choices]
 
-            response = client.chat.completions.create(
-                model=model, messages=[{"role": "user", "content": prompt}], **kwargs
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Error calling OpenAI: {str(e)}"
 
-    elif provider == "anthropic":
-        # Use Anthropic client
-        try:
-            from anthropic import Anthropic
+def sample_llm(
+    prompt: str,
+    n: int = 5,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    max_workers: Optional[int] = None,
+    stop_when_decided: bool = False,
+    extract=extract_answer,
+    **kwargs,
+) -> List[str]:
+    """
+    Sample several completions for the same prompt (self-consistency prompting).
+
+    OpenAI and Azure return all ``n`` samples from one request using the native
+    ``n`` parameter. Other providers get ``n`` concurrent ``call_llm`` requests,
+    which are never coalesced, even at temperature 0.
+    With ``stop_when_decided=True`` the concurrent path submits requests in
+    waves: first a bare majority of ``n``, then only as many as are needed
+    before the remaining samples could no longer change the majority answer.
+    Fewer than ``n`` requests are made (and samples returned) when the vote is
+    decided early.
+
+    Failed requests (call_llm error strings) use up their share of ``n`` but
+    are left out of the vote and the returned samples.
 
-            client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-            model = model or os.getenv("ANTHROPIC_MODEL", "claude-3-opus-20240229")
+    Args:
+        prompt: The prompt text
+        n: Number of samples
+        provider: LLM provider (see call_llm)
+        model: Model/deployment name
+        temperature: Sampling temperature (should be > 0 for diverse samples)
+        max_workers: Concurrent requests (default: n, or a bare majority of n
+                     when stop_when_decided is set)
+        stop_when_decided: Stop early once the vote cannot change
+        extract: Function mapping a completion to its answer, used for early stopping
+        **kwargs: Additional arguments for the provider
+
+    Returns:
+        List[str]: Sampled completions, or the error strings if every request failed
+
+    Example:
+        >>> samples = sample_llm(cot_prompt, n=7, provider="ollama", stop_when_decided=True)
+        >>> majority_vote([extract_answer(s) for s in samples])
+    """
+    import os
+    from collections import Counter
+    from concurrent.futures import ThreadPoolExecutor
+
+    if provider is None:
+        provider = os.getenv("LLM_PROVIDER", "openai").lower()
 
-            response = client.messages.create(
-                model=model,
-                max_tokens=kwargs.get("max_tokens", 1024),
-                messages=[{"role": "user", "content": prompt}],
+    if provider in _NATIVE_N_PROVIDERS and n > 1:
+        try:
+            return _sample_native(
+                prompt, provider, model, n, temperature=temperature, **kwargs
             )
-            return response.content[0].text
         except Exception as e:
-            return f"Error calling Anthropic: {str(e)}"
-
-    else:
-        return f"Unknown provider: {provider}"
+            return [f"Error calling {provider}: {str(e)}"]
+
+    kwargs.pop("coalesce", None)
+
+    if max_workers is None:
+        max_workers = n // 2 + 1 if stop_when_decided else n
+    max_workers = max(1, min(max_workers, n))
+
+    samples = []
+    errors = []
+    counts = Counter()
+    remaining = n
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while remaining and not (
+            stop_when_decided and _vote_decided(counts, remaining)
+        ):
+            # A wave only asks for samples that are needed before the vote
+            # could possibly be decided, so none of them is ever wasted
+            wave = remaining
+            if stop_when_decided:
+                wave = min(_samples_to_decide(counts, remaining), remaining)
+            # Samples are deliberate repeats of one request; coalescing
+            # them would return n copies of a single completion
+            futures = [
+                pool.submit(
+                    call_llm,
+                    prompt,
+                    provider=provider,
+                    model=model,
+                    coalesce=False,
+                    temperature=temperature,
+                    **kwargs,
+                )
+                for _ in range(wave)
+            ]
+            remaining -= wave
+
+            for future in futures:
+                text = future.result()
+                if is_llm_error(text):
+                    errors.append(text)
+                    continue
+                samples.append(text)
+                answer = extract(text)
+                if answer is not None:
+                    counts[answer] += 1
+
+    return samples or errors
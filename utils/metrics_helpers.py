@@ -0,0 +1,457 @@
+"""
+Metrics Helper Functions
+
+In-process counters and histograms for LLM traffic, exposed in the
+Prometheus text format over HTTP or as a periodically written file.
+
+Updates go to a per-thread shard of each metric, guarded by a lock of its own,
+so thread-pool workers never contend with each other; a shard's lock is only
+contended while a render copies that shard, which keeps every copy (e.g. a
+histogram's buckets, sum and count) consistent. When
+a thread exits, its shard is folded into a retired total, so short-lived
+thread pools do not accumulate shards.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import os
+import threading
+import weakref
+
+# Default latency buckets in seconds (LLM calls range from ms to minutes)
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _ShardOwner:
+    """Holds a thread's shard; collected (and retired) when the thread exits."""
+
+    __slots__ = ("shard", "lock", "__weakref__")
+
+    def __init__(self):
+        self.shard: Dict = {}
+        self.lock = threading.Lock()
+
+
+class _Metric:
+    """Base class holding per-thread shards of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        # Live (shard, lock) pairs by shard id, and the merged values of exited threads
+        self._shards: Dict[int, Tuple[Dict, threading.Lock]] = {}
+        self._retired: Dict = {}
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _shard(self) -> _ShardOwner:
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards[id(owner.shard)] = (owner.shard, owner.lock)
+            # Thread-local values are released when their thread exits
+            weakref.finalize(owner, self._retire, owner.shard)
+        return owner
+
+    def _retire(self, shard: Dict):
+        with self._shards_lock:
+            self._shards.pop(id(shard), None)
+            self._merge(self._retired, shard)
+
+    def _merge(self, target: Dict, shard: Dict):
+        raise NotImplementedError
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _snapshots(self) -> List[Dict]:
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            retired: Dict = {}
+            self._merge(retired, self._retired)
+
+        snapshots = [retired]
+        for shard, lock in shards:
+            # Copy under the shard's lock so no update is seen half-applied
+            copy: Dict = {}
+            with lock:
+                self._merge(copy, shard)
+            snapshots.append(copy)
+        return snapshots
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing value per label set.
+
+    Example:
+        >>> requests = Counter("app_requests_total", "Requests", ("route",))
+        >>> requests.inc(route="/chat")
+    """
+
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        """Increase the counter for the given labels."""
+        owner = self._shard()
+        key = self._key(labels)
+        with owner.lock:
+            owner.shard[key] = owner.shard.get(key, 0) + value
+
+    def _merge(self, target: Dict, shard: Dict):
+        for key, value in shard.items():
+            target[key] = target.get(key, 0) + value
+
+    def values(self) -> Dict[Tuple, float]:
+        """Return {label values: total} merged across threads."""
+        merged: Dict[Tuple, float] = {}
+        for shard in self._snapshots():
+            self._merge(merged, shard)
+        return merged
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Bucketed observations (e.g. latency) per label set.
+
+    Example:
+        >>> latency = Histogram("app_latency_seconds", "Latency", ("route",))
+        >>> latency.observe(0.42, route="/chat")
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """Record one observation for the given labels."""
+        owner = self._shard()
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+
+        with owner.lock:
+            state = owner.shard.get(key)
+            if state is None:
+                # [per-bucket counts..., +Inf count, sum]
+                state = owner.shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def _merge(self, target: Dict, shard: Dict):
+        for key, state in shard.items():
+            state = list(state)
+            if key not in target:
+                target[key] = state
+            else:
+                target[key] = [a + b for a, b in zip(target[key], state)]
+
+    def values(self) -> Dict[Tuple, List]:
+        """Return {label values: [bucket counts..., +Inf count, sum]} merged across threads."""
+        merged: Dict[Tuple, List] = {}
+        for shard in self._snapshots():
+            self._merge(merged, shard)
+        return merged
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += state[len(self.buckets)]
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A named collection of metrics that can be rendered together.
+
+    Example:
+        >>> registry = MetricsRegistry()
+        >>> hits = registry.counter("cache_hits_total", "Cache hits", ("cache",))
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(
+        self, name: str, description: str, labelnames: Tuple[str, ...] = ()
+    ) -> Counter:
+        """Get or create a counter."""
+        return self._get_or_create(Counter, name, description, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self._get_or_create(Histogram, name, description, labelnames, buckets)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self) -> str:
+        return f"MetricsRegistry(metrics={len(self.metrics)})"
+
+
+# Default registry used by the LLM helpers
+registry = MetricsRegistry()
+
+_LLM_LABELS = ("provider", "model", "template")
+
+llm_requests = registry.counter("llm_requests_total", "LLM requests", _LLM_LABELS)
+llm_errors = registry.counter(
+    "llm_errors_total", "LLM requests that returned an error", _LLM_LABELS
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Prompt and completion tokens", _LLM_LABELS + ("direction",)
+)
+llm_cost = registry.counter(
+    "llm_cost_usd_total", "Estimated LLM cost in USD", _LLM_LABELS
+)
+llm_cache_hits = registry.counter(
+    "llm_cache_hits_total", "Requests served by a shared in-flight call", _LLM_LABELS
+)
+llm_latency = registry.histogram(
+    "llm_request_latency_seconds", "End-to-end call_llm latency", _LLM_LABELS
+)
+
+# LLM traffic is recorded only once metrics are enabled (token counting is not free)
+_enabled = os.getenv("LLM_METRICS", "0") == "1"
+
+
+def enable_metrics(enabled: bool = True):
+    """Turn recording of LLM traffic metrics on or off."""
+    global _enabled
+    _enabled = enabled
+
+
+def metrics_enabled() -> bool:
+    """Return True if LLM traffic is being recorded."""
+    return _enabled
+
+
+def record_llm_request(
+    provider: str,
+    model: Optional[str],
+    template: Optional[str],
+    prompt: str,
+    response: str,
+    latency: float,
+    error: bool = False,
+    shared: bool = False,
+):
+    """
+    Record one call_llm request in the default registry.
+
+    Args:
+        provider: LLM provider
+        model: Model/deployment name
+        template: Prompt template name, if any
+        prompt: The prompt text
+        response: The response text
+        latency: End-to-end latency in seconds
+        error: Whether the call returned an error
+        shared: Whether the result came from another in-flight call
+    """
+    from .llm_helpers import _safe_count_tokens, estimate_cost
+
+    labels = {"provider": provider, "model": model or "", "template": template or ""}
+
+    llm_requests.inc(**labels)
+    llm_latency.observe(latency, **labels)
+
+    if shared:
+        llm_cache_hits.inc(**labels)
+    if error:
+        llm_errors.inc(**labels)
+        return
+
+    input_tokens = _safe_count_tokens(prompt)
+    output_tokens = _safe_count_tokens(response or "")
+    llm_tokens.inc(input_tokens, direction="input", **labels)
+    llm_tokens.inc(output_tokens, direction="output", **labels)
+
+    # Shared results and local models cost nothing extra
+    if not shared and provider != "ollama":
+        cost = estimate_cost(input_tokens, output_tokens, model or "gpt-4")
+        llm_cost.inc(cost["total_cost"], **labels)
+
+
+def render_prometheus(metrics_registry: Optional[MetricsRegistry] = None) -> str:
+    """
+    Render metrics in the Prometheus text format.
+
+    Args:
+        metrics_registry: Registry to render (default: the LLM registry)
+
+    Returns:
+        str: Prometheus exposition text
+    """
+    return (metrics_registry or registry).render()
+
+
+def start_metrics_server(
+    port: int = 9464,
+    host: str = "0.0.0.0",
+    metrics_registry: Optional[MetricsRegistry] = None,
+):
+    """
+    Serve metrics at ``http://<host>:<port>/metrics`` from a background thread.
+
+    Also enables LLM traffic recording.
+
+    Args:
+        port: TCP port to listen on
+        host: Interface to bind
+        metrics_registry: Registry to serve (default: the LLM registry)
+
+    Returns:
+        The running ThreadingHTTPServer (call ``shutdown()`` to stop it)
+
+    Example:
+        >>> server = start_metrics_server(9464)
+        >>> # scrape_configs: - targets: ["jupyter:9464"]
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus(metrics_registry).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    enable_metrics()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def dump_metrics(path: str, metrics_registry: Optional[MetricsRegistry] = None) -> str:
+    """
+    Write metrics to a file atomically (for the node_exporter textfile collector).
+
+    Args:
+        path: Output path, e.g. "outputs/metrics/llm.prom"
+        metrics_registry: Registry to dump (default: the LLM registry)
+
+    Returns:
+        str: Path to the written file
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus(metrics_registry))
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def start_metrics_dump(
+    path: str,
+    interval: float = 15.0,
+    metrics_registry: Optional[MetricsRegistry] = None,
+) -> threading.Event:
+    """
+    Periodically dump metrics to a file from a background thread.
+
+    Also enables LLM traffic recording.
+
+    Args:
+        path: Output path
+        interval: Seconds between dumps
+        metrics_registry: Registry to dump (default: the LLM registry)
+
+    Returns:
+        threading.Event: Set it to stop dumping
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                dump_metrics(path, metrics_registry)
+            except Exception as e:
+                print(f"Error dumping metrics: {str(e)}")
+        dump_metrics(path, metrics_registry)
+
+    enable_metrics()
+    threading.Thread(target=loop, daemon=True).start()
+
+    return stop
@@ -0,0 +1,403 @@
+"""
+Tracing Helper Functions
+
+Lightweight spans around LLM provider calls, with pluggable exporters
+(console, JSONL file, and OpenTelemetry when it is installed).
+
+Tracing is off until an exporter is added. While it is off, ``trace_span``
+returns a shared no-op span and ``traced`` functions run unwrapped, so the
+instrumentation in the other helper modules costs next to nothing.
+"""
+
+from typing import Dict, List, Optional
+import functools
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+# Registered exporters; tracing is enabled while this list is non-empty
+_exporters: List = []
+_exporters_lock = threading.Lock()
+
+# Per-thread stack of open spans, used to link children to parents
+_local = threading.local()
+
+_ids = itertools.count(1)
+
+
+class Span:
+    """
+    A timed operation with attributes and point-in-time events.
+
+    Attributes:
+        name (str): Operation name (e.g. "ollama.http")
+        attributes (Dict): Key/value details (provider, model, tokens, ...)
+        events (List[Dict]): Named events with their offset from the span start
+        span_id (int): Unique span ID within the process
+        parent_id (int): ID of the enclosing span on the same thread, if any
+        trace_id (int): ID of the outermost span on the same thread
+        start_time (float): Wall-clock start (epoch seconds)
+        duration (float): Duration in seconds (set when the span ends)
+        error (str): Exception message if the span ended with an error
+    """
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.events: List[Dict] = []
+        self.span_id = next(_ids)
+        self.parent_id = None
+        self.trace_id = self.span_id
+        self.start_time = None
+        self.duration = None
+        self.error = None
+        self._start = None
+
+    def set_attribute(self, key: str, value):
+        """Set one attribute on the span."""
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        """Record a named event at the current time."""
+        offset = time.perf_counter() - self._start if self._start else 0.0
+        self.events.append({"name": name, "offset": offset, "attributes": attributes})
+
+    def __enter__(self) -> "Span":
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.parent_id = stack[-1].span_id
+            self.trace_id = stack[-1].trace_id
+        stack.append(self)
+
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+
+        for exporter in list(_exporters):
+            on_start = getattr(exporter, "on_start", None)
+            if on_start is not None:
+                _safe_export(on_start, self)
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.error = f"{exc_type.__name__}: {exc}"
+
+        # Generator spans can close out of order (or on another thread)
+        stack = getattr(_local, "stack", [])
+        if self in stack:
+            stack.remove(self)
+
+        for exporter in list(_exporters):
+            _safe_export(exporter.export, self)
+
+        return False
+
+    def to_dict(self) -> Dict:
+        """Convert the span to a JSON-serializable dict."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "attributes": self.attributes,
+            "events": [
+                {
+                    "name": e["name"],
+                    "offset_ms": round(e["offset"] * 1000, 3),
+                    "attributes": e["attributes"],
+                }
+                for e in self.events
+            ],
+            "error": self.error,
+        }
+
+    def __repr__(self) -> str:
+        return f"Span(name='{self.name}', span_id={self.span_id})"
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is disabled."""
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _safe_export(fn, span: Span):
+    """Call an exporter hook; tracing must never break the traced call."""
+    try:
+        fn(span)
+    except Exception as e:
+        print(f"Error exporting span {span.name}: {str(e)}", file=sys.stderr)
+
+
+def tracing_enabled() -> bool:
+    """Return True if at least one exporter is registered."""
+    return bool(_exporters)
+
+
+def trace_span(name: str, **attributes):
+    """
+    Open a span around a block of code.
+
+    Args:
+        name: Operation name
+        **attributes: Initial span attributes
+
+    Returns:
+        Context manager yielding the span (a no-op span while tracing is off)
+
+    Example:
+        >>> with trace_span("rag.retrieve", k=5) as span:
+        ...     docs = retrieve(query)
+        ...     span.set_attribute("hits", len(docs))
+    """
+    if not _exporters:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def traced(name: str, attrs: tuple = ()):
+    """
+    Decorator that wraps every call of a function in a span.
+
+    Generator functions get one span covering the whole iteration, with a
+    ``first_chunk`` event (time to first token) and a ``chunks`` attribute.
+
+    Args:
+        name: Span name
+        attrs: Argument names copied into span attributes (e.g. ("model",))
+
+    Example:
+        >>> @traced("search.query", attrs=("index",))
+        ... def query(text, index="default"):
+        ...     ...
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def attributes(args, kwargs) -> Dict:
+            if not attrs:
+                return {}
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            return {a: bound.arguments.get(a) for a in attrs}
+
+        if inspect.isgeneratorfunction(fn):
+
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not _exporters:
+                    yield from fn(*args, **kwargs)
+                    return
+
+                with Span(name, attributes(args, kwargs)) as span:
+                    chunks = 0
+                    inner = fn(*args, **kwargs)
+                    try:
+                        for chunk in inner:
+                            if chunks == 0:
+                                span.add_event("first_chunk")
+                            chunks += 1
+                            yield chunk
+                    finally:
+                        inner.close()
+                        span.set_attribute("chunks", chunks)
+
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _exporters:
+                return fn(*args, **kwargs)
+
+            with Span(name, attributes(args, kwargs)):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ==================== Exporters ====================
+
+
+class ConsoleExporter:
+    """
+    Print finished spans, indented by nesting depth.
+
+    Example:
+        >>> add_span_exporter(ConsoleExporter())
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def export(self, span: Span):
+        # The span has already been popped, so the stack holds its ancestors
+        depth = len(getattr(_local, "stack", []))
+        details = " ".join(f"{k}={v}" for k, v in span.attributes.items())
+        events = " ".join(
+            f"{e['name']}@{e['offset'] * 1000:.1f}ms" for e in span.events
+        )
+        status = f" ERROR {span.error}" if span.error else ""
+        print(
+            f"[trace] {'  ' * depth}{span.name} {span.duration * 1000:.1f}ms "
+            f"{details} {events}{status}".rstrip(),
+            file=self.stream or sys.stdout,
+        )
+
+
+class JsonlExporter:
+    """
+    Append finished spans to a JSONL file, one span per line.
+
+    Example:
+        >>> add_span_exporter(JsonlExporter("outputs/traces.jsonl"))
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    """
+    Mirror spans into OpenTelemetry (requires ``opentelemetry-api``).
+
+    Configure the OpenTelemetry SDK (tracer provider and exporter) as usual;
+    this class only creates the OpenTelemetry spans.
+
+    Raises:
+        ImportError: If opentelemetry is not installed
+    """
+
+    def __init__(self, tracer_name: str = "utils.llm_helpers"):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+        self._open: Dict[int, object] = {}
+
+    def on_start(self, span: Span):
+        parent = self._open.get(span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent else None
+        self._open[span.span_id] = self.tracer.start_span(
+            span.name, context=context, start_time=int(span.start_time * 1e9)
+        )
+
+    def export(self, span: Span):
+        otel_span = self._open.pop(span.span_id, None)
+        if otel_span is None:
+            return
+
+        for key, value in span.attributes.items():
+            if value is not None:
+                otel_span.set_attribute(
+                    key,
+                    value if isinstance(value, (str, bool, int, float)) else str(value),
+                )
+        for event in span.events:
+            timestamp = int((span.start_time + event["offset"]) * 1e9)
+            otel_span.add_event(event["name"], event["attributes"], timestamp=timestamp)
+        if span.error:
+            otel_span.set_status(
+                self._trace.Status(self._trace.StatusCode.ERROR, span.error)
+            )
+
+        otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+
+# ==================== Configuration ====================
+
+
+def add_span_exporter(exporter):
+    """Register an exporter (any object with an ``export(span)`` method)."""
+    with _exporters_lock:
+        _exporters.append(exporter)
+
+
+def remove_span_exporter(exporter):
+    """Unregister a previously added exporter."""
+    with _exporters_lock:
+        if exporter in _exporters:
+            _exporters.remove(exporter)
+
+
+def clear_span_exporters():
+    """Remove all exporters, disabling tracing."""
+    with _exporters_lock:
+        _exporters.clear()
+
+
+def configure_tracing(spec: Optional[str] = None) -> List:
+    """
+    Add exporters from a comma-separated spec (default: LLM_TRACE env var).
+
+    Supported entries: ``console``, ``jsonl:<path>``, ``otel``.
+
+    Args:
+        spec: Exporter spec, e.g. "console,jsonl:outputs/traces.jsonl"
+
+    Returns:
+        List of exporters that were added
+
+    Example:
+        >>> configure_tracing("jsonl:outputs/traces.jsonl")
+    """
+    spec = spec if spec is not None else os.getenv("LLM_TRACE", "")
+    added = []
+
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        if entry == "console":
+            exporter = ConsoleExporter()
+        elif entry.startswith("jsonl:"):
+            exporter = JsonlExporter(entry[len("jsonl:") :])
+        elif entry == "otel":
+            try:
+                exporter = OpenTelemetryExporter()
+            except ImportError:
+                print("Error configuring tracing: opentelemetry is not installed")
+                continue
+        else:
+            print(f"Unknown trace exporter: {entry}")
+            continue
+
+        add_span_exporter(exporter)
+        added.append(exporter)
+
+    return added
+
+
+configure_tracing()